@@ -5,16 +5,34 @@ This program collects N1MM+ "Contact Info" broadcasts and saves data from the br
 in database tables.
 """
 
+import argparse
+import asyncio
+import calendar
+import collections
+import datetime
 import hashlib
+import ipaddress
 import logging
 import multiprocessing
+import os
+import pickle
+import queue
+import re
+import signal
 import socket
 import sqlite3
+import struct
+import sys
+import threading
 import time
 import xml.parsers.expat
+import zlib
 
 from config import Config
+import constants
 import dataaccess
+import journal
+import metrics
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016, 2017, 2019, 2024 Jeffrey B. Otterson'
@@ -22,6 +40,60 @@ __license__ = 'Simplified BSD'
 
 config = Config()
 BROADCAST_BUF_SIZE = 2048
+WORKER_REPORT_INTERVAL = 60  # seconds between receive worker throughput reports
+SHUTDOWN_DRAIN_TIME = 4  # seconds the receivers wait at shutdown for held messages to reach the queue
+BACKLOG_SIZE = 1000  # messages held by the receiver when the queue is full and OVERFLOW_POLICY is drop
+REBUILD_BATCH_SIZE = 5000  # messages per transaction when rebuilding from the journal
+RETRY_INTERVAL = 1.0  # seconds between tries to write again the messages of a batch that was rolled back
+JOURNAL_CHECKPOINT_INTERVAL = 60  # seconds between journal checkpoints
+JOURNAL_CHECKPOINT_MARGIN = 5.0  # seconds a datagram may take from the journal to the message queue
+# IP_PKTINFO is not exported by the socket module before python 3.12, 8 is the linux value.
+IP_PKTINFO = getattr(socket, 'IP_PKTINFO', 8)
+SIOCGIFBRDADDR = 0x8919  # linux ioctl to get an interface's broadcast address
+LIMITED_BROADCAST = b'\xff\xff\xff\xff'
+INTERFACE_CACHE_SECONDS = 60  # how long an interface's broadcast address is kept before it is asked again
+
+# interface index: (broadcast address, monotonic time it expires), see interface_broadcast_address
+interface_broadcast_addresses = {}
+
+# the root element of the message, skipping the <?xml ... ?> declaration
+MESSAGE_TYPE_PATTERN = re.compile(rb'<([A-Za-z]\w*)[\s/>]')
+# a leaf element with text content, <name>value</name>
+ELEMENT_PATTERN = re.compile(rb'<(\w+)>([^<]*)</\1>')
+# the elements process_message uses, by their encoded names
+DECODED_FIELDS = {name.encode(): name for name in (
+    'ID', 'timestamp', 'contestnr', 'mycall', 'band', 'mode', 'operator', 'StationName', 'NetBiosName',
+    'rxfreq', 'txfreq', 'call', 'snt', 'rcv', 'exchange1', 'section', 'comment',
+    'RadioNr', 'Freq', 'TXFreq', 'Mode', 'OpCall', 'IsRunning', 'IsTransmitting', 'IsConnected', 'score')}
+# a dynamicresults breakdown element, <qso band="total" mode="ALL">123</qso>
+BREAKDOWN_PATTERN = re.compile(rb'<(qso|mult|point)\s([^>]*)>\s*(\d+)\s*</\1>')
+BREAKDOWN_TOTAL_PATTERN = re.compile(rb'band="total"[^>]*mode="ALL"')
+
+MESSAGES = metrics.counter('n1mm_collector_messages_total', 'messages processed, by message type', ('type',))
+PARSE_ERRORS = metrics.counter('n1mm_collector_parse_errors_total', 'messages that could not be decoded')
+DUPLICATES = metrics.counter('n1mm_collector_duplicates_total', 'exact re-broadcasts dropped by the duplicate filter')
+DATAGRAMS = metrics.counter('n1mm_collector_datagrams_total', 'datagrams received')
+QUEUE_DEPTH = metrics.gauge('n1mm_collector_queue_depth', 'messages waiting in the queue to the message processor')
+HELD_MESSAGES = metrics.gauge('n1mm_collector_held_messages', 'messages held by the receiver while the queue is full')
+DROPPED_MESSAGES = metrics.counter('n1mm_collector_dropped_messages_total',
+                                   'messages dropped because the queue was full', ('type',))
+SPILLED_MESSAGES = metrics.counter('n1mm_collector_spilled_messages_total',
+                                   'messages written to the spill file because the queue was full')
+KERNEL_DROPS = metrics.gauge('n1mm_collector_kernel_drops',
+                             'datagrams the kernel dropped for the receive socket since it was opened')
+WRITE_SECONDS = metrics.histogram('n1mm_collector_write_seconds', 'time to write one message to the database')
+COMMIT_SECONDS = metrics.histogram('n1mm_collector_commit_seconds', 'time to commit a batch')
+ROLLBACKS = metrics.counter('n1mm_collector_rollbacks_total', 'batches rolled back because the database write failed')
+BATCH_MESSAGES = metrics.histogram('n1mm_collector_batch_messages', 'messages per committed batch',
+                                   buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+OPERATORS = metrics.gauge('n1mm_collector_operators', 'operators in the lookup cache')
+STATIONS = metrics.gauge('n1mm_collector_stations', 'stations in the lookup cache')
+DEDUPE_ENTRIES = metrics.gauge('n1mm_collector_dedupe_entries', 'QSOs remembered by the duplicate filter')
+RADIOS = metrics.gauge('n1mm_collector_radios', 'radios in the radio state table')
+SCORE_SAMPLES = metrics.counter('n1mm_collector_score_samples_total',
+                                'dynamicresults scores written to the score log')
+RADIO_STATE_WRITES = metrics.counter('n1mm_collector_radio_state_writes_total',
+                                     'radio state rows written to the database')
 
 run = True
 
@@ -37,6 +109,7 @@ class Operators:
         self.cursor.execute('SELECT id, name FROM operator;')
         for row in self.cursor:
             self.operators[row[1]] = row[0]
+        OPERATORS.set(len(self.operators))
 
     def lookup_operator_id(self, operator):
         """
@@ -45,10 +118,11 @@ class Operators:
         """
         oid = self.operators.get(operator)
         if oid is None:
+            # not committed here, the new operator is committed with the QSO that uses it.
             self.cursor.execute("insert into operator (name) values (?);", (operator,))
-            self.db.commit()
             oid = self.cursor.lastrowid
             self.operators[operator] = oid
+            OPERATORS.set(len(self.operators))
         return oid
 
 
@@ -63,17 +137,280 @@ class Stations:
         self.cursor.execute('SELECT id, name FROM station;')
         for row in self.cursor:
             self.stations[row[1]] = row[0]
+        STATIONS.set(len(self.stations))
 
     def lookup_station_id(self, station):
         sid = self.stations.get(station)
         if sid is None:
             self.cursor.execute('insert into station (name) values (?);', (station,))
-            self.db.commit()
             sid = self.cursor.lastrowid
             self.stations[station] = sid
+            STATIONS.set(len(self.stations))
         return sid
 
 
+class Names:
+    """
+    lookup cache for one of the name tables behind the integer-encoded columns of qso_log, section or exchange.
+    """
+
+    def __init__(self, cursor, table):
+        self.cursor = cursor
+        self.table = table
+        self.ids = {}
+        self.cursor.execute(f'SELECT id, name FROM {table};')
+        for row in self.cursor:
+            self.ids[row[1]] = row[0]
+
+    def lookup_id(self, name):
+        """
+        lookup the id for name, creating it if it is new.
+        """
+        name = name or ''
+        nid = self.ids.get(name)
+        if nid is None:
+            # not committed here, the new name is committed with the QSO that uses it.
+            self.cursor.execute(f'INSERT INTO {self.table} (name) VALUES (?);', (name,))
+            nid = self.cursor.lastrowid
+            self.ids[name] = nid
+        return nid
+
+
+class BatchWriter:
+    """
+    group-commit the database writes made by process_message.
+    messages are applied in the order they were received, inside one transaction.
+    the transaction is committed when batch_size messages are pending, or when the
+    oldest pending message is batch_latency seconds old, whichever comes first.
+    when a write or the commit fails, the transaction is rolled back; committed and rolled_back,
+    if given, are called after each commit and rollback.
+    """
+
+    def __init__(self, db, batch_size, batch_latency, committed=None, rolled_back=None):
+        self.db = db
+        self.committed = committed
+        self.rolled_back = rolled_back
+        self.batch_size = max(1, batch_size)
+        self.batch_latency = batch_latency
+        self.pending = 0
+        self.deadline = None
+        self.batch_count = 0
+        self.message_count = 0
+        self.largest_batch = 0
+        self.commit_seconds = 0.0
+        self.slowest_commit = 0.0
+
+    def added(self):
+        """
+        note that a message was written to the database but not yet committed.
+        """
+        if self.pending == 0:
+            self.deadline = time.monotonic() + self.batch_latency
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def timeout(self):
+        """
+        return the number of seconds until the pending batch must be committed,
+        or None if nothing is pending.
+        """
+        if self.pending == 0:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def commit_if_due(self):
+        if self.pending > 0 and time.monotonic() >= self.deadline:
+            self.commit()
+
+    def commit(self):
+        if self.pending == 0:
+            if self.committed is not None:
+                self.committed()
+            return
+        t0 = time.monotonic()
+        try:
+            self.db.commit()
+        except sqlite3.Error as error:
+            self.roll_back(error)
+            return
+        elapsed = time.monotonic() - t0
+        COMMIT_SECONDS.observe(elapsed)
+        BATCH_MESSAGES.observe(self.pending)
+        self.batch_count += 1
+        self.message_count += self.pending
+        self.commit_seconds += elapsed
+        if self.pending > self.largest_batch:
+            self.largest_batch = self.pending
+        if elapsed > self.slowest_commit:
+            self.slowest_commit = elapsed
+        logging.debug(f'committed batch of {self.pending} messages in {elapsed * 1000:.1f} ms')
+        self.pending = 0
+        self.deadline = None
+        if self.committed is not None:
+            self.committed()
+
+    def roll_back(self, error):
+        """
+        give up the open transaction after a failed write or commit, 'database is locked' when another
+        connection held the write lock for longer than DATABASE_BUSY_TIMEOUT.
+        """
+        logging.error(f'database write failed, rolling back the batch: {error}')
+        ROLLBACKS.inc()
+        try:
+            self.db.rollback()
+        except sqlite3.Error as rollback_error:
+            logging.error(f'rollback failed: {rollback_error}')
+        self.pending = 0
+        self.deadline = None
+        if self.rolled_back is not None:
+            self.rolled_back()
+
+    def log_statistics(self):
+        if self.batch_count == 0:
+            logging.info('batch writer: no batches committed.')
+            return
+        logging.info(f'batch writer: {self.message_count} messages in {self.batch_count} batches, '
+                     f'average batch {self.message_count / self.batch_count:.1f}, largest batch {self.largest_batch}, '
+                     f'average commit {self.commit_seconds / self.batch_count * 1000:.1f} ms, '
+                     f'slowest commit {self.slowest_commit * 1000:.1f} ms')
+
+
+class DuplicateFilter:
+    """
+    a bounded LRU of the QSOs recently written, keyed by qso_id, holding a digest of the QSO content.
+    N1MM+ re-broadcasts contacts when it resyncs, and several machines can forward the same packet.
+    exact repeats are dropped here instead of rewriting the row and its indexes; changed content
+    still goes through as a replace.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.digests = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(fields):
+        return hashlib.blake2b(repr(fields).encode(), digest_size=16).digest()
+
+    def is_duplicate(self, qso_id, fields):
+        """
+        return True if qso_id was recently recorded with exactly these fields.
+        """
+        if self.size <= 0:
+            return False
+        if self.digests.get(qso_id) == self.digest(fields):
+            self.digests.move_to_end(qso_id)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def remember(self, qso_id, fields):
+        """
+        remember the fields of a QSO once its row is written. the message writer loads the filter again
+        if the batch is rolled back, so it never holds a QSO the database does not.
+        """
+        if self.size <= 0:
+            return
+        self.digests[qso_id] = self.digest(fields)
+        self.digests.move_to_end(qso_id)
+        if len(self.digests) > self.size:
+            self.digests.popitem(last=False)
+        DEDUPE_ENTRIES.set(len(self.digests))
+
+    def forget(self, qso_id):
+        self.digests.pop(qso_id, None)
+        DEDUPE_ENTRIES.set(len(self.digests))
+
+    def load(self, cursor):
+        """
+        rebuild the cache from the most recently written rows of qso_log.
+        """
+        if self.size <= 0:
+            return
+        for row in dataaccess.get_recent_contacts(cursor, self.size):
+            self.digests[row[-1]] = self.digest(row[:-1])
+        DEDUPE_ENTRIES.set(len(self.digests))
+        logging.info(f'duplicate filter loaded {len(self.digests)} recent QSOs')
+
+    def log_statistics(self):
+        logging.info(f'duplicate filter: {self.hits} duplicates dropped, {self.misses} QSOs passed')
+
+
+class RadioStates:
+    """
+    the latest RadioInfo of each radio, keyed by (station, radio number).
+    N1MM+ sends RadioInfo once a second or more for every radio, and it rarely changes, so it is kept
+    here and a radio is only written when its state changed, at most every interval seconds.
+    a radio that is still heard from is rewritten every refresh seconds to keep its last_seen current.
+    """
+
+    def __init__(self, interval, refresh):
+        self.interval = interval
+        self.refresh = refresh
+        self.states = {}
+        self.last_seen = {}
+        self.written = {}
+        self.next_write = 0.0
+
+    def update(self, data):
+        station = (data.get('StationName') or data.get('NetBiosName', '')).upper()
+        radio_nr = int(data.get('RadioNr', 1))
+        freq = int(data.get('Freq', 0)) * 10  # convert to Hz
+        tx_freq = int(data.get('TXFreq', 0)) * 10 or freq
+        key = (station, radio_nr)
+        self.states[key] = (freq, tx_freq, constants.Bands.get_band_number_for_frequency(freq),
+                            data.get('Mode', '').upper(), data.get('OpCall', '').upper(),
+                            data.get('IsRunning') == 'True', data.get('IsTransmitting') == 'True',
+                            data.get('IsConnected', 'True') == 'True')
+        self.last_seen[key] = int(time.time())
+        RADIOS.set(len(self.states))
+
+    def is_due(self):
+        return time.monotonic() >= self.next_write
+
+    def changes(self):
+        """
+        return the radio_state rows that need writing, and remember them as written.
+        """
+        self.next_write = time.monotonic() + self.interval
+        rows = []
+        for key, state in self.states.items():
+            last_seen = self.last_seen[key]
+            written = self.written.get(key)
+            if written is None or written[0] != state or last_seen - written[1] >= self.refresh:
+                rows.append(key + state + (last_seen,))
+                self.written[key] = (state, last_seen)
+        return rows
+
+
+class ScoreLog:
+    """
+    the last score written to the score_log table.
+    N1MM+ sends dynamicresults far more often than the score changes; a sample is only appended
+    when it differs from the last one, and samples older than the last one (journal replay) are skipped.
+    """
+
+    def __init__(self):
+        self.last = None
+        self.skipped = 0
+
+    def load(self, cursor):
+        self.last = dataaccess.get_last_score(cursor)
+
+    def is_new(self, sample):
+        """
+        return True if sample, a tuple of (timestamp, score, qsos, mults, points), should be appended.
+        """
+        if self.last is not None and (sample[0] < self.last[0] or sample[1:] == self.last[1:]):
+            self.skipped += 1
+            return False
+        self.last = sample
+        return True
+
+
 class N1mmMessageParser:
     """
     this is a cheap and dirty class to parse N1MM+ broadcast messages.
@@ -138,39 +475,94 @@ def compress_message(msg):
     return new_msg
 
 
+def decode_message(message, parser):
+    """
+    decode a N1MM+ broadcast in a single pass over the received bytes.
+    returns a dict like N1mmMessageParser.parse, but with only the fields process_message uses.
+    messages the fast path cannot handle (entities, CDATA, comments, no root element) are
+    passed to the expat based parser instead.
+    """
+    root = MESSAGE_TYPE_PATTERN.search(message)
+    if root is None or b'&' in message or b'<!' in message:
+        data = parser.parse(compress_message(message))
+    else:
+        data = {'__messagetype__': root.group(1).decode()}
+        for element, value in ELEMENT_PATTERN.findall(message, root.end()):
+            if value:
+                name = DECODED_FIELDS.get(element)
+                if name is not None:
+                    data[name] = value.decode()
+    if data.get('__messagetype__') == 'dynamicresults':
+        data.update(decode_score_breakdown(message))
+    return data
+
+
+def decode_score_breakdown(message):
+    """
+    return the total QSOs, multipliers and points from the breakdown of a dynamicresults message.
+    the totals are the elements with band="total" and mode="ALL"; there is one mult element per multiplier type.
+    """
+    totals = {'total_qsos': 0, 'total_mults': 0, 'total_points': 0}
+    for element, attributes, value in BREAKDOWN_PATTERN.findall(message):
+        if BREAKDOWN_TOTAL_PATTERN.search(attributes):
+            totals['total_' + element.decode() + 's'] += int(value)
+    return totals
+
+
 def checksum(data):
     """
     generate a unique ID for each QSO.
     this is using md5 rather than crc32 because it is hoped that md5 will have less collisions.
+    the 16 byte digest is used as the qso_id key as it is.
     """
     hval = data['timestamp'] + data['StationName'] + data['contestnr'] + data['call']
-    return int(hashlib.md5(hval.encode()).hexdigest(), 16)
+    return hashlib.md5(hval.encode()).digest()
+
+
+def contact_qso_id(data):
+    """
+    the qso_id key of a decoded contactinfo or contactreplace message.
+    """
+    qso_id = data.get('ID', '')
+    # If no ID tag from N1MM, generate a hash for uniqueness
+    if len(qso_id) == 0:
+        return checksum(data)
+    return dataaccess.encode_qso_id(qso_id)
 
 
 def convert_timestamp(s):
     """
     convert the N1MM+ timestamp into a python time object.
+    the usual fixed YYYY-MM-DD HH:MM:SS layout is sliced apart, anything else goes to strptime.
     """
+    if len(s) == 19 and s[4] == '-' and s[7] == '-' and s[10] == ' ' and s[13] == ':' and s[16] == ':':
+        try:
+            return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                                     int(s[11:13]), int(s[14:16]), int(s[17:19])).timetuple()
+        except ValueError:
+            pass
     return time.strptime(s, '%Y-%m-%d %H:%M:%S')
 
 
-def process_message(parser, db, cursor, operators, stations, message, seen):
+def process_message(parser, db, cursor, operators, stations, sections, exchanges, message, seen, radios, scores):
     """
     Process a N1MM+ contactinfo message
+    sections and exchanges are the Names lookups for the integer-encoded qso_log columns.
+    message is the received datagram, or the dict a receive worker already decoded it into.
+    seen is the DuplicateFilter used to drop exact re-broadcasts.
+    radios is the RadioStates that RadioInfo messages update, it is written separately.
+    scores is the ScoreLog that drops unchanged dynamicresults scores.
+    returns True if the database was changed, the caller is responsible for the commit.
     """
-    message = compress_message(message)
-    data = parser.parse(message)
+    if isinstance(message, dict):
+        data = message
+    else:
+        data = decode_message(message, parser)
     message_type = data.get('__messagetype__', '')
     logging.debug(f'Received UDP message {message_type}')
+    MESSAGES.inc(type=message_type)
     if message_type in ['contactinfo', 'contactreplace']:
-        qso_id = data.get('ID', '')
-        
-        # If no ID tag from N1MM, generate a hash for uniqueness
-        if len(qso_id) == 0:
-           qso_id = checksum(data)
-        else:
-           qso_id = qso_id.replace('-','')
-            
+        qso_id = contact_qso_id(data)
         qso_timestamp = data.get('timestamp')
         mycall = data.get('mycall', '').upper()
         band = data.get('band')
@@ -192,12 +584,25 @@ def process_message(parser, db, cursor, operators, stations, message, seen):
         # convert qso_timestamp to datetime object
         timestamp = convert_timestamp(qso_timestamp)
 
-        dataaccess.record_contact_combined(db, cursor, operators, stations,
-                                           timestamp, mycall, band, mode, operator, station,
-                                           rx_freq, tx_freq, callsign, rst_sent, rst_recv,
-                                           exchange, section, comment, qso_id)
+        # the same fields, in the same order, as dataaccess.get_recent_contacts
+        fields = (calendar.timegm(timestamp), mycall, band, mode, operator, station,
+                  rx_freq, tx_freq, callsign, rst_sent, rst_recv, exchange, section, comment)
+        if seen.is_duplicate(qso_id, fields):
+            logging.debug(f'dropped duplicate of QSO {qso_id.hex()}')
+            DUPLICATES.inc()
+            return False
+
+        t0 = time.perf_counter()
+        written = dataaccess.record_contact_combined(db, cursor, operators, stations, sections, exchanges,
+                                                     timestamp, mycall, band, mode, operator, station,
+                                                     rx_freq, tx_freq, callsign, rst_sent, rst_recv,
+                                                     exchange, section, comment, qso_id, commit=False)
+        WRITE_SECONDS.observe(time.perf_counter() - t0)
+        if written:
+            seen.remember(qso_id, fields)
+        return written
     elif message_type == 'RadioInfo':
-        logging.debug('Received RadioInfo message')
+        radios.update(data)
     elif message_type == 'contactdelete':
         qso_id = data.get('ID') or ''
         
@@ -205,81 +610,994 @@ def process_message(parser, db, cursor, operators, stations, message, seen):
         if len(qso_id) == 0:
             qso_id = checksum(data)
         else:
-            qso_id = qso_id.replace('-', '')
-        
-        logging.info(f'Delete QSO Request with ID {qso_id}')
-        dataaccess.delete_contact_by_qso_id(db, cursor, qso_id)
+            qso_id = dataaccess.encode_qso_id(qso_id)
         
+        logging.info(f'Delete QSO Request with ID {qso_id.hex()}')
+        seen.forget(qso_id)
+        t0 = time.perf_counter()
+        dataaccess.delete_contact_by_qso_id(db, cursor, qso_id, commit=False)
+        WRITE_SECONDS.observe(time.perf_counter() - t0)
+        return True
+
     elif message_type == 'dynamicresults':
-        logging.debug('Received Score message')
+        qso_timestamp = data.get('timestamp')
+        if qso_timestamp:
+            timestamp = calendar.timegm(convert_timestamp(qso_timestamp))
+        else:
+            timestamp = int(time.time())
+        sample = (timestamp, int(data.get('score', 0)), data.get('total_qsos', 0), data.get('total_mults', 0),
+                  data.get('total_points', 0))
+        if not scores.is_new(sample):
+            logging.debug('Received unchanged Score message')
+            return False
+        logging.info(f'Score: {sample[1]} with {sample[2]} QSOs, {sample[3]} multipliers, {sample[4]} points')
+        dataaccess.record_score(cursor, *sample)
+        SCORE_SAMPLES.inc()
+        return True
     else:
         logging.warning(f'unknown message type "{message_type}" received, ignoring.')
         logging.debug(message)
+    return False
+
+
+class MessageWriter:
+    """
+    apply messages to the database. holds the connection, lookup caches, duplicate filter and
+    batch writer used by the message processor and by journal replay.
+    the messages of the open transaction are kept until it commits. if it is rolled back, they are held,
+    with every message after them, and written again in order every RETRY_INTERVAL until a batch commits.
+    """
+
+    def __init__(self, batch_size, batch_latency):
+        self.db = dataaccess.connect()
+        try:
+            self.cursor = self.db.cursor()
+            dataaccess.create_tables(self.db, self.cursor)
+            self.load_caches()
+            self.parser = N1mmMessageParser()
+            self.batch = BatchWriter(self.db, batch_size, batch_latency, self.committed, self.rolled_back)
+            self.radios = RadioStates(config.RADIO_STATE_INTERVAL, config.RADIO_STATE_MAX_AGE / 2)
+            self.batch_messages = []
+            self.held = []
+            self.retry_time = 0.0
+        except Exception:
+            self.db.close()
+            raise
+
+    def load_caches(self):
+        """
+        load the lookup caches, the duplicate filter and the score log from the database.
+        """
+        self.operators = Operators(self.db, self.cursor)
+        self.stations = Stations(self.db, self.cursor)
+        self.sections = Names(self.cursor, 'section')
+        self.exchanges = Names(self.cursor, 'exchange')
+        self.seen = DuplicateFilter(config.COLLECTOR_DEDUPE_CACHE_SIZE)
+        self.seen.load(self.cursor)
+        self.scores = ScoreLog()
+        self.scores.load(self.cursor)
+
+    def apply(self, message):
+        if self.held:
+            self.held.append(message)
+            self.retry()
+        else:
+            self.write(message)
+
+    def write(self, message):
+        self.batch_messages.append(message)
+        try:
+            changed = process_message(self.parser, self.db, self.cursor, self.operators, self.stations,
+                                      self.sections, self.exchanges, message, self.seen, self.radios, self.scores)
+        except (xml.parsers.expat.ExpatError, KeyError, ValueError, TypeError) as error:
+            PARSE_ERRORS.inc()
+            logging.warning(f'could not decode message: {error}')
+            logging.debug(message)
+            return
+        except sqlite3.OperationalError as error:
+            self.batch.roll_back(error)
+            return
+        except sqlite3.Error as error:
+            logging.warning(f'could not write message: {error}')
+            logging.debug(message)
+            return
+        if changed:
+            self.batch.added()
+        elif self.batch.pending == 0:
+            # nothing uncommitted depends on this message
+            self.batch_messages = []
+
+    def committed(self):
+        self.batch_messages = []
+
+    def rolled_back(self):
+        """
+        the caches may hold names, QSOs and scores that were rolled back, so they are loaded again,
+        and the batch's messages are held in front of the messages already held.
+        """
+        self.held[:0] = self.batch_messages
+        self.batch_messages = []
+        self.retry_time = time.monotonic() + RETRY_INTERVAL
+        try:
+            self.load_caches()
+        except sqlite3.Error as error:
+            logging.error(f'cannot reload the caches: {error}')
+            self.held.clear()
+            raise
+
+    def retry(self, force=False):
+        """
+        write the held messages again, if RETRY_INTERVAL has passed since the last rollback, and commit them.
+        """
+        if not self.held or (not force and time.monotonic() < self.retry_time):
+            return
+        messages, self.held = self.held, []
+        logging.info(f'writing {len(messages)} held messages again')
+        for i, message in enumerate(messages):
+            self.write(message)
+            if self.held:  # rolled back again, the rest wait behind the batch
+                self.held.extend(messages[i + 1:])
+                return
+        self.batch.commit()
+
+    def write_radio_states(self, force=False):
+        """
+        write the radios that changed, if RADIO_STATE_INTERVAL has passed since the last write.
+        the rows join the pending batch. they wait while messages are held, and are dropped if the write
+        fails, the radios report again soon enough.
+        """
+        if self.held or (not force and not self.radios.is_due()):
+            return
+        rows = self.radios.changes()
+        if rows:
+            try:
+                dataaccess.record_radio_states(self.cursor, rows)
+            except sqlite3.OperationalError as error:
+                self.batch.roll_back(error)
+                return
+            except sqlite3.Error as error:
+                logging.warning(f'could not write {len(rows)} radio states: {error}')
+                return
+            RADIO_STATE_WRITES.inc(len(rows))
+            self.batch.added()
+
+    def finish(self):
+        """
+        write what is left, returns False if some messages could not be written.
+        """
+        self.retry(force=True)
+        self.write_radio_states(force=True)
+        self.batch.commit()
+        self.batch.log_statistics()
+        self.seen.log_statistics()
+        logging.info(f'score log: {self.scores.skipped} unchanged scores dropped')
+        if self.held:
+            logging.error(f'{len(self.held)} messages could not be written to the database')
+        return not self.held
+
+    def close(self):
+        self.db.close()
+        logging.info('db closed')
+
+
+class JournalCheckpoint:
+    """
+    writes the journal checkpoint of the run while the message processor is idle: when the queue is empty
+    and nothing is uncommitted or held, every datagram journaled more than JOURNAL_CHECKPOINT_MARGIN seconds
+    ago is in the database. the checkpoint is only written once those commits are on disk, or a power loss
+    could take commits that recovery no longer replays: with DATABASE_SYNCHRONOUS = FULL or EXTRA, or without
+    WAL, every commit is synced; with NORMAL in WAL mode, a passive WAL checkpoint on db must copy every frame
+    into the database first; with OFF no checkpoint is written and recovery replays the whole run.
+    """
+
+    def __init__(self, run, db):
+        self.run = run
+        self.db = db
+        self.next_time = time.monotonic() + JOURNAL_CHECKPOINT_INTERVAL
+
+    def synced(self):
+        """
+        True if every commit so far is on disk.
+        """
+        if config.DATABASE_SYNCHRONOUS == 'OFF':
+            return False
+        if config.DATABASE_SYNCHRONOUS in ('FULL', 'EXTRA') or not config.DATABASE_WAL:
+            return True
+        try:
+            busy, log_frames, checkpointed = self.db.execute('PRAGMA wal_checkpoint(PASSIVE);').fetchone()
+        except sqlite3.Error as error:
+            logging.warning(f'WAL checkpoint for the journal checkpoint failed: {error}')
+            return False
+        return busy == 0 and log_frames == checkpointed
+
+    def idle(self):
+        now = time.monotonic()
+        if now < self.next_time:
+            return
+        self.next_time = now + JOURNAL_CHECKPOINT_INTERVAL
+        received = time.time() - JOURNAL_CHECKPOINT_MARGIN
+        if self.synced():
+            journal.write_checkpoint(config.JOURNAL_DIR, self.run, received)
+        else:
+            logging.debug('journal checkpoint skipped, the last commits may not be on disk yet')
+
+
+def replay_journal(store, runs, since=0.0):
+    """
+    apply every datagram in the journal runs received at or after since through process_message,
+    as fast as the database allows. returns the number of datagrams replayed.
+    """
+    count = 0
+    for received, data in journal.read_runs(config.JOURNAL_DIR, runs, since):
+        store.apply(data)
+        store.batch.commit_if_due()
+        count += 1
+    # replayed RadioInfo is history, the radios will report their current state soon enough.
+    store.radios = RadioStates(config.RADIO_STATE_INTERVAL, config.RADIO_STATE_MAX_AGE / 2)
+    store.batch.commit()
+    return count
+
+
+def recover_journal(store, current_run):
+    """
+    replay the journal runs before current_run that did not shut down cleanly, from their checkpoints, so the
+    messages that were still queued when the collector or its message processor died are written now.
+    messages that did reach the database are dropped by the duplicate filter or rewritten unchanged.
+    """
+    for journal_run in journal.unclean_runs(config.JOURNAL_DIR, current_run):
+        t0 = time.monotonic()
+        count = replay_journal(store, [journal_run], journal.read_checkpoint(config.JOURNAL_DIR, journal_run))
+        store.retry(force=True)
+        if store.held:
+            logging.error(f'journal run {journal_run} could not be written to the database, '
+                          f'it will be replayed at the next start')
+            store.held.clear()
+            continue
+        journal.mark_closed(config.JOURNAL_DIR, journal_run)
+        logging.warning(f'journal run {journal_run} did not shut down cleanly, '
+                        f'replayed {count} messages in {time.monotonic() - t0:.1f} seconds')
 
 
-def message_processor(q, event):
+def drain_queue(q, store):
+    """
+    after a stop request, write what the receivers queued before they stopped, up to their shutdown sentinel.
+    returns True if the sentinel was reached, so nothing queued was lost.
+    """
+    while True:
+        try:
+            message = q.get(timeout=SHUTDOWN_DRAIN_TIME + 1)
+        except queue.Empty:
+            return False
+        if message is None:
+            return True
+        store.apply(message)
+
+
+def message_processor(q, event, metrics_queue=None, journal_run=None):
+    """
+    own the database connection and write the messages taken from q.
+    when the message processor runs in its own process, metrics_queue carries its metrics to the endpoint.
+    journal_run is the journal run of this collector start; earlier runs that did not shut down cleanly
+    are replayed before the queue is read.
+    returns True if every message queued by the receivers was written.
+    """
     global run
     logging.info('collector message_processor starting.')
+    if metrics_queue is not None:
+        metrics.publish_snapshots(metrics_queue, 'message_processor')
     message_count = 0
-    seen = set()
-    db = sqlite3.connect(config.DATABASE_FILENAME)
+    store = None
+    checkpoint_scheduler = None
+    complete = False
     try:
-        cursor = db.cursor()
-        dataaccess.create_tables(db, cursor)
-
-        operators = Operators(db, cursor)
-        stations = Stations(db, cursor)
-        parser = N1mmMessageParser()
+        store = MessageWriter(config.COLLECTOR_BATCH_SIZE, config.COLLECTOR_BATCH_LATENCY)
+        journal_checkpoint = JournalCheckpoint(journal_run, store.db) if journal_run is not None else None
+        checkpoint_scheduler = dataaccess.start_checkpoint_scheduler()
+        if journal_run is not None:
+            recover_journal(store, journal_run)
+        writer = store.batch
 
         thread_run = True
         while not event.is_set() and thread_run:
             try:
-                udp_data = q.get()
+                timeout = writer.timeout()
+                try:
+                    udp_data = q.get(timeout=1.0 if timeout is None else timeout)
+                except queue.Empty:
+                    store.retry()
+                    store.write_radio_states()
+                    writer.commit()
+                    if journal_checkpoint is not None and writer.pending == 0 and not store.held:
+                        journal_checkpoint.idle()
+                    continue
+                if udp_data is None:  # the receiver is shutting down
+                    complete = True
+                    break
                 message_count += 1
-                process_message(parser, db, cursor, operators, stations, udp_data, seen)
+                store.apply(udp_data)
+                store.write_radio_states()
+                writer.commit_if_due()
             except KeyboardInterrupt:
                 logging.debug('message processor stopping due to keyboard interrupt')
                 thread_run = False
+        if not complete:
+            complete = drain_queue(q, store)
+        complete = store.finish() and complete
     finally:
-        db.close()
-        logging.info('db closed')
+        if checkpoint_scheduler is not None:
+            checkpoint_scheduler.stop()
+        if store is not None:
+            store.close()
         run = False
         logging.info(f'collector message_processor exited, {message_count} messages collected.')
+    return complete
 
 
-def main():
+def run_message_processor(q, event, metrics_queue, journal_run):
+    """
+    process target for message_processor. the exit code tells the parent whether every queued message
+    was written, so it knows if the journal run can be marked closed.
+    """
+    # the parent stops the message processor with event and the sentinel, after the receivers have stopped.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if not message_processor(q, event, metrics_queue, journal_run):
+        sys.exit(1)
+
+
+def journal_qso_ids(runs):
+    """
+    the qso_id of every contact in the journal runs.
+    """
+    parser = N1mmMessageParser()
+    qso_ids = set()
+    for received, data in journal.read_runs(config.JOURNAL_DIR, runs):
+        if b'<contact' not in data[:128]:
+            continue
+        try:
+            message = decode_message(data, parser)
+            if message.get('__messagetype__') in ('contactinfo', 'contactreplace'):
+                qso_ids.add(contact_qso_id(message))
+        except (xml.parsers.expat.ExpatError, KeyError, ValueError, TypeError):
+            continue
+    return qso_ids
+
+
+def rebuild_from_journal(force=False):
+    """
+    rebuild qso_log and score_log from every run in the journal, replaying the datagrams through process_message
+    in large transactions. the collector must not be running.
+    the rebuild deletes every QSO first, so QSOs that are not in the journal would be lost: those of runs
+    deleted by JOURNAL_RETENTION_DAYS, of a migrated database, or logged with JOURNAL = False.
+    unless force is set, the rebuild refuses to start when qso_log has any.
+    """
+    runs = sorted(journal.list_runs(config.JOURNAL_DIR))
+    if not runs:
+        logging.error(f'no journal found in {config.JOURNAL_DIR}')
+        return
+    store = MessageWriter(REBUILD_BATCH_SIZE, 60.0)
     try:
-        logging.info('Collector started...')
-        receive_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        process_event = None
-        proc = None
+        if not force:
+            qso_ids = journal_qso_ids(runs)
+            missing = sum(1 for qso_id, in store.cursor.execute('SELECT qso_id FROM qso_log;')
+                          if qso_id not in qso_ids)
+            if missing:
+                logging.error(f'{missing} QSOs are not in the journal in {config.JOURNAL_DIR} '
+                              f'and would be lost by the rebuild. use --force to rebuild anyway.')
+                return
+        # a failed rebuild can simply be run again, so it does not need to sync every batch.
+        store.db.execute('PRAGMA synchronous = OFF;')
+        deleted = store.cursor.execute('DELETE FROM qso_log;').rowcount
+        store.cursor.execute('DELETE FROM score_log;')
+        logging.info(f'deleted {deleted} QSOs, rebuilding from {len(runs)} journal runs')
+        # the duplicate filter and score log were loaded from the rows just deleted.
+        store.seen = DuplicateFilter(config.COLLECTOR_DEDUPE_CACHE_SIZE)
+        store.scores = ScoreLog()
+        t0 = time.monotonic()
+        count = replay_journal(store, runs)
+        elapsed = time.monotonic() - t0
+        if not store.finish():
+            logging.error('the rebuild could not be written to the database, run it again')
+            return
+        for journal_run in runs:
+            journal.mark_closed(config.JOURNAL_DIR, journal_run)
+        logging.info(f'rebuilt from {count} messages in {elapsed:.1f} seconds, '
+                     f'{count / max(elapsed, 0.001):.0f} messages/s')
+    finally:
+        store.close()
+
+
+def is_radio_info(message):
+    """
+    True if the received datagram, or decoded message, is a RadioInfo message.
+    """
+    if isinstance(message, dict):
+        return message.get('__messagetype__') == 'RadioInfo'
+    return b'<RadioInfo' in message[:128]
+
+
+class IngestQueue:
+    """
+    the receiver's side of the bounded queue to the message processor.
+    when the queue is full, the overflow policy decides what happens to new messages:
+    block   -- wait for room, letting the socket receive buffer absorb the burst.
+    drop    -- hold up to BACKLOG_SIZE messages in the receiver, and when that is full,
+               drop the oldest RadioInfo message, or the oldest message if there is none.
+    spill   -- append messages to a spill file and feed them back, in order, as room appears.
+    """
+
+    def __init__(self, q, policy, spill_filename):
+        self.q = q
+        self.policy = policy
+        self.spill_filename = spill_filename
+        self.backlog = collections.deque()
+        self.spill_file = None
+        self.spill_read_offset = 0
+        self.spill_count = 0
+        self.dropped = 0
+        self.dropped_radio_info = 0
+        self.spilled = 0
+
+    def put(self, message):
+        if self.policy == 'block':
+            self.q.put(message)
+            return
+        self.flush()
+        if len(self.backlog) == 0 and self.spill_count == 0:
+            try:
+                self.q.put(message, block=False)
+                return
+            except queue.Full:
+                pass
+        if self.policy == 'spill':
+            self.spill(message)
+        else:
+            self.backlog.append(message)
+            if len(self.backlog) > BACKLOG_SIZE:
+                self.drop_one()
+
+    def drop_one(self):
+        for i, message in enumerate(self.backlog):
+            if is_radio_info(message):
+                del self.backlog[i]
+                self.dropped_radio_info += 1
+                DROPPED_MESSAGES.inc(type='RadioInfo')
+                return
+        self.backlog.popleft()
+        self.dropped += 1
+        DROPPED_MESSAGES.inc(type='other')
+        if self.dropped % 100 == 1:
+            logging.warning(f'message queue is full, {self.dropped} messages dropped.')
+
+    def spill(self, message):
+        if self.spill_file is None:
+            self.spill_file = open(self.spill_filename, 'w+b')
+            self.spill_read_offset = 0
+        data = pickle.dumps(message)
+        self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(struct.pack('<I', len(data)))
+        self.spill_file.write(data)
+        self.spill_count += 1
+        self.spilled += 1
+        SPILLED_MESSAGES.inc()
+
+    def flush(self):
+        """
+        move held messages into the queue while it has room.
+        """
         try:
-            receive_socket.bind(('', config.N1MM_BROADCAST_PORT))
+            while len(self.backlog) > 0:
+                self.q.put(self.backlog[0], block=False)
+                self.backlog.popleft()
+            while self.spill_count > 0:
+                self.spill_file.seek(self.spill_read_offset)
+                length = struct.unpack('<I', self.spill_file.read(4))[0]
+                message = pickle.loads(self.spill_file.read(length))
+                self.q.put(message, block=False)
+                self.spill_read_offset += 4 + length
+                self.spill_count -= 1
+                if self.spill_count == 0:
+                    self.spill_file.truncate(0)
+                    self.spill_read_offset = 0
+        except queue.Full:
+            pass
+
+    def drain(self, timeout):
+        """
+        at shutdown, give the message processor up to timeout seconds to take the held messages.
+        returns True if it took them all.
+        """
+        deadline = time.monotonic() + timeout
+        self.flush()
+        while self.held() > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+            self.flush()
+        if self.held() > 0:
+            logging.warning(f'{self.held()} received messages were not written at shutdown.')
+            return False
+        return True
+
+    def poll_interval(self):
+        """
+        how long the receiver may wait for a datagram before it should flush held messages again.
+        """
+        return 0.01 if self.held() > 0 else 1.0
 
-            q = multiprocessing.Queue()
-            process_event = multiprocessing.Event()
+    def held(self):
+        """
+        the number of messages waiting in the receiver for room in the queue.
+        """
+        return len(self.backlog) + self.spill_count
+
+    def depth(self):
+        try:
+            return self.q.qsize()
+        except NotImplementedError:  # multiprocessing.Queue on macOS
+            return -1
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            os.remove(self.spill_filename)
+            self.spill_file = None
+
+
+def set_receive_buffer_size(receive_socket):
+    """
+    set SO_RCVBUF to RECEIVE_BUFFER_SIZE if configured, and log what the kernel actually granted.
+    """
+    if config.COLLECTOR_RECEIVE_BUFFER_SIZE > 0:
+        receive_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.COLLECTOR_RECEIVE_BUFFER_SIZE)
+    size = receive_socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    logging.info(f'UDP receive buffer is {size} bytes')
+    return size
 
-            proc = multiprocessing.Process(name='message_processor', target=message_processor, args=(q, process_event))
-            proc.start()
 
-            receive_socket.settimeout(5)
-            global run
-            while run:
+def read_udp_drops(receive_socket):
+    """
+    return the kernel's count of datagrams dropped for this socket, from /proc/net/udp.
+    returns None where that is not available.
+    """
+    try:
+        inode = str(os.fstat(receive_socket.fileno()).st_ino)
+        for filename in ('/proc/net/udp', '/proc/net/udp6'):
+            with open(filename) as udp_file:
+                next(udp_file)  # header
+                for line in udp_file:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        return int(fields[-1])
+    except (OSError, ValueError, StopIteration):
+        pass
+    return None
+
+
+class ReceiveStatistics:
+    """
+    periodically log the receiver's queue and kernel drop counters, and update their metrics.
+    """
+
+    def __init__(self, name, ingest, receive_socket):
+        self.name = name
+        self.ingest = ingest
+        self.receive_socket = receive_socket
+        self.next_report = time.monotonic() + config.COLLECTOR_STATS_INTERVAL
+        self.next_metrics_update = time.monotonic()
+        self.start_kernel_drops = read_udp_drops(receive_socket)
+
+    def kernel_drops(self):
+        """
+        return the datagrams the kernel dropped since the receiver started, or None if unknown.
+        """
+        drops = read_udp_drops(self.receive_socket)
+        if drops is None or self.start_kernel_drops is None:
+            return None
+        return drops - self.start_kernel_drops
+
+    def update(self, force=False):
+        now = time.monotonic()
+        if config.METRICS_ENABLED and (force or now >= self.next_metrics_update):
+            self.next_metrics_update = now + metrics.PUBLISH_INTERVAL
+            QUEUE_DEPTH.set(self.ingest.depth())
+            HELD_MESSAGES.set(self.ingest.held())
+            drops = self.kernel_drops()
+            if drops is not None:
+                KERNEL_DROPS.set(drops)
+        if not force and now < self.next_report:
+            return
+        self.next_report = now + config.COLLECTOR_STATS_INTERVAL
+        kernel_drops = self.kernel_drops()
+        if kernel_drops is None:
+            kernel_drops = 'unknown'
+        elif kernel_drops > 0:
+            logging.warning(f'{self.name}: the kernel dropped {kernel_drops} datagrams, '
+                            f'consider a larger RECEIVE_BUFFER_SIZE')
+        logging.info(f'{self.name}: queue depth {self.ingest.depth()}, held {self.ingest.held()}, '
+                     f'spilled {self.ingest.spilled}, dropped {self.ingest.dropped} '
+                     f'+ {self.ingest.dropped_radio_info} RadioInfo, kernel drops {kernel_drops}')
+
+
+def put_sentinel(q):
+    """
+    wake the message processor so it exits, without waiting long on a full queue.
+    """
+    try:
+        q.put(None, timeout=1)
+    except queue.Full:
+        pass
+
+
+def make_queue(process_safe):
+    if process_safe:
+        return multiprocessing.Queue(config.COLLECTOR_QUEUE_SIZE)
+    return queue.Queue(config.COLLECTOR_QUEUE_SIZE)
+
+
+def make_metrics_queue():
+    """
+    the queue child processes send their metrics snapshots on, or None when metrics are disabled.
+    """
+    if not config.METRICS_ENABLED:
+        return None
+    metrics_queue = multiprocessing.Queue(100)
+    metrics.receive_snapshots(metrics_queue)
+    return metrics_queue
+
+
+def make_ingest_queue(q, name):
+    return IngestQueue(q, config.COLLECTOR_OVERFLOW_POLICY, f'{config.COLLECTOR_SPILL_FILENAME}.{name}')
+
+
+class N1mmDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio protocol that hands each received N1MM+ broadcast to the message processor.
+    """
+
+    def __init__(self, ingest, journal_writer):
+        self.ingest = ingest
+        self.journal_writer = journal_writer
+
+    def datagram_received(self, data, addr):
+        DATAGRAMS.inc()
+        if self.journal_writer is not None:
+            self.journal_writer.append(data)
+        self.ingest.put(data)
+
+    def error_received(self, exc):
+        logging.warning(f'UDP receive error: {exc}')
+
+
+async def receive_messages(q, writer_thread, journal_run):
+    """
+    receive N1MM+ broadcasts until told to stop or the message processor exits.
+    returns True if every received message was handed to the message processor.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+    except (NotImplementedError, AttributeError):
+        pass  # no signal handlers on windows
+    ingest = make_ingest_queue(q, 'asyncio')
+    journal_writer = journal.open_writer(journal_run, 'receiver')
+    transport, protocol = await loop.create_datagram_endpoint(lambda: N1mmDatagramProtocol(ingest, journal_writer),
+                                                              local_addr=('0.0.0.0', config.N1MM_BROADCAST_PORT))
+    receive_socket = transport.get_extra_info('socket')
+    set_receive_buffer_size(receive_socket)
+    statistics = ReceiveStatistics('receiver', ingest, receive_socket)
+    try:
+        while not stop.is_set() and writer_thread.is_alive():
+            try:
+                await asyncio.wait_for(stop.wait(), ingest.poll_interval())
+            except asyncio.TimeoutError:
+                pass
+            ingest.flush()
+            statistics.update()
+            if journal_writer is not None:
+                journal_writer.sync_if_due()
+    finally:
+        delivered = writer_thread.is_alive() and ingest.drain(SHUTDOWN_DRAIN_TIME)
+        statistics.update(force=True)
+        transport.close()
+        ingest.close()
+        if journal_writer is not None:
+            journal_writer.close()
+    return delivered
+
+
+def asyncio_main(journal_run):
+    """
+    single process collector: an asyncio datagram endpoint receives the broadcasts
+    and a thread owns the database connection.
+    returns True if every received message was written.
+    """
+    q = make_queue(False)
+    metrics_server = metrics.start_server(config.METRICS_COLLECTOR_PORT, 'collector')
+    thread_event = threading.Event()
+    results = []
+    writer_thread = threading.Thread(name='message_processor',
+                                     target=lambda: results.append(message_processor(q, thread_event,
+                                                                                     journal_run=journal_run)))
+    writer_thread.start()
+    delivered = False
+    try:
+        delivered = asyncio.run(receive_messages(q, writer_thread, journal_run))
+    finally:
+        thread_event.set()
+        put_sentinel(q)
+        writer_thread.join()
+        metrics.stop_server(metrics_server)
+    return delivered and results == [True]
+
+
+def process_main(journal_run):
+    """
+    two process collector: this process receives the broadcasts and a child process
+    owns the database connection.
+    returns True if every received message was written.
+    """
+    receive_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    q = None
+    ingest = None
+    statistics = None
+    process_event = None
+    proc = None
+    metrics_server = None
+    journal_writer = None
+    delivered = False
+    try:
+        set_receive_buffer_size(receive_socket)
+        receive_socket.bind(('', config.N1MM_BROADCAST_PORT))
+
+        q = make_queue(True)
+        ingest = make_ingest_queue(q, 'receiver')
+        statistics = ReceiveStatistics('receiver', ingest, receive_socket)
+        process_event = multiprocessing.Event()
+        metrics_queue = make_metrics_queue()
+        journal_writer = journal.open_writer(journal_run, 'receiver')
+
+        proc = multiprocessing.Process(name='message_processor', target=run_message_processor,
+                                       args=(q, process_event, metrics_queue, journal_run))
+        proc.start()
+        # started after the fork, so the child does not inherit the listening socket.
+        metrics_server = metrics.start_server(config.METRICS_COLLECTOR_PORT, 'receiver')
+
+        while run and proc.is_alive():
+            receive_socket.settimeout(ingest.poll_interval())
+            try:
+                udp_data = receive_socket.recv(BROADCAST_BUF_SIZE)
+                DATAGRAMS.inc()
+                if journal_writer is not None:
+                    journal_writer.append(udp_data)
+                ingest.put(udp_data)
+            except socket.timeout:
+                ingest.flush()
+                if journal_writer is not None:
+                    journal_writer.sync_if_due()
+            statistics.update()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if ingest is not None and proc is not None and proc.is_alive():
+            delivered = ingest.drain(SHUTDOWN_DRAIN_TIME)
+        if statistics is not None:
+            statistics.update(force=True)
+        if receive_socket is not None:
+            receive_socket.close()
+        if ingest is not None:
+            ingest.close()
+        if journal_writer is not None:
+            journal_writer.close()
+        if process_event is not None:
+            process_event.set()
+        if q is not None:
+            put_sentinel(q)
+        metrics.stop_server(metrics_server)
+        if proc is not None:
+            proc.join(60)
+            if proc.is_alive():
+                logging.warning('message processor did not exit upon request, killing.')
+                proc.terminate()
+    return delivered and proc.exitcode == 0
+
+
+def interface_broadcast_address(interface):
+    """
+    the IPv4 broadcast address of the interface with index interface, as 4 bytes, or None if it has none.
+    the address is asked of the kernel at most every INTERFACE_CACHE_SECONDS.
+    """
+    now = time.monotonic()
+    cached = interface_broadcast_addresses.get(interface)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+    address = None
+    try:
+        import fcntl
+        name = socket.if_indextoname(interface)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            request = fcntl.ioctl(s.fileno(), SIOCGIFBRDADDR, struct.pack('256s', name.encode()[:15]))
+        address = request[20:24]  # the sin_addr of the struct sockaddr_in in the struct ifreq
+    except (ImportError, OSError) as error:
+        logging.debug(f'no broadcast address for interface {interface}: {error}')
+    interface_broadcast_addresses[interface] = (address, now + INTERFACE_CACHE_SECONDS)
+    return address
+
+
+def is_shared_datagram(ancdata):
+    """
+    True if the IP_PKTINFO ancillary data shows the datagram was sent to a broadcast or multicast address:
+    a multicast address, the limited broadcast address, BROADCAST_ADDRESS, or the broadcast address of
+    the interface it came in on. the kernel gives every SO_REUSEPORT socket a copy of those, but only
+    one socket gets a unicast datagram.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.IPPROTO_IP and kind == IP_PKTINFO and len(data) >= 12:
+            interface, local_address, destination = struct.unpack('=I4s4s', data[:12])
+            address = ipaddress.IPv4Address(destination)
+            return (address.is_multicast or destination == LIMITED_BROADCAST
+                    or str(address) == config.N1MM_BROADCAST_ADDRESS.strip()
+                    or destination == interface_broadcast_address(interface))
+    return False
+
+
+def receive_worker(worker_number, worker_count, q, event, metrics_queue=None, journal_run=None):
+    """
+    receive and decode broadcasts on a SO_REUSEPORT socket shared with the other workers.
+    the decoded messages are passed to the single message processor that writes the database.
+    datagrams from one sender are always handled by the same worker, so their order is kept:
+    the kernel hashes unicast datagrams by sender, and copies of broadcast datagrams are
+    dropped by every worker except the one the sender's address is sharded to.
+    exits with code 1 if some received messages could not be handed to the message processor.
+    """
+    logging.info(f'receive worker {worker_number} starting.')
+    # workers_main sets event when it is time to stop, so a message is not lost between recvmsg and the queue.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if metrics_queue is not None:
+        metrics.publish_snapshots(metrics_queue, f'receive_worker_{worker_number}')
+    parser = N1mmMessageParser()
+    receive_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ingest = make_ingest_queue(q, f'worker{worker_number}')
+    journal_writer = journal.open_writer(journal_run, f'worker{worker_number}')
+    statistics = None
+    delivered = False
+    received = 0
+    accepted = 0
+    received_bytes = 0
+    total_accepted = 0
+    try:
+        receive_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        receive_socket.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+        set_receive_buffer_size(receive_socket)
+        receive_socket.bind(('', config.N1MM_BROADCAST_PORT))
+        statistics = ReceiveStatistics(f'receive worker {worker_number}', ingest, receive_socket)
+        report_start = time.monotonic()
+        while not event.is_set():
+            receive_socket.settimeout(ingest.poll_interval())
+            try:
+                udp_data, ancdata, flags, address = receive_socket.recvmsg(BROADCAST_BUF_SIZE,
+                                                                           socket.CMSG_SPACE(12))
+                received += 1
+                DATAGRAMS.inc()
+                if is_shared_datagram(ancdata):
+                    shard = zlib.crc32(f'{address[0]}:{address[1]}'.encode()) % worker_count
+                    if shard != worker_number:
+                        continue
+                if journal_writer is not None:
+                    journal_writer.append(udp_data)
                 try:
-                    udp_data = receive_socket.recv(BROADCAST_BUF_SIZE)
-                    q.put(udp_data)
-                except socket.timeout:
-                    pass
-        finally:
-            if receive_socket is not None:
-                receive_socket.close()
-            if process_event is not None:
-                process_event.set()
-            if proc is not None:
-                proc.join(60)
-                if proc.is_alive():
-                    logging.warning('message processor did not exit upon request, killing.')
-                    proc.terminate()
+                    message = decode_message(udp_data, parser)
+                except xml.parsers.expat.ExpatError as error:
+                    PARSE_ERRORS.inc()
+                    logging.warning(f'could not decode message: {error}')
+                    continue
+                ingest.put(message)
+                accepted += 1
+                received_bytes += len(udp_data)
+            except socket.timeout:
+                ingest.flush()
+                if journal_writer is not None:
+                    journal_writer.sync_if_due()
+            statistics.update()
+            now = time.monotonic()
+            if now - report_start >= WORKER_REPORT_INTERVAL:
+                elapsed = now - report_start
+                logging.info(f'receive worker {worker_number}: {received} datagrams received, {accepted} decoded, '
+                             f'{accepted / elapsed:.1f} messages/s, {received_bytes / elapsed:.0f} bytes/s')
+                total_accepted += accepted
+                received = accepted = received_bytes = 0
+                report_start = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        delivered = ingest.drain(SHUTDOWN_DRAIN_TIME)
+        if statistics is not None:
+            statistics.update(force=True)
+        receive_socket.close()
+        ingest.close()
+        if journal_writer is not None:
+            journal_writer.close()
+        logging.info(f'receive worker {worker_number} exited, {total_accepted + accepted} messages decoded.')
+    if not delivered:
+        sys.exit(1)
+
+
+def workers_main(worker_count, journal_run):
+    """
+    multi process collector: worker_count processes receive and decode the broadcasts,
+    and one more process owns the database connection.
+    returns True if every received message was written.
+    """
+    q = make_queue(True)
+    process_event = multiprocessing.Event()
+    worker_event = multiprocessing.Event()
+    metrics_queue = make_metrics_queue()
+    metrics_server = None
+    proc = multiprocessing.Process(name='message_processor', target=run_message_processor,
+                                   args=(q, process_event, metrics_queue, journal_run))
+    proc.start()
+    workers = []
+    try:
+        for worker_number in range(worker_count):
+            worker = multiprocessing.Process(name=f'receive_worker_{worker_number}', target=receive_worker,
+                                             args=(worker_number, worker_count, q, worker_event, metrics_queue,
+                                                   journal_run))
+            worker.start()
+            workers.append(worker)
+        metrics_server = metrics.start_server(config.METRICS_COLLECTOR_PORT, 'collector')
+        while proc.is_alive() and all(worker.is_alive() for worker in workers):
+            proc.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker_event.set()
+        for worker in workers:
+            worker.join(SHUTDOWN_DRAIN_TIME + 1)
+            if worker.is_alive():
+                worker.terminate()
+        process_event.set()
+        put_sentinel(q)
+        proc.join(60)
+        if proc.is_alive():
+            logging.warning('message processor did not exit upon request, killing.')
+            proc.terminate()
+        metrics.stop_server(metrics_server)
+    return proc.exitcode == 0 and all(worker.exitcode == 0 for worker in workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='collect N1MM+ broadcasts into the n1mm_view database.')
+    parser.add_argument('--rebuild-from-journal', action='store_true',
+                        help='rebuild the QSO log from the journal in JOURNAL_DIR as fast as possible, then exit. '
+                             'stop the collector first. every QSO is deleted first, so QSOs that are not in the '
+                             'journal are lost; the rebuild refuses to start when there are any, unless --force.')
+    parser.add_argument('--force', action='store_true',
+                        help='with --rebuild-from-journal, rebuild even if QSOs logged before the journal '
+                             'would be lost.')
+    args = parser.parse_args()
+    if args.rebuild_from_journal:
+        rebuild_from_journal(args.force)
+        return
+
+    try:
+        logging.info(f'Collector started in {config.COLLECTOR_MODE} mode...')
+        journal_run = journal.next_run(config.JOURNAL_DIR) if config.JOURNAL_ENABLED else None
+        if journal_run is not None and config.JOURNAL_RETENTION_DAYS > 0:
+            journal.prune_runs(config.JOURNAL_DIR, journal_run, config.JOURNAL_RETENTION_DAYS)
+        worker_count = config.COLLECTOR_WORKERS
+        if worker_count > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            logging.warning('SO_REUSEPORT is not supported here, using one receive worker.')
+            worker_count = 1
+        if config.COLLECTOR_MODE == 'asyncio':
+            if worker_count > 1:
+                logging.warning('WORKERS is ignored in asyncio mode.')
+            complete = asyncio_main(journal_run)
+        elif worker_count > 1:
+            complete = workers_main(worker_count, journal_run)
+        else:
+            complete = process_main(journal_run)
+        # the next start replays a run that is not marked closed.
+        if journal_run is not None and complete:
+            journal.mark_closed(config.JOURNAL_DIR, journal_run)
     except KeyboardInterrupt:
         pass
 
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+"""
+n1mm_view columnar
+the NumPy aggregation engine. it reads the integer columns of qso_log into arrays once, and computes the
+QSO datasets the charts use with bincount and reshape, in the same shapes as the dataaccess getters.
+used by dataaccess.load_snapshot when AGGREGATION_ENGINE = numpy, and checked against the SQL getters
+by compare(), see dbtool.py compare.
+"""
+
+import collections
+import logging
+
+import numpy
+
+import constants
+import dataaccess
+import timeseries
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+COLUMNS = ('timestamp', 'band_id', 'mode_id', 'operator_id', 'station_id', 'section_id', 'exchange_id')
+QsoColumns = collections.namedtuple('QsoColumns', COLUMNS)
+
+# simple mode of each mode_id, as an array so a whole column maps at once
+SIMPLE_MODE = numpy.array(constants.Modes.MODE_TO_SIMPLE_MODE, dtype=numpy.int64)
+
+
+def load_columns(cursor):
+    """
+    read the integer columns of qso_log into one int64 array per column.
+    """
+    cursor.execute(f'SELECT {", ".join(COLUMNS)} FROM qso_log;')
+    rows = numpy.array(cursor.fetchall(), dtype=numpy.int64).reshape(-1, len(COLUMNS))
+    return QsoColumns(*(numpy.ascontiguousarray(rows[:, i]) for i in range(len(COLUMNS))))
+
+
+def load_names(cursor, table):
+    """
+    return {id: name} for a name table: operator, station, section or exchange.
+    """
+    cursor.execute(f'SELECT id, name FROM {table};')
+    return dict(cursor.fetchall())
+
+
+def named_counts(cursor, table, ids):
+    """
+    count the QSOs for each id in a column, returns [(name, count), ...] for the ids that have QSOs.
+    """
+    counts = numpy.bincount(ids)
+    names = load_names(cursor, table)
+    return [(names[i], count) for i, count in enumerate(counts.tolist()) if count > 0]
+
+
+def qso_band_modes(columns):
+    """
+    the band by simple mode matrix of get_qso_band_modes.
+    """
+    modes = len(constants.Modes.SIMPLE_MODES_LIST)
+    cells = columns.band_id * modes + SIMPLE_MODE[columns.mode_id]
+    counts = numpy.bincount(cells, minlength=constants.Bands.count() * modes)
+    return counts.reshape(constants.Bands.count(), modes).tolist()
+
+
+def operators_by_qsos(cursor, columns):
+    """
+    [(operator, count), ...] most QSOs first, like get_operators_by_qsos.
+    """
+    return sorted(named_counts(cursor, 'operator', columns.operator_id), key=lambda item: item[1], reverse=True)
+
+
+def station_qsos(cursor, columns):
+    return named_counts(cursor, 'station', columns.station_id)
+
+
+def qso_classes(cursor, columns):
+    """
+    [(count, exchange), ...] like get_qso_classes.
+    """
+    return [(count, name) for name, count in named_counts(cursor, 'exchange', columns.exchange_id)]
+
+
+def qsos_by_section(cursor, columns):
+    return dict(named_counts(cursor, 'section', columns.section_id))
+
+
+def qsos_per_hour_per_band(columns):
+    """
+    the timeseries.BucketSeries of get_qsos_per_hour_per_band, and the QSOs by band.
+    """
+    bands = constants.Bands.count()
+    qsos_by_band = numpy.bincount(columns.band_id, minlength=bands).tolist()
+    series = timeseries.event_series()
+    # QSOs count from the start of their minute, like the minute counts the sql engine reads
+    minutes = columns.timestamp // 60 * 60
+    inside = (minutes >= series.start) & (minutes < series.end())
+    buckets = (minutes[inside] - series.start) // series.bucket_seconds
+    counts = numpy.bincount(buckets * bands + columns.band_id[inside], minlength=series.buckets * bands)
+    for index in numpy.flatnonzero(counts).tolist():
+        series.add(series.start + index // bands * series.bucket_seconds, index % bands, int(counts[index]))
+    return series, qsos_by_band
+
+
+def compare(cursor):
+    """
+    compute every dataset with both engines and return the names of the ones that differ.
+    the order of rows the SQL getters do not sort is ignored.
+    """
+    columns = load_columns(cursor)
+    sql_per_hour, sql_per_band = dataaccess.get_qsos_per_hour_per_band(cursor)
+    numpy_per_hour, numpy_per_band = qsos_per_hour_per_band(columns)
+    pairs = {
+        'band_modes': (dataaccess.get_qso_band_modes(cursor), qso_band_modes(columns)),
+        'operators': (sorted(dataaccess.get_operators_by_qsos(cursor)), sorted(operators_by_qsos(cursor, columns))),
+        'stations': (sorted(dataaccess.get_station_qsos(cursor)), sorted(station_qsos(cursor, columns))),
+        'classes': (sorted(dataaccess.get_qso_classes(cursor)), sorted(qso_classes(cursor, columns))),
+        'sections': (dataaccess.get_qsos_by_section(cursor), qsos_by_section(cursor, columns)),
+        'qsos_per_hour': (sql_per_hour, numpy_per_hour),
+        'qsos_per_band': (sql_per_band, numpy_per_band),
+    }
+    differences = [dataset for dataset, (sql, engine) in pairs.items() if sql != engine]
+    for dataset in differences:
+        logging.error(f'{dataset} differs between the sql and numpy engines')
+    return differences
@@ -83,6 +83,34 @@ class Config(metaclass = Singleton):
         
         self.DATABASE_FILENAME = cfg.get('GLOBAL','DATABASE_FILENAME',fallback='n1mm_view.db')
         logging.info ('Using database file %s' % (self.DATABASE_FILENAME))
+        # SQLite performance profile
+        self.DATABASE_WAL = cfg.getboolean('GLOBAL','DATABASE_WAL',fallback=True)
+        self.DATABASE_SYNCHRONOUS = cfg.get('GLOBAL','DATABASE_SYNCHRONOUS',fallback='NORMAL').upper()
+        if self.DATABASE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+           logging.error('Invalid DATABASE_SYNCHRONOUS %s, using NORMAL' % (self.DATABASE_SYNCHRONOUS))
+           self.DATABASE_SYNCHRONOUS = 'NORMAL'
+        self.DATABASE_CACHE_SIZE_KB = cfg.getint('GLOBAL','DATABASE_CACHE_SIZE_KB',fallback=8192)
+        self.DATABASE_MMAP_SIZE_MB = cfg.getint('GLOBAL','DATABASE_MMAP_SIZE_MB',fallback=64)
+        self.DATABASE_BUSY_TIMEOUT = cfg.getfloat('GLOBAL','DATABASE_BUSY_TIMEOUT',fallback=5.0)
+        self.DATABASE_CHECKPOINT_INTERVAL = cfg.getint('GLOBAL','DATABASE_CHECKPOINT_INTERVAL',fallback=30)
+        # How the dashboard and headless compute the QSO charts: sql reads the QSO count tables,
+        # numpy reads the QSO log columns into arrays, see columnar.py, and incremental keeps the counts
+        # in memory and reads only the QSO changes, see incremental.py
+        self.AGGREGATION_ENGINE = cfg.get('GLOBAL','AGGREGATION_ENGINE',fallback='incremental').lower()
+        if self.AGGREGATION_ENGINE not in ('sql', 'numpy', 'incremental'):
+           logging.error('Unknown AGGREGATION_ENGINE %s, using incremental' % (self.AGGREGATION_ENGINE))
+           self.AGGREGATION_ENGINE = 'incremental'
+        # How the Sections Worked map is drawn: layers redraws the section shapes with matplotlib when
+        # a section changes color, raster recolors a per pixel section label array with NumPy, see sectionmap.py
+        self.MAP_ENGINE = cfg.get('GLOBAL','MAP_ENGINE',fallback='layers').lower()
+        if self.MAP_ENGINE not in ('layers', 'raster'):
+           logging.error('Unknown MAP_ENGINE %s, using layers' % (self.MAP_ENGINE))
+           self.MAP_ENGINE = 'layers'
+        # The night shade on the map is worked out once for every NIGHT_SHADE_MINUTES, see sectionmap.py
+        self.NIGHT_SHADE_MINUTES = cfg.getint('GLOBAL','NIGHT_SHADE_MINUTES',fallback=5)
+        if self.NIGHT_SHADE_MINUTES < 1:
+           logging.error('Invalid NIGHT_SHADE_MINUTES %s, using 5' % (self.NIGHT_SHADE_MINUTES))
+           self.NIGHT_SHADE_MINUTES = 5
         
         self.LOGO_FILENAME = cfg.get('GLOBAL','LOGO_FILENAME',fallback='logo.png')
         if not os.path.exists(self.LOGO_FILENAME):
@@ -110,12 +138,65 @@ class Config(metaclass = Singleton):
         logging.info ('Listening on UDP port %d' % (self.N1MM_BROADCAST_PORT))
         self.N1MM_BROADCAST_ADDRESS = cfg.get('N1MM INFO','BROADCAST_ADDRESS')
         self.N1MM_LOG_FILE_NAME = cfg.get('N1MM INFO','LOG_FILE_NAME')
+
+        # The collector can run as two processes joined by a queue, or as one asyncio process
+        self.COLLECTOR_MODE = cfg.get('COLLECTOR INFO','MODE',fallback='process').lower()
+        if self.COLLECTOR_MODE not in ('process', 'asyncio'):
+           logging.error('Unknown collector MODE %s, using process' % (self.COLLECTOR_MODE))
+           self.COLLECTOR_MODE = 'process'
+        # Number of processes receiving and decoding broadcasts in process mode, sharing the port with SO_REUSEPORT
+        self.COLLECTOR_WORKERS = cfg.getint('COLLECTOR INFO','WORKERS',fallback=1)
+        # Number of recent QSOs remembered to drop exact re-broadcasts, 0 disables
+        self.COLLECTOR_DEDUPE_CACHE_SIZE = cfg.getint('COLLECTOR INFO','DEDUPE_CACHE_SIZE',fallback=5000)
+        # Receive buffer, bounded queue and what to do when the queue is full
+        self.COLLECTOR_RECEIVE_BUFFER_SIZE = cfg.getint('COLLECTOR INFO','RECEIVE_BUFFER_SIZE',fallback=0)
+        self.COLLECTOR_QUEUE_SIZE = cfg.getint('COLLECTOR INFO','QUEUE_SIZE',fallback=10000)
+        self.COLLECTOR_OVERFLOW_POLICY = cfg.get('COLLECTOR INFO','OVERFLOW_POLICY',fallback='block').lower()
+        if self.COLLECTOR_OVERFLOW_POLICY not in ('block', 'drop', 'spill'):
+           logging.error('Unknown OVERFLOW_POLICY %s, using block' % (self.COLLECTOR_OVERFLOW_POLICY))
+           self.COLLECTOR_OVERFLOW_POLICY = 'block'
+        self.COLLECTOR_SPILL_FILENAME = cfg.get('COLLECTOR INFO','SPILL_FILENAME',fallback='n1mm_view.spill')
+        self.COLLECTOR_STATS_INTERVAL = cfg.getint('COLLECTOR INFO','STATS_INTERVAL',fallback=60)
+        # Journal of the received contact and score datagrams, for crash recovery and --rebuild-from-journal
+        self.JOURNAL_ENABLED = cfg.getboolean('COLLECTOR INFO','JOURNAL',fallback=True)
+        self.JOURNAL_DIR = cfg.get('COLLECTOR INFO','JOURNAL_DIR',fallback='journal')
+        self.JOURNAL_SEGMENT_SIZE = cfg.getint('COLLECTOR INFO','JOURNAL_SEGMENT_SIZE_MB',fallback=16) * 1024 * 1024
+        self.JOURNAL_FSYNC_INTERVAL = cfg.getint('COLLECTOR INFO','JOURNAL_FSYNC_INTERVAL_MS',fallback=1000) / 1000.0
+        self.JOURNAL_RETENTION_DAYS = cfg.getint('COLLECTOR INFO','JOURNAL_RETENTION_DAYS',fallback=0)
+        if self.JOURNAL_RETENTION_DAYS < 0:
+           logging.error('Invalid JOURNAL_RETENTION_DAYS %d, keeping the journal' % (self.JOURNAL_RETENTION_DAYS))
+           self.JOURNAL_RETENTION_DAYS = 0
+        # The collector commits QSOs in batches: when BATCH_SIZE messages are pending or BATCH_LATENCY_MS has passed
+        self.COLLECTOR_BATCH_SIZE = cfg.getint('COLLECTOR INFO','BATCH_SIZE',fallback=200)
+        self.COLLECTOR_BATCH_LATENCY = cfg.getint('COLLECTOR INFO','BATCH_LATENCY_MS',fallback=250) / 1000.0
+        # RadioInfo is kept in memory and written at most every RADIO_STATE_INTERVAL seconds, when it changed.
+        # Radios not heard from for RADIO_STATE_MAX_AGE seconds are left off the radio status panel.
+        self.RADIO_STATE_INTERVAL = cfg.getint('COLLECTOR INFO','RADIO_STATE_INTERVAL',fallback=5)
+        self.RADIO_STATE_MAX_AGE = cfg.getint('COLLECTOR INFO','RADIO_STATE_MAX_AGE',fallback=120)
+        
+        # Field Day score: QSO points times POWER_MULTIPLIER, plus every entry of [BONUS POINTS]
+        self.SCORE_POWER_MULTIPLIER = cfg.getint('SCORING INFO','POWER_MULTIPLIER',fallback=2)
+        if self.SCORE_POWER_MULTIPLIER < 1:
+           logging.error('Invalid POWER_MULTIPLIER %d, using 1' % (self.SCORE_POWER_MULTIPLIER))
+           self.SCORE_POWER_MULTIPLIER = 1
+        self.SCORE_BONUS_POINTS = {}
+        if cfg.has_section('BONUS POINTS'):
+           for name, points in cfg.items('BONUS POINTS'):
+              try:
+                 self.SCORE_BONUS_POINTS[name] = int(points)
+              except ValueError:
+                 logging.error('Invalid bonus points %s for %s, ignored' % (points, name))
         
         self.QTH_LATITUDE = cfg.getfloat('EVENT INFO','QTH_LATITUDE')
         self.QTH_LONGITUDE = cfg.getfloat('EVENT INFO','QTH_LONGITUDE')
         self.DISPLAY_DWELL_TIME = cfg.getint('GLOBAL','DISPLAY_DWELL_TIME',fallback=6)
         self.DATA_DWELL_TIME = cfg.getint('GLOBAL','DATA_DWELL_TIME',fallback=60)
         self.HEADLESS_DWELL_TIME = cfg.getint('GLOBAL','HEADLESS_DWELL_TIME',fallback=180)
+        # Length of the time buckets of the QSOs per hour by band chart
+        self.RATE_BUCKET_MINUTES = cfg.getint('GLOBAL','RATE_BUCKET_MINUTES',fallback=12)
+        if self.RATE_BUCKET_MINUTES < 1:
+           logging.error('Invalid RATE_BUCKET_MINUTES %d, using 12' % (self.RATE_BUCKET_MINUTES))
+           self.RATE_BUCKET_MINUTES = 12
         self.SKIP_TIMESTAMP_CHECK = cfg.getboolean('DEBUG','SKIP_TIMESTAMP_CHECK',fallback=False)
         
         
@@ -125,3 +206,9 @@ class Config(metaclass = Singleton):
         self.POST_FILE_COMMAND = cfg.get('HEADLESS INFO','POST_FILE_COMMAND', fallback=None)
         self.VIEW_FONT = cfg.getint('FONT INFO','VIEW_FONT',fallback=64)
         self.BIGGER_FONT = cfg.getint('FONT INFO','BIGGER_FONT',fallback=180)
+
+        # Prometheus text format metrics served on 127.0.0.1, one port per program
+        self.METRICS_ENABLED = cfg.getboolean('METRICS INFO','ENABLED',fallback=False)
+        self.METRICS_COLLECTOR_PORT = cfg.getint('METRICS INFO','COLLECTOR_PORT',fallback=9616)
+        self.METRICS_DASHBOARD_PORT = cfg.getint('METRICS INFO','DASHBOARD_PORT',fallback=9617)
+        self.METRICS_HEADLESS_PORT = cfg.getint('METRICS INFO','HEADLESS_PORT',fallback=9618)
@@ -24,11 +24,26 @@ class Bands:
     BANDS_LIST = ['N/A', '1.8', '3.5', '7', '14', '21', '28', '50', '144', '420']
     BANDS_TITLE = ['No Band', '160M', '80M', '40M', '20M', '15M', '10M', '6M', '2M', '70cm']
     BANDS = {elem: index for index, elem in enumerate(BANDS_LIST)}
+    # band edges in kHz, generous enough for the region 1, 2 and 3 allocations, by band number
+    BAND_EDGES = [(0, 0), (1800, 2000), (3500, 4000), (7000, 7300), (14000, 14350), (21000, 21450),
+                  (28000, 29700), (50000, 54000), (144000, 148000), (420000, 450000)]
 
     @classmethod
     def get_band_number(cls, band_name):
         return Bands.BANDS.get(band_name)
 
+    @classmethod
+    def get_band_number_for_frequency(cls, frequency):
+        """
+        return the band number for a frequency in Hz, 0 if it is not in a supported band.
+        """
+        khz = frequency / 1000
+        for band_number in range(1, len(Bands.BAND_EDGES)):
+            low, high = Bands.BAND_EDGES[band_number]
+            if low <= khz <= high:
+                return band_number
+        return 0
+
     @classmethod
     def count(cls):
         return len(Bands.BANDS_LIST)
@@ -17,6 +17,7 @@ import time
 from config import Config
 import dataaccess
 import graphics
+import metrics
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
@@ -35,141 +36,101 @@ QSO_MODES_PIE_INDEX = 7
 QSO_CLASSES_PIE_INDEX = 8
 QSO_RATE_CHART_IMAGE_INDEX = 9
 SECTIONS_WORKED_MAP_INDEX = 10
-IMAGE_COUNT = 11
+RADIO_STATUS_TABLE_INDEX = 11
+SCORE_CHART_INDEX = 12
+FIELD_DAY_SCORE_TABLE_INDEX = 13
+SCORE_RATE_CHART_INDEX = 14
+IMAGE_COUNT = 15
 
 IMAGE_MESSAGE = 1
 CRAWL_MESSAGE = 2
+METRICS_MESSAGE = 3
+
+LOAD_DATA_SECONDS = metrics.histogram('n1mm_dashboard_load_data_seconds',
+                                      'time to read the chart data from the database')
+CHART_RENDER_SECONDS = metrics.histogram('n1mm_dashboard_chart_render_seconds',
+                                         'time to render each chart', ('chart',))
+CHART_IMAGE_BYTES = metrics.gauge('n1mm_dashboard_chart_image_bytes',
+                                  'size of the last image of each chart', ('chart',))
+UPDATE_SECONDS = metrics.histogram('n1mm_dashboard_update_seconds', 'time for one chart engine update')
 
 SAVE_PNG = False
 
-def load_data(size, q, last_qso_timestamp):
+def load_data(size, q, detector, running=None):
     """
     load data from the database tables
+    detector is the dataaccess.ChangeDetector that tells if the QSOs changed, its connection is used for the reads.
+    running is the caller's dataaccess.running_aggregates(), or None.
     """
     logging.debug('load data')
 
-    qso_operators = []
-    qso_stations = []
-    qso_band_modes = []
-    operator_qso_rates = []
-    qsos_per_hour = []
-    qsos_by_section = {}
-    qso_classes = []
-
-    db = None
     data_updated = False
 
     try:
-        logging.debug('connecting to database')
-        db = sqlite3.connect(config.DATABASE_FILENAME)
-        cursor = db.cursor()
-        logging.debug('database connected')
-
-        # get timestamp from the last record in the database
-        last_qso_time, message = dataaccess.get_last_qso(cursor)
-
-        logging.debug('old_timestamp = %d, timestamp = %d', last_qso_timestamp, last_qso_time)
-        if last_qso_time != last_qso_timestamp:
+        t0 = time.monotonic()
+        data_updated = detector.qso_log_changed()
+        # sections are read every time, the map is always drawn to advance the gray line.
+        # radios and the N1MM+ score change without new QSOs, so they are read every time too.
+        snapshot = dataaccess.load_snapshot(detector.connection(), qsos=data_updated, running=running)
+        if data_updated:
             logging.debug('data updated!')
-            data_updated = True
-            q.put((CRAWL_MESSAGE, 3, message))
-
-            # load qso_operators
-            qso_operators = dataaccess.get_operators_by_qsos(cursor)
-
-            # load qso_stations -- maybe useless chartjunk
-            qso_stations = dataaccess.get_station_qsos(cursor)
-
-            # get something else.
-            qso_band_modes = dataaccess.get_qso_band_modes(cursor)
-
-            # load qso exchange data: what class are the other stations?
-            qso_classes = dataaccess.get_qso_classes(cursor)
-
-            # load QSOs per Hour by Operator
-            operator_qso_rates = dataaccess.get_qsos_per_hour_per_operator(cursor, last_qso_time)
-
-            # load QSO rates per Hour by Band
-            qsos_per_hour, qsos_per_band = dataaccess.get_qsos_per_hour_per_band(cursor)
-
-        # load QSOs by Section
-        # This has to be done even if no new QSO to advance gray line and since the map is always drawn.
-        qsos_by_section = dataaccess.get_qsos_by_section(cursor)
+            q.put((CRAWL_MESSAGE, 3, snapshot.last_qso_message))
+            q.put((CRAWL_MESSAGE, 6, score_message(snapshot.score)))
 
+        if snapshot.total_rates is not None:
+            q.put((CRAWL_MESSAGE, 5, 'Rate: %d/hr now, %d/hr last 10 minutes, %d/hr last hour, best hour %d'
+                   % snapshot.total_rates))
         q.put((CRAWL_MESSAGE, 0, ''))
 
+        LOAD_DATA_SECONDS.observe(time.monotonic() - t0)
         logging.debug('load data done')
     except sqlite3.OperationalError as error:
-        if error.args is not None and error.args[0].startswith('no such table'):
+        # open a fresh connection next time, and reload everything.
+        detector.close()
+        if error.args is not None and error.args[0].startswith(('no such table', 'unable to open')):
             q.put((CRAWL_MESSAGE, 0, 'database not ready', graphics.YELLOW, graphics.RED))
         else:
             logging.error(error.args[0])
             logging.exception(error)
             q.put((CRAWL_MESSAGE, 0, 'database read error', graphics.YELLOW, graphics.RED))
         return
-    finally:
-        if db is not None:
-            logging.debug('Closing DB')
-            cursor.close()
-            db.close()
-            db = None
 
     if data_updated:
-        try:
-            image_data, image_size = graphics.qso_summary_table(size, qso_band_modes)
-            enqueue_image(q, QSO_COUNTS_TABLE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_rates_table(size, operator_qso_rates)
-            enqueue_image(q, QSO_RATES_TABLE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_operators_graph(size, qso_operators)
-            enqueue_image(q, QSO_OPERATORS_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_operators_table(size, qso_operators)
-            enqueue_image(q, QSO_OPERATORS_TABLE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_stations_graph(size, qso_stations)
-            enqueue_image(q, QSO_STATIONS_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_bands_graph(size, qso_band_modes)
-            enqueue_image(q, QSO_BANDS_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_modes_graph(size, qso_band_modes)
-            enqueue_image(q, QSO_MODES_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_classes_graph(size, qso_classes)
-            enqueue_image(q, QSO_CLASSES_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_rates_graph(size, qsos_per_hour)
-            enqueue_image(q, QSO_RATE_CHART_IMAGE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-
+        render_chart(q, QSO_COUNTS_TABLE_INDEX, graphics.qso_summary_table, size, snapshot.qso_band_modes)
+        render_chart(q, QSO_OPERATORS_PIE_INDEX, graphics.qso_operators_graph, size, snapshot.qso_operators)
+        render_chart(q, QSO_OPERATORS_TABLE_INDEX, graphics.qso_operators_table, size, snapshot.qso_operators)
+        render_chart(q, QSO_STATIONS_PIE_INDEX, graphics.qso_stations_graph, size, snapshot.qso_stations)
+        render_chart(q, QSO_BANDS_PIE_INDEX, graphics.qso_bands_graph, size, snapshot.qso_band_modes)
+        render_chart(q, QSO_MODES_PIE_INDEX, graphics.qso_modes_graph, size, snapshot.qso_band_modes)
+        render_chart(q, QSO_CLASSES_PIE_INDEX, graphics.qso_classes_graph, size, snapshot.qso_classes)
+        render_chart(q, QSO_RATE_CHART_IMAGE_INDEX, graphics.qso_rates_graph, size, snapshot.qsos_per_hour)
+        render_chart(q, FIELD_DAY_SCORE_TABLE_INDEX, graphics.field_day_score_table, size, snapshot.score)
+        render_chart(q, SCORE_RATE_CHART_INDEX, graphics.score_rate_graph, size, snapshot.score)
+
+    # the running rates move with the clock, so they are redrawn every time they are loaded
+    if snapshot.operator_qso_rates is not None:
+        render_chart(q, QSO_RATES_TABLE_INDEX, graphics.qso_rates_table, size, snapshot.operator_qso_rates)
+    render_chart(q, RADIO_STATUS_TABLE_INDEX, graphics.radio_status_table, size, snapshot.radio_states)
+    render_chart(q, SCORE_CHART_INDEX, graphics.score_graph, size, snapshot.score_curve)
+    render_chart(q, SECTIONS_WORKED_MAP_INDEX, graphics.draw_map, size, snapshot.qsos_by_section)
+    gc.collect()
+
+
+def render_chart(q, image_id, chart_function, *args):
+    """
+    render one chart and send the image to the display, recording how long it took.
+    """
+    chart = chart_function.__name__
     try:
-        image_data, image_size = graphics.draw_map(size, qsos_by_section)
-        enqueue_image(q, SECTIONS_WORKED_MAP_INDEX, image_data, image_size)
-        gc.collect()
+        t0 = time.monotonic()
+        image_data, image_size = chart_function(*args)
+        CHART_RENDER_SECONDS.observe(time.monotonic() - t0, chart=chart)
+        if image_data is not None:
+            CHART_IMAGE_BYTES.set(len(image_data), chart=chart)
+        enqueue_image(q, image_id, image_data, image_size)
     except Exception as e:
         logging.exception(e)
 
-    return last_qso_time
-
 
 def enqueue_image(q, image_id, image_data, size):
     if image_data is not None:
@@ -190,6 +151,19 @@ def delta_time_to_string(delta_time):
         return '%02d:%02d:%02d' % (hours, minutes, seconds)
 
 
+def score_message(score):
+    """
+    return the crawl message for a scoring.Score
+    """
+    if score is None:
+        return ''
+    message = 'Score: %d, %d QSOs, %d points x%d power' % (score.score, score.qsos, score.points,
+                                                         score.power_multiplier)
+    if score.bonus_points != 0:
+        message += ' + %d bonus' % score.bonus_points
+    return message
+
+
 def update_crawl_message(crawl_messages):
     crawl_messages.set_message(0, config.EVENT_NAME)
     crawl_messages.set_message_colors(0, graphics.BRIGHT_BLUE, graphics.BLACK)
@@ -281,15 +255,19 @@ def update_charts(q, event, size):
     except AttributeError:
         logging.warning("can't be nice to windows")
     q.put((CRAWL_MESSAGE, 4, 'Chart engine starting...'))
-    last_qso_timestamp = 0
+    detector = dataaccess.ChangeDetector()
+    running = dataaccess.running_aggregates()
     q.put((CRAWL_MESSAGE, 4, ''))
 
     try:
         while not event.is_set():
             t0 = time.time()
-            last_qso_timestamp = load_data(size, q, last_qso_timestamp) or 0
+            load_data(size, q, detector, running)
             t1 = time.time()
             delta = t1 - t0
+            UPDATE_SECONDS.observe(delta)
+            if config.METRICS_ENABLED:
+                q.put((METRICS_MESSAGE, metrics.REGISTRY.collect()))
             update_delay = config.DATA_DWELL_TIME - delta
             if update_delay < 0:
                 update_delay = config.DATA_DWELL_TIME
@@ -298,6 +276,8 @@ def update_charts(q, event, size):
     except Exception as e:
         logging.exception('Exception in update_charts', exc_info=e)
         q.put((CRAWL_MESSAGE, 4, 'Chart engine failed.', graphics.YELLOW, graphics.RED))
+    finally:
+        detector.close()
 
 
 def change_image(screen, size, images, image_index, delta):
@@ -337,6 +317,7 @@ def main():
 
     proc = multiprocessing.Process(name='image-updater', target=update_charts, args=(q, process_event, display_size))
     proc.start()
+    metrics_server = metrics.start_server(config.METRICS_DASHBOARD_PORT, 'dashboard')
 
     try:
         image_index = LOGO_IMAGE_INDEX
@@ -403,6 +384,8 @@ def main():
                             bg = payload[4]
                         crawl_messages.set_message(n, message)
                         crawl_messages.set_message_colors(n, fg, bg)
+                    elif message_type == METRICS_MESSAGE:
+                        metrics.REGISTRY.add_snapshot('chart_engine', payload[1])
 
             crawl_messages.crawl_message()
             pygame.display.update()  # was .flip()
@@ -422,6 +405,7 @@ def main():
         logging.warning('chart engine did not exit upon request, killing.')
         proc.terminate()
     logging.debug('update thread has stopped.')
+    metrics.stop_server(metrics_server)
     logging.info('dashboard exit')
 
 
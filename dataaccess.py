@@ -1,26 +1,211 @@
 # n1mm_view database access code
 
 import calendar
+import collections
 from datetime import datetime
+import hashlib
 import logging
+import os
+import sqlite3
+import threading
 import time
+import types
 import constants
 from config import Config
+import metrics
+import scoring
+import timeseries
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016, 2019, 2020, Jeffrey B. Otterson'
 __license__ = 'Simplified BSD'
 
 config = Config()
+CHECKPOINT_BACKSTOP_PAGES = 10000
+LAST_QSO_COUNT = 10  # QSOs in the last QSOs table
+_columnar = None  # the columnar module once imported, False if NumPy is missing, see columnar_engine
+SCHEMA_VERSION = 4  # PRAGMA user_version of a current database, see MIGRATIONS
+
+# QSO counts kept up to date by triggers on qso_log, so the charts do not scan the log.
+# each is (table, ((column, type, expression over a qso_log row), ...)); {row} is NEW., OLD. or qso_log.
+AGGREGATES = (
+    ('qso_count_band_mode', (('band_id', 'INTEGER', '{row}band_id'), ('mode_id', 'INTEGER', '{row}mode_id'))),
+    ('qso_count_operator', (('operator_id', 'INTEGER', '{row}operator_id'),)),
+    ('qso_count_station', (('station_id', 'INTEGER', '{row}station_id'),)),
+    ('qso_count_section', (('section_id', 'INTEGER', '{row}section_id'),)),
+    ('qso_count_exchange', (('exchange_id', 'INTEGER', '{row}exchange_id'),)),
+    ('qso_count_minute_band', (('minute', 'INTEGER', '{row}timestamp / 60'), ('band_id', 'INTEGER', '{row}band_id'))),
+)
+# every change to qso_log is also appended to qso_change, a row of CHANGE_COLUMNS with sign +1 for a QSO
+# added and -1 for a QSO removed, so a reader can keep counts by reading only the changes since it last looked.
+# each is (column, type). the triggers keep about the last CHANGELOG_SIZE changes.
+CHANGE_COLUMNS = (('timestamp', 'INTEGER'), ('band_id', 'INTEGER'), ('mode_id', 'INTEGER'),
+                  ('operator_id', 'INTEGER'), ('station_id', 'INTEGER'), ('section_id', 'INTEGER'),
+                  ('exchange_id', 'INTEGER'), ('callsign', 'TEXT'))
+CHANGELOG_SIZE = 10000
+CHANGELOG_PRUNE_EVERY = 1000
 logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
                     level=config.LOG_LEVEL)
 logging.Formatter.converter = time.gmtime
 
+SNAPSHOT_DATASET_SECONDS = metrics.histogram('n1mm_snapshot_dataset_seconds',
+                                             'time to load each dataset of a chart snapshot', ('dataset',))
+
+# every dataset the charts use, read from the database at one moment by load_snapshot.
+# the QSO datasets are None in a snapshot loaded with qsos=False. with running aggregates, the rates are
+# always loaded, total_rates is the station's rates in the order of rates.RATE_TITLES, None without them.
+# score is the scoring.Score computed from the QSOs, a QSO dataset.
+# timings maps each dataset to seconds.
+Snapshot = collections.namedtuple('Snapshot', (
+    'last_qso_time', 'last_qso_message', 'qso_operators', 'qso_stations', 'qso_band_modes', 'qso_classes',
+    'operator_qso_rates', 'qsos_per_hour', 'qsos_per_band', 'last_qsos',
+    'qsos_by_section', 'radio_states', 'score_curve', 'total_rates', 'score', 'timings'))
+
+
+def configure_connection(db):
+    """
+    apply the performance pragmas from the [GLOBAL] section of the ini to a connection
+    """
+    db.execute(f'PRAGMA cache_size = -{config.DATABASE_CACHE_SIZE_KB};')
+    db.execute(f'PRAGMA mmap_size = {config.DATABASE_MMAP_SIZE_MB * 1024 * 1024};')
+
+
+def connect():
+    """
+    open the read/write database connection used by the collector.
+    the journal mode is stored in the database file, so setting WAL here also applies to the readers.
+    """
+    db = sqlite3.connect(config.DATABASE_FILENAME, timeout=config.DATABASE_BUSY_TIMEOUT)
+    if config.DATABASE_WAL:
+        db.execute('PRAGMA journal_mode = WAL;')
+        if config.DATABASE_CHECKPOINT_INTERVAL > 0:
+            # the checkpoint scheduler keeps the WAL small, this is only a backstop.
+            db.execute(f'PRAGMA wal_autocheckpoint = {CHECKPOINT_BACKSTOP_PAGES};')
+    else:
+        db.execute('PRAGMA journal_mode = DELETE;')
+    db.execute(f'PRAGMA synchronous = {config.DATABASE_SYNCHRONOUS};')
+    configure_connection(db)
+    return db
+
+
+def connect_read_only():
+    """
+    open a read-only database connection for the dashboard and headless readers.
+    readers never take a write lock, and wait up to DATABASE_BUSY_TIMEOUT seconds for the collector.
+    """
+    db_uri = 'file:{}?mode=ro'.format(os.path.abspath(config.DATABASE_FILENAME))
+    db = sqlite3.connect(db_uri, uri=True, timeout=config.DATABASE_BUSY_TIMEOUT)
+    configure_connection(db)
+    return db
+
+
+class ChangeDetector:
+    """
+    tell a reader whether qso_log changed since it last looked, without querying qso_log.
+    keeps one read-only connection open, which the reader can also use for its queries.
+    PRAGMA data_version only changes when another connection commits, so an idle database costs one
+    pragma. when it did change, the qso_log version tells QSO changes, including replaced and deleted
+    QSOs, from radio state and score writes.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.data_version = None
+        self.qso_log_version = None
+
+    def connection(self):
+        if self.db is None:
+            self.db = connect_read_only()
+        return self.db
+
+    def qso_log_changed(self):
+        """
+        return True if qso_log changed since the last call. the first call, and any call that cannot read
+        the versions, returns True.
+        """
+        try:
+            db = self.connection()
+            data_version = db.execute('PRAGMA data_version;').fetchone()[0]
+            if data_version == self.data_version:
+                return False
+            qso_log_version = get_qso_log_version(db.cursor())
+        except sqlite3.Error as error:
+            logging.debug(f'cannot read the database version: {error}')
+            self.close()
+            return True
+        self.data_version = data_version
+        if qso_log_version == self.qso_log_version:
+            return False
+        self.qso_log_version = qso_log_version
+        return True
+
+    def close(self):
+        """
+        close the connection, it is opened again when needed. call this after a database error.
+        """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.data_version = None
+        self.qso_log_version = None
+
+
+class CheckpointScheduler(threading.Thread):
+    """
+    checkpoint the WAL on a background thread with its own connection, so the collector's
+    commits do not stall doing checkpoints.  A passive checkpoint never waits for readers;
+    once every frame has been copied back to the database, the WAL file is truncated.
+    The connection has no busy timeout: a truncate that would have to wait for a reader or
+    the writer is skipped until the next interval, instead of holding off the collector's
+    commits while it waits.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='checkpoint_scheduler', daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        db = connect()
+        try:
+            db.execute('PRAGMA busy_timeout = 0;')
+            while not self.stop_event.wait(self.interval):
+                try:
+                    busy, log_frames, checkpointed = db.execute('PRAGMA wal_checkpoint(PASSIVE);').fetchone()
+                    if busy == 0 and log_frames > 0 and log_frames == checkpointed:
+                        busy = db.execute('PRAGMA wal_checkpoint(TRUNCATE);').fetchone()[0]
+                        if busy:
+                            logging.debug('checkpoint: WAL in use, not truncated')
+                    logging.debug(f'checkpoint: {checkpointed} of {log_frames} WAL frames copied')
+                except sqlite3.OperationalError as err:
+                    logging.warning(f'checkpoint failed: {err}')
+        finally:
+            db.close()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def start_checkpoint_scheduler():
+    """
+    start the background checkpoint scheduler if WAL mode and a checkpoint interval are configured.
+    returns the scheduler, or None.
+    """
+    if not config.DATABASE_WAL or config.DATABASE_CHECKPOINT_INTERVAL <= 0:
+        return None
+    scheduler = CheckpointScheduler(config.DATABASE_CHECKPOINT_INTERVAL)
+    scheduler.start()
+    return scheduler
+
 
 def create_tables(db, cursor):
     """
-    set up the database tables
+    set up the database tables, migrating an older database to SCHEMA_VERSION first
     """
+    if get_schema_version(cursor) < SCHEMA_VERSION and table_exists(cursor, 'qso_log'):
+        migrate(db, cursor)
+
     cursor.execute('CREATE TABLE IF NOT EXISTS operator\n'
                    '    (id INTEGER PRIMARY KEY NOT NULL, \n'
                    '    name char(12) NOT NULL);')
@@ -31,8 +216,9 @@ def create_tables(db, cursor):
                    '    name char(12) NOT NULL);')
     cursor.execute('CREATE INDEX IF NOT EXISTS station_name ON station(name);')
 
+    create_name_tables(cursor)
+
     cursor.execute('CREATE TABLE IF NOT EXISTS qso_log\n'
-                   # '    (id INTEGER PRIMARY KEY NOT NULL,\n'
                    '     (timestamp INTEGER NOT NULL,\n'
                    '     mycall char(12) NOT NULL,\n'
                    '     band_id INTEGER NOT NULL,\n'
@@ -44,126 +230,398 @@ def create_tables(db, cursor):
                    '     callsign char(12) NOT NULL,\n'
                    '     rst_sent char(3),\n'
                    '     rst_recv char(3),\n'
-                   '     exchange char(4),\n'
-                   '     section char(4),\n'
+                   '     exchange_id INTEGER NOT NULL,\n'
+                   '     section_id INTEGER NOT NULL,\n'
                    '     comment TEXT,\n'
-                   '     qso_id  char(32) PRIMARY KEY NOT NULL);')  # this is primary key to speed up Update & Delete
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_band_id ON qso_log(band_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_mode_id ON qso_log(mode_id);')
+                   '     qso_id BLOB PRIMARY KEY NOT NULL);')  # 16 bytes, see encode_qso_id
+    create_qso_log_indexes(cursor)
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION};')
+
+    create_aggregates(cursor)
+
+    create_changelog(cursor)
+
+    # bumped by every change to qso_log, so readers can tell QSO changes from radio state and score writes
+    cursor.execute('CREATE TABLE IF NOT EXISTS qso_log_version\n'
+                   '    (id INTEGER PRIMARY KEY CHECK (id = 0),\n'
+                   '     version INTEGER NOT NULL);')
+    cursor.execute('INSERT OR IGNORE INTO qso_log_version (id, version) VALUES (0, 0);')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_version_{event.lower()} AFTER {event} ON qso_log \n'
+                       f'BEGIN\n'
+                       f'    UPDATE qso_log_version SET version = version + 1 WHERE id = 0;\n'
+                       f'END;')
+
+    # the latest RadioInfo of each radio, written by the collector when it changes
+    cursor.execute('CREATE TABLE IF NOT EXISTS radio_state\n'
+                   '    (station char(12) NOT NULL,\n'
+                   '     radio_nr INTEGER NOT NULL,\n'
+                   '     freq INTEGER NOT NULL,\n'
+                   '     tx_freq INTEGER NOT NULL,\n'
+                   '     band_id INTEGER NOT NULL,\n'
+                   '     mode char(8) NOT NULL,\n'
+                   '     operator char(12) NOT NULL,\n'
+                   '     is_running INTEGER NOT NULL,\n'
+                   '     is_transmitting INTEGER NOT NULL,\n'
+                   '     is_connected INTEGER NOT NULL,\n'
+                   '     last_seen INTEGER NOT NULL,\n'
+                   '     PRIMARY KEY (station, radio_nr));')
+
+    # N1MM+ dynamicresults scores, appended by the collector when the score changes
+    cursor.execute('CREATE TABLE IF NOT EXISTS score_log\n'
+                   '    (timestamp INTEGER NOT NULL,\n'
+                   '     score INTEGER NOT NULL,\n'
+                   '     qsos INTEGER NOT NULL,\n'
+                   '     mults INTEGER NOT NULL,\n'
+                   '     points INTEGER NOT NULL);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS score_log_timestamp ON score_log(timestamp);')
+    db.commit()
+
+
+def get_schema_version(cursor):
+    cursor.execute('PRAGMA user_version;')
+    version = cursor.fetchone()[0]
+    # databases from before the schema was versioned are version 1
+    return version if version > 0 else 1
+
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?;", (table,))
+    return cursor.fetchone()[0] > 0
+
+
+def create_name_tables(cursor):
+    """
+    the names behind the integer-encoded section and exchange columns of qso_log.
+    """
+    for table in ('section', 'exchange'):
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table}\n'
+                       f'    (id INTEGER PRIMARY KEY NOT NULL, \n'
+                       f'    name char(8) NOT NULL);')
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {table}_name ON {table}(name);')
+
+
+def create_qso_log_indexes(cursor):
+    """
+    the indexes of qso_log. the primary key covers lookups by qso_id.
+    get_last_qso and get_last_N_qsos use qso_log_timestamp only to read the newest rows in timestamp order,
+    their other columns come from the table. it covers get_qsos_per_hour_per_operator, which reads just
+    timestamp and operator_id.
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_timestamp ON qso_log(timestamp, operator_id);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_band_mode ON qso_log(band_id, mode_id);')
     cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_operator_id ON qso_log(operator_id);')
     cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_station_id ON qso_log(station_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_section ON qso_log(section);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_qso_id ON qso_log(qso_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_qso_timestamp ON qso_log(timestamp);')
-    db.commit()
+    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_section_id ON qso_log(section_id);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_exchange_id ON qso_log(exchange_id);')
 
 
-def record_contact_combined(db, cursor, operators, stations,
-                            timestamp, mycall, band, mode, operator, station,
-                            rx_freq, tx_freq, callsign, rst_sent, rst_recv,
-                            exchange, section, comment, qso_id):
+def encode_qso_id(qso_id):
     """
-    record the results of a contact_message
+    return the 16 byte key of a QSO.
+    N1MM+ IDs are 32 hex digits, the collector's checksum() is an md5 digest, and version 1 databases
+    hold the checksum as a decimal number. anything else is hashed to 16 bytes.
     """
-    band_id = constants.Bands.get_band_number(band)
-    mode_id = constants.Modes.get_mode_number(mode)
-    operator_id = operators.lookup_operator_id(operator)
-    station_id = stations.lookup_station_id(station)
+    if isinstance(qso_id, bytes) and len(qso_id) == 16:
+        return qso_id
+    if isinstance(qso_id, int):
+        return qso_id.to_bytes(16, 'big')
+    text = str(qso_id).replace('-', '')
+    if len(text) == 32:
+        try:
+            return bytes.fromhex(text)
+        except ValueError:
+            pass
+    if text.isdigit() and int(text) < 1 << 128:
+        return int(text).to_bytes(16, 'big')
+    return hashlib.md5(text.encode()).digest()
+
+
+def migrate_to_v2(cursor):
+    """
+    version 2: 16 byte BLOB qso_id keys, section and exchange integer-encoded through lookup tables,
+    no duplicate index on qso_id, and indexes that cover the queries.
+    qso_log is copied to a new table in its original order, so rowid still follows the order QSOs were logged.
+    """
+    create_name_tables(cursor)
+    for table in ('section', 'exchange'):
+        cursor.execute(f"INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT IFNULL({table}, '') FROM qso_log;")
+    cursor.execute('CREATE TABLE qso_log_v2\n'
+                   '     (timestamp INTEGER NOT NULL,\n'
+                   '     mycall char(12) NOT NULL,\n'
+                   '     band_id INTEGER NOT NULL,\n'
+                   '     mode_id INTEGER NOT NULL,\n'
+                   '     operator_id INTEGER NOT NULL,\n'
+                   '     station_id INTEGER NOT NULL,\n'
+                   '     rx_freq INTEGER NOT NULL,\n'
+                   '     tx_freq INTEGER NOT NULL,\n'
+                   '     callsign char(12) NOT NULL,\n'
+                   '     rst_sent char(3),\n'
+                   '     rst_recv char(3),\n'
+                   '     exchange_id INTEGER NOT NULL,\n'
+                   '     section_id INTEGER NOT NULL,\n'
+                   '     comment TEXT,\n'
+                   '     qso_id BLOB PRIMARY KEY NOT NULL);')
+    cursor.execute("INSERT OR REPLACE INTO qso_log_v2 \n"
+                   "SELECT timestamp, mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq, \n"
+                   "       callsign, rst_sent, rst_recv, exchange.id, section.id, comment, encode_qso_id(qso_id) \n"
+                   "FROM qso_log \n"
+                   "JOIN exchange ON exchange.name = IFNULL(qso_log.exchange, '') \n"
+                   "JOIN section ON section.name = IFNULL(qso_log.section, '') \n"
+                   "ORDER BY qso_log.rowid;")
+    # dropping qso_log drops its indexes and triggers, the count tables are rebuilt by create_tables
+    cursor.execute('DROP TABLE qso_log;')
+    cursor.execute('ALTER TABLE qso_log_v2 RENAME TO qso_log;')
+    create_qso_log_indexes(cursor)
+    for table, columns in AGGREGATES:
+        cursor.execute(f'DROP TABLE IF EXISTS {table};')
+    if table_exists(cursor, 'qso_log_version'):
+        cursor.execute('UPDATE qso_log_version SET version = version + 1;')
+
+
+def migrate_to_v3(cursor):
+    """
+    version 3: QSOs counted by minute and band instead of by 12 minute slice, so the chart buckets can be any
+    number of minutes. dropping the count triggers makes create_tables create them again and rebuild the counts.
+    """
+    for trigger in ('replace', 'insert', 'update', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS qso_log_aggregate_{trigger};')
+    cursor.execute('DROP TABLE IF EXISTS qso_count_slice_band;')
 
-    logging.info(' QSO: %s %6s %4s %-6s %-12s %-12s %10d %10d %-6s %3s %3s %3s %-3s %-3s %32s' % (
-        time.strftime('%Y-%m-%d %H:%M:%S', timestamp),
-        mycall, band,
-        mode, operator,
-        station, rx_freq, tx_freq, callsign, rst_sent,
-        rst_recv, exchange, section, comment, qso_id))
 
-    if band_id is None or mode_id is None or operator_id is None or station_id is None:
-        logging.warning('[dataaccess] cannot log this QSO, bad data.')
+def migrate_to_v4(cursor):
+    """
+    version 4: the callsign in qso_change, for the score. dropping the changelog triggers makes create_tables
+    create them again with it. the changes logged without it are deleted, so the readers reload their counts.
+    """
+    if not table_exists(cursor, 'qso_change'):
         return
-    try:
-        cursor.execute(
-            'insert or replace into qso_log \n'
-            '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
-            '     callsign, rst_sent, rst_recv, exchange, section, comment, qso_id)\n'
-            '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);',
-            (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq,
-             callsign, rst_sent, rst_recv, exchange, section, comment, str(qso_id)))
+    for trigger in ('replace', 'insert', 'update', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS qso_log_change_{trigger};')
+    cursor.execute('DELETE FROM qso_change;')
+    cursor.execute("ALTER TABLE qso_change ADD COLUMN callsign TEXT NOT NULL DEFAULT '';")
 
-        db.commit()
-    except Exception as err:
-        logging.warning('Insert Failed: %s\nError: %s' % (qso_id, str(err)))
+
+# (version, function that migrates the database from the version before it)
+MIGRATIONS = (
+    (2, migrate_to_v2),
+    (3, migrate_to_v3),
+    (4, migrate_to_v4),
+)
 
 
-def record_contact(db, cursor, operators, stations,
-                   timestamp, mycall, band, mode, operator, station,
-                   rx_freq, tx_freq, callsign, rst_sent, rst_recv,
-                   exchange, section, comment, qso_id):
+def migrate(db, cursor):
     """
-    record the results of a contact_message
+    bring the database up to SCHEMA_VERSION, one migration per transaction.
     """
-    band_id = constants.Bands.get_band_number(band)
-    mode_id = constants.Modes.get_mode_number(mode)
-    operator_id = operators.lookup_operator_id(operator)
-    station_id = stations.lookup_station_id(station)
+    db.create_function('encode_qso_id', 1, encode_qso_id, deterministic=True)
+    for version, migration in MIGRATIONS:
+        if get_schema_version(cursor) >= version:
+            continue
+        logging.warning(f'migrating {config.DATABASE_FILENAME} to schema version {version}')
+        t0 = time.monotonic()
+        db.commit()
+        cursor.execute('BEGIN IMMEDIATE;')
+        try:
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {version};')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        logging.warning(f'migrated to schema version {version} in {time.monotonic() - t0:.1f} seconds')
 
-    logging.info('QSO: %s %6s %4s %-6s %-12s %-12s %10d %10d %-6s %3s %3s %3s %-3s %-3s %32s' % (
-        time.strftime('%Y-%m-%d %H:%M:%S', timestamp),
-        mycall, band,
-        mode, operator,
-        station, rx_freq, tx_freq, callsign, rst_sent,
-        rst_recv, exchange, section, comment, qso_id))
 
-    if band_id is None or mode_id is None or operator_id is None or station_id is None:
-        logging.warning('cannot log this QSO, bad data.')
+def aggregate_columns(columns):
+    return ', '.join(column for column, column_type, expression in columns)
+
+
+def aggregate_expressions(columns, row):
+    return ', '.join(expression.format(row=row) for column, column_type, expression in columns)
+
+
+def aggregate_increment(table, columns, row):
+    return (f'INSERT INTO {table} ({aggregate_columns(columns)}, qso_count) '
+            f'VALUES ({aggregate_expressions(columns, row)}, 1) '
+            f'ON CONFLICT ({aggregate_columns(columns)}) DO UPDATE SET qso_count = qso_count + 1;')
+
+
+def aggregate_decrement(table, columns, row):
+    return (f'UPDATE {table} SET qso_count = qso_count - 1 '
+            f'WHERE ({aggregate_columns(columns)}) = ({aggregate_expressions(columns, row)});')
+
+
+def create_aggregates(cursor):
+    """
+    create the aggregate tables and the triggers that maintain them in the same transaction as every
+    insert, replace, update and delete on qso_log.
+    insert or replace deletes the old row without firing the delete trigger (recursive_triggers is off),
+    so the replaced row is subtracted by a before insert trigger instead.
+    if the triggers are new, the aggregates are built from the QSOs already logged.
+    """
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'qso_log_aggregate_%';")
+    triggers_exist = cursor.fetchone()[0] == 4
+    for table, columns in AGGREGATES:
+        column_definitions = ', '.join(f'{column} {column_type} NOT NULL' for column, column_type, expression in columns)
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} \n'
+                       f'    ({column_definitions}, qso_count INTEGER NOT NULL, \n'
+                       f'     PRIMARY KEY ({aggregate_columns(columns)}));')
+    if triggers_exist:
         return
-    try:
-        cursor.execute(
-            'insert into qso_log \n'
-            '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
-            '     callsign, rst_sent, rst_recv, exchange, section, comment, qso_id)\n'
-            '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);',
-            (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq,
-             callsign, rst_sent, rst_recv, exchange, section, comment, qso_id))
+    replaced = ''.join(f'    UPDATE {table} SET qso_count = qso_count - 1 \n'
+                       f'    WHERE ({aggregate_columns(columns)}) IN \n'
+                       f'        (SELECT {aggregate_expressions(columns, "qso_log.")} FROM qso_log '
+                       f'WHERE qso_id = NEW.qso_id);\n'
+                       for table, columns in AGGREGATES)
+    inserted = ''.join(f'    {aggregate_increment(table, columns, "NEW.")}\n' for table, columns in AGGREGATES)
+    deleted = ''.join(f'    {aggregate_decrement(table, columns, "OLD.")}\n' for table, columns in AGGREGATES)
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_aggregate_replace BEFORE INSERT ON qso_log \n'
+                   f'BEGIN\n{replaced}END;')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_aggregate_insert AFTER INSERT ON qso_log \n'
+                   f'BEGIN\n{inserted}END;')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_aggregate_update AFTER UPDATE ON qso_log \n'
+                   f'BEGIN\n{deleted}{inserted}END;')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_aggregate_delete AFTER DELETE ON qso_log \n'
+                   f'BEGIN\n{deleted}END;')
+    logging.info('created the QSO count triggers')
+    rebuild_aggregates(cursor)
+
+
+def create_changelog(cursor):
+    """
+    create qso_change and the triggers that append every insert, replace, update and delete on qso_log to it.
+    like the aggregates, a replaced row is logged by a before insert trigger.
+    every CHANGELOG_PRUNE_EVERY changes, the changes older than the last CHANGELOG_SIZE are deleted.
+    """
+    definitions = ', '.join(f'{column} {column_type} NOT NULL' for column, column_type in CHANGE_COLUMNS)
+    columns = ', '.join(column for column, column_type in CHANGE_COLUMNS)
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS qso_change \n'
+                   f'    (seq INTEGER PRIMARY KEY AUTOINCREMENT, sign INTEGER NOT NULL, {definitions});')
+
+    def logged(sign, row):
+        values = ', '.join(f'{row}{column}' for column, column_type in CHANGE_COLUMNS)
+        return f'    INSERT INTO qso_change (sign, {columns}) VALUES ({sign}, {values});\n'
+
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_change_replace BEFORE INSERT ON qso_log \n'
+                   f'BEGIN\n'
+                   f'    INSERT INTO qso_change (sign, {columns}) \n'
+                   f'        SELECT -1, {columns} FROM qso_log WHERE qso_id = NEW.qso_id;\n'
+                   f'END;')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_change_insert AFTER INSERT ON qso_log \n'
+                   f'BEGIN\n{logged(1, "NEW.")}END;')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_change_update AFTER UPDATE ON qso_log \n'
+                   f'BEGIN\n{logged(-1, "OLD.")}{logged(1, "NEW.")}END;')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_log_change_delete AFTER DELETE ON qso_log \n'
+                   f'BEGIN\n{logged(-1, "OLD.")}END;')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS qso_change_prune AFTER INSERT ON qso_change \n'
+                   f'WHEN NEW.seq % {CHANGELOG_PRUNE_EVERY} = 0 \n'
+                   f'BEGIN\n'
+                   f'    DELETE FROM qso_change WHERE seq <= NEW.seq - {CHANGELOG_SIZE};\n'
+                   f'END;')
+
+
+def get_changes(cursor, after_seq):
+    """
+    return the changes to qso_log after after_seq as (seq, sign, CHANGE_COLUMNS...) rows, oldest first.
+    """
+    columns = ', '.join(column for column, column_type in CHANGE_COLUMNS)
+    cursor.execute(f'SELECT seq, sign, {columns} FROM qso_change WHERE seq > ? ORDER BY seq;', (after_seq,))
+    return cursor.fetchall()
 
-        db.commit()
-    except Exception as err:
-        logging.warning('Insert Failed: %s\nError: %s' % (qso_id, str(err)))
+
+def get_changelog_range(cursor):
+    """
+    return the (first, last) seq in qso_change, (None, None) when it is empty or does not exist.
+    """
+    if not table_exists(cursor, 'qso_change'):
+        return None, None
+    cursor.execute('SELECT MIN(seq), MAX(seq) FROM qso_change;')
+    return cursor.fetchone()
+
+
+def aggregate_query(table, columns):
+    """
+    the query that computes an aggregate table from qso_log.
+    """
+    expressions = aggregate_expressions(columns, '')
+    return f'SELECT {expressions}, COUNT(*) FROM qso_log GROUP BY {expressions}'
 
 
-def update_contact(db, cursor, operators, stations,
-                   timestamp, mycall, band, mode, operator, station,
-                   rx_freq, tx_freq, callsign, rst_sent, rst_recv,
-                   exchange, section, comment, qso_id):
+def rebuild_aggregates(cursor):
+    """
+    recompute every aggregate table from qso_log. the caller is responsible for the commit.
+    """
+    for table, columns in AGGREGATES:
+        cursor.execute(f'DELETE FROM {table};')
+        cursor.execute(f'INSERT INTO {table} ({aggregate_columns(columns)}, qso_count) '
+                       f'{aggregate_query(table, columns)};')
+    logging.info('rebuilt the QSO counts')
+
+
+def check_aggregates(cursor):
+    """
+    compare every aggregate table with the counts computed from qso_log.
+    returns {table: number of groups that differ}, only for the tables that differ.
+    """
+    differences = {}
+    for table, columns in AGGREGATES:
+        cursor.execute(f'SELECT {aggregate_columns(columns)}, qso_count FROM {table} WHERE qso_count != 0;')
+        stored = set(cursor.fetchall())
+        cursor.execute(aggregate_query(table, columns) + ';')
+        computed = set(cursor.fetchall())
+        if stored != computed:
+            differences[table] = len(stored ^ computed)
+    return differences
+
+
+def record_contact_combined(db, cursor, operators, stations, sections, exchanges,
+                            timestamp, mycall, band, mode, operator, station,
+                            rx_freq, tx_freq, callsign, rst_sent, rst_recv,
+                            exchange, section, comment, qso_id, commit=True):
     """
     record the results of a contact_message
+    sections and exchanges are the lookups for the integer-encoded section and exchange columns.
+    qso_id is the 16 byte key from encode_qso_id.
+    set commit False to leave the transaction open when the caller batches commits; then a failed write
+    raises sqlite3.OperationalError so the caller can roll back the batch.
+    returns True if the row was written.
     """
     band_id = constants.Bands.get_band_number(band)
     mode_id = constants.Modes.get_mode_number(mode)
     operator_id = operators.lookup_operator_id(operator)
     station_id = stations.lookup_station_id(station)
+    exchange_id = exchanges.lookup_id(exchange)
+    section_id = sections.lookup_id(section)
 
-    logging.info('Update QSO: %s %6s %4s %-6s %-12s %-12s %10d %10d %-6s %3s %3s %3s %-3s %-3s %32s' % (
+    logging.info(' QSO: %s %6s %4s %-6s %-12s %-12s %10d %10d %-6s %3s %3s %3s %-3s %-3s %32s' % (
         time.strftime('%Y-%m-%d %H:%M:%S', timestamp),
         mycall, band,
         mode, operator,
         station, rx_freq, tx_freq, callsign, rst_sent,
-        rst_recv, exchange, section, comment, qso_id))
+        rst_recv, exchange, section, comment, qso_id.hex()))
 
     if band_id is None or mode_id is None or operator_id is None or station_id is None:
         logging.warning('[dataaccess] cannot log this QSO, bad data.')
-        return
+        return False
     try:
         cursor.execute(
-            'update qso_log \n'
-            '    set timestamp=?, mycall=?, band_id=?, mode_id=?, operator_id=?, station_id=? , rx_freq=?, tx_freq=?, \n'
-            '     callsign=?, rst_sent=?, rst_recv=?, exchange=?, section=?, comment=? \n'
-            ' where qso_id = ?;',
+            'insert or replace into qso_log \n'
+            '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
+            '     callsign, rst_sent, rst_recv, exchange_id, section_id, comment, qso_id)\n'
+            '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);',
             (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq,
-             callsign, rst_sent, rst_recv, exchange, section, comment, qso_id))
-
-        db.commit()
+             callsign, rst_sent, rst_recv, exchange_id, section_id, comment, qso_id))
+
+        if commit:
+            db.commit()
+        return True
+    except sqlite3.OperationalError as err:
+        if not commit:  # the caller rolls back the batch and writes it again
+            raise
+        logging.warning('Insert Failed: %s\nError: %s' % (qso_id, str(err)))
     except Exception as err:
-        logging.warning('Update Failed: %s\nError: %s' % (qso_id, str(err)))
+        logging.warning('Insert Failed: %s\nError: %s' % (qso_id, str(err)))
+    return False
 
 
 def delete_contact(db, cursor, timestamp, station, callsign):
@@ -184,26 +642,89 @@ def delete_contact(db, cursor, timestamp, station, callsign):
         return ''
 
 
-def delete_contact_by_qso_id(db, cursor, qso_id):
+def delete_contact_by_qso_id(db, cursor, qso_id, commit=True):
     """
     Delete the results of a delete in N1MM
+    set commit False to leave the transaction open when the caller batches commits.
     """
 
     """ station_id = stations.lookup_station_id(station)
 """
 
-    logging.debug('DELETEQSOByqso_id: %s' % (qso_id))
+    logging.debug('DELETEQSOByqso_id: %s' % (qso_id.hex()))
     try:
-        cursor.execute('delete from qso_log where qso_id = ?;', (str(qso_id),))
-        db.commit()
+        cursor.execute('delete from qso_log where qso_id = ?;', (qso_id,))
+        if commit:
+            db.commit()
+    except sqlite3.OperationalError:
+        if not commit:  # the caller rolls back the batch and writes it again
+            raise
+        logging.exception('Exception deleting contact (by qso_id) from db.')
+        return ''
     except Exception as e:
         logging.exception('Exception deleting contact (by qso_id) from db.')
         return ''
 
 
+def record_radio_states(cursor, radio_states):
+    """
+    write radio states, each a tuple of the radio_state columns in table order.
+    the caller is responsible for the commit.
+    """
+    cursor.executemany('INSERT OR REPLACE INTO radio_state \n'
+                       '    (station, radio_nr, freq, tx_freq, band_id, mode, operator, \n'
+                       '     is_running, is_transmitting, is_connected, last_seen) \n'
+                       '    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);', radio_states)
+
+
+def record_score(cursor, timestamp, score, qsos, mults, points):
+    """
+    append a score sample. the caller is responsible for the commit.
+    """
+    cursor.execute('INSERT INTO score_log (timestamp, score, qsos, mults, points) VALUES (?, ?, ?, ?, ?);',
+                   (timestamp, score, qsos, mults, points))
+
+
+def get_last_score(cursor):
+    """
+    return the last score sample as (timestamp, score, qsos, mults, points), or None.
+    """
+    cursor.execute('SELECT timestamp, score, qsos, mults, points FROM score_log ORDER BY rowid DESC LIMIT 1;')
+    row = cursor.fetchone()
+    return tuple(row) if row is not None else None
+
+
+def get_recent_contacts(cursor, count):
+    """
+    return the count most recently written QSOs, oldest first, as the fields
+    the collector's duplicate filter digests, followed by the qso_id.
+    """
+    cursor.execute('SELECT timestamp, mycall, band_id, mode_id, operator.name, station.name, rx_freq, tx_freq, \n'
+                   '       callsign, rst_sent, rst_recv, exchange.name, section.name, comment, qso_id \n'
+                   'FROM qso_log \n'
+                   'JOIN operator ON operator.id = operator_id \n'
+                   'JOIN station ON station.id = station_id \n'
+                   'JOIN exchange ON exchange.id = exchange_id \n'
+                   'JOIN section ON section.id = section_id \n'
+                   'ORDER BY qso_log.rowid DESC LIMIT ?;', (count,))
+    contacts = []
+    for row in cursor:
+        contacts.append((row[0], row[1], constants.Bands.BANDS_LIST[row[2]], constants.Modes.MODES_LIST[row[3]])
+                        + tuple(row[4:]))
+    contacts.reverse()
+    return contacts
+
+
+def get_qso_log_version(cursor):
+    cursor.execute('SELECT version FROM qso_log_version WHERE id = 0;')
+    return cursor.fetchone()[0]
+
+
 def get_last_qso(cursor):
-    cursor.execute('SELECT timestamp, callsign, exchange, section, operator.name, band_id \n'
-                   'FROM qso_log JOIN operator WHERE operator.id = operator_id \n'
+    cursor.execute('SELECT timestamp, callsign, exchange.name, section.name, operator.name, band_id \n'
+                   'FROM qso_log JOIN operator ON operator.id = operator_id \n'
+                   'JOIN exchange ON exchange.id = exchange_id \n'
+                   'JOIN section ON section.id = section_id \n'
                    'ORDER BY timestamp DESC LIMIT 1')
     last_qso_time = int(time.time()) - 60
     message = ''
@@ -220,9 +741,9 @@ def get_last_qso(cursor):
 def get_operators_by_qsos(cursor):
     logging.debug('Load QSOs by Operator')
     qso_operators = []
-    cursor.execute('SELECT name, COUNT(operator_id) AS qso_count \n'
-                   'FROM qso_log JOIN operator ON operator.id = operator_id \n'
-                   'GROUP BY operator_id ORDER BY qso_count DESC;')
+    cursor.execute('SELECT name, qso_count \n'
+                   'FROM qso_count_operator JOIN operator ON operator.id = operator_id \n'
+                   'WHERE qso_count > 0 ORDER BY qso_count DESC;')
     for row in cursor:
         qso_operators.append((row[0], row[1]))
     return qso_operators
@@ -231,8 +752,8 @@ def get_operators_by_qsos(cursor):
 def get_station_qsos(cursor):
     logging.debug('Load QSOs by Station')
     qso_stations = []
-    cursor.execute('SELECT name, COUNT(station_id) AS qso_count \n'
-                   'FROM qso_log JOIN station ON station.id = station_id GROUP BY station_id;')
+    cursor.execute('SELECT name, qso_count \n'
+                   'FROM qso_count_station JOIN station ON station.id = station_id WHERE qso_count > 0;')
     for row in cursor:
         qso_stations.append((row[0], row[1]))
     return qso_stations
@@ -261,53 +782,49 @@ def get_qsos_per_hour_per_operator(cursor, last_qso_time):
 def get_qso_band_modes(cursor):
     qso_band_modes = [[0] * 4 for _ in constants.Bands.BANDS_LIST]
 
-    cursor.execute('SELECT COUNT(*), band_id, mode_id FROM qso_log GROUP BY band_id, mode_id;')
+    cursor.execute('SELECT qso_count, band_id, mode_id FROM qso_count_band_mode;')
     for row in cursor:
         qso_band_modes[row[1]][constants.Modes.MODE_TO_SIMPLE_MODE[row[2]]] += row[0]
     return qso_band_modes
 
 
 def get_qso_classes(cursor):
-    cursor.execute('SELECT COUNT(*), exchange FROM qso_log group by exchange;')
+    cursor.execute('SELECT qso_count, name FROM qso_count_exchange JOIN exchange ON exchange.id = exchange_id \n'
+                   'WHERE qso_count > 0;')
     exchanges = []
     for row in cursor:
         exchanges.append((row[0], row[1]))
     return exchanges
 
 
-def get_qsos_per_hour_per_band(cursor):
-    qsos_per_hour = []
+def get_qsos_by_band(cursor):
     qsos_by_band = [0] * constants.Bands.count()
-    slice_minutes = 15
-    slice_minutes = 12  # TODO FIXME was 15, 12 looks pretty ok
-    slices_per_hour = 60 / slice_minutes
-    window_seconds = slice_minutes * 60
-
-    logging.debug('Load QSOs per Hour by Band')
-    cursor.execute('SELECT timestamp / %d * %d AS ts, band_id, COUNT(*) AS qso_count \n'
-                   'FROM qso_log GROUP BY ts, band_id;' % (window_seconds, window_seconds))
+    cursor.execute('SELECT band_id, SUM(qso_count) FROM qso_count_band_mode GROUP BY band_id;')
     for row in cursor:
-        if len(qsos_per_hour) == 0:
-            qsos_per_hour.append([0] * constants.Bands.count())
-            qsos_per_hour[-1][0] = row[0]
-        while qsos_per_hour[-1][0] != row[0]:
-            ts = qsos_per_hour[-1][0] + window_seconds
-            qsos_per_hour.append([0] * constants.Bands.count())
-            qsos_per_hour[-1][0] = ts
-        qsos_per_hour[-1][row[1]] = row[2] * slices_per_hour
-        qsos_by_band[row[1]] += row[2]
+        qsos_by_band[row[0]] += row[1]
+    return qsos_by_band
 
-    for rec in qsos_per_hour:
-        rec[0] = datetime.utcfromtimestamp(rec[0])
-        # t = rec[0].strftime('%H:%M:%S')
 
-    return qsos_per_hour, qsos_by_band
+def get_qsos_per_hour_per_band(cursor):
+    """
+    return a timeseries.BucketSeries of the QSOs in the event by bucket and band, and the QSOs by band.
+    """
+    logging.debug('Load QSOs per Hour by Band')
+    series = timeseries.event_series()
+    # the minutes that start inside the event
+    cursor.execute('SELECT (minute * 60 - ?) / ? AS bucket, band_id, SUM(qso_count) FROM qso_count_minute_band \n'
+                   'WHERE minute >= ? AND minute < ? AND qso_count > 0 GROUP BY bucket, band_id;',
+                   (series.start, series.bucket_seconds, -(-series.start // 60), -(-series.end() // 60)))
+    for row in cursor:
+        series.add(series.start + row[0] * series.bucket_seconds, row[1], row[2])
+    return series, get_qsos_by_band(cursor)
 
 
 def get_qsos_by_section(cursor):
     logging.debug('Load QSOs by Section')
     qsos_by_section = {}
-    cursor.execute('SELECT section, COUNT(section) AS qsos FROM qso_log GROUP BY section;')
+    cursor.execute('SELECT name, qso_count FROM qso_count_section JOIN section ON section.id = section_id \n'
+                   'WHERE qso_count > 0;')
     for row in cursor:
         qsos_by_section[row[0]] = row[1]
         logging.debug(f'Section {row[0]} {row[1]}')
@@ -318,10 +835,12 @@ def get_last_N_qsos(cursor, nQSOCount):
     logging.info('get_last_N_qsos for last %d QSOs' % (nQSOCount))
     qsos = []
     cursor.execute(
-        'SELECT qso_id, timestamp, callsign, band_id, mode_id, operator.name, rx_freq, tx_freq, exchange, section, station.name \n'
+        'SELECT qso_id, timestamp, callsign, band_id, mode_id, operator.name, rx_freq, tx_freq, exchange.name, section.name, station.name \n'
         'FROM qso_log '
         'JOIN operator ON operator.id = operator_id\n'
         'JOIN station ON station.id = station_id\n'
+        'JOIN exchange ON exchange.id = exchange_id\n'
+        'JOIN section ON section.id = section_id\n'
         'ORDER BY timestamp DESC LIMIT %d;' % (nQSOCount))
     for row in cursor:
         qsos.append((row[1]  # raw timestamp 0
@@ -345,3 +864,160 @@ def get_last_N_qsos(cursor, nQSOCount):
         )
         logging.info('%s' % (message))
     return qsos
+
+
+def get_radio_states(cursor, max_age):
+    """
+    return the radios heard from in the last max_age seconds, by station and radio number, as tuples of
+    (station, radio_nr, freq, band title, mode, operator, is_running, is_transmitting, last_seen)
+    """
+    logging.debug('Load radio states')
+    radio_states = []
+    try:
+        cursor.execute('SELECT station, radio_nr, freq, band_id, mode, operator, is_running, is_transmitting, \n'
+                       '       last_seen \n'
+                       'FROM radio_state WHERE last_seen >= ? AND is_connected \n'
+                       'ORDER BY station, radio_nr;', (int(time.time()) - max_age,))
+    except sqlite3.OperationalError as error:
+        # the collector that creates the table has not been started since it was added
+        if error.args and error.args[0].startswith('no such table'):
+            return radio_states
+        raise
+    for row in cursor:
+        radio_states.append((row[0], row[1], row[2], constants.Bands.BANDS_TITLE[row[3]], row[4], row[5],
+                             bool(row[6]), bool(row[7]), row[8]))
+    return radio_states
+
+
+def get_score_curve(cursor, points=200):
+    """
+    return the score over time as a list of (datetime, score), at most about points long.
+    the samples are grouped into points equal time slices and the last sample of each slice is kept,
+    so the chart costs the same at the end of the event as at the start.
+    """
+    logging.debug('Load score curve')
+    score_curve = []
+    try:
+        cursor.execute('SELECT MIN(timestamp), MAX(timestamp) FROM score_log;')
+    except sqlite3.OperationalError as error:
+        if error.args and error.args[0].startswith('no such table'):
+            return score_curve
+        raise
+    first, last = cursor.fetchone()
+    if first is None:
+        return score_curve
+    slice_seconds = max(1, (last - first) // points + 1)
+    # SQLite returns the other columns from the row holding the MAX()
+    cursor.execute('SELECT MAX(timestamp), score FROM score_log \n'
+                   'GROUP BY (timestamp - ?) / ? ORDER BY 1;', (first, slice_seconds))
+    for row in cursor:
+        score_curve.append((datetime.utcfromtimestamp(row[0]), row[1]))
+    return score_curve
+
+
+def columnar_engine():
+    """
+    return the columnar module when AGGREGATION_ENGINE is numpy, None for sql.
+    if NumPy cannot be imported, log it once and use sql.
+    """
+    global _columnar
+    if config.AGGREGATION_ENGINE != 'numpy':
+        return None
+    if _columnar is None:
+        try:
+            import columnar
+            _columnar = columnar
+        except ImportError as error:
+            logging.error(f'cannot use the numpy aggregation engine, using sql: {error}')
+            _columnar = False
+    return _columnar or None
+
+
+def running_aggregates():
+    """
+    return a new incremental.RunningAggregates when AGGREGATION_ENGINE is incremental, else None.
+    a long running reader keeps it and passes it to every load_snapshot.
+    """
+    if config.AGGREGATION_ENGINE != 'incremental':
+        return None
+    import incremental
+    return incremental.RunningAggregates()
+
+
+def load_snapshot(db, qsos=True, running=None):
+    """
+    load every dataset the charts need inside one read transaction, so all the charts show the same moment.
+    set qsos False to skip the datasets that only change with qso_log, when the caller knows it did not change;
+    the sections, radio states and score curve are always loaded.
+    the QSO counts come from running, an incremental.RunningAggregates, when the caller has one, from
+    columnar.py when AGGREGATION_ENGINE is numpy, and from the count tables otherwise. the Field Day score
+    comes from running too, and is computed from qso_log otherwise.
+    returns a Snapshot.
+    """
+    timings = {}
+    cursor = db.cursor()
+
+    def timed(dataset, function, *args):
+        t0 = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - t0
+        timings[dataset] = elapsed
+        SNAPSHOT_DATASET_SECONDS.observe(elapsed, dataset=dataset)
+        return result
+
+    if db.in_transaction:
+        db.rollback()
+    cursor.execute('BEGIN;')
+    try:
+        last_qso_time = last_qso_message = qso_operators = qso_stations = qso_band_modes = qso_classes = None
+        operator_qso_rates = qsos_per_hour = qsos_per_band = last_qsos = total_rates = score = None
+        engine = columnar_engine() if qsos and running is None else None
+        qsos_by_section = None
+        if running is not None:
+            timed('changes', running.refresh, cursor)
+            if qsos:
+                qso_operators = timed('operators', running.operators_by_qsos)
+                qso_stations = timed('stations', running.station_qsos)
+                qso_band_modes = timed('band_modes', running.qso_band_modes)
+                qso_classes = timed('classes', running.qso_classes)
+                qsos_per_hour, qsos_per_band = timed('qsos_per_hour', running.qsos_per_hour_per_band)
+                score = timed('score', running.score)
+            qsos_by_section = timed('sections', running.qsos_by_section)
+            # the rates follow the wall clock, or the last QSO when debugging with an old log
+            now = None if config.SKIP_TIMESTAMP_CHECK else time.time()
+            operator_qso_rates = timed('operator_rates', running.operator_rates, now)
+            total_rates = running.total_rates(now)
+        elif engine is not None:
+            columns = timed('columns', engine.load_columns, cursor)
+            qso_operators = timed('operators', engine.operators_by_qsos, cursor, columns)
+            qso_stations = timed('stations', engine.station_qsos, cursor, columns)
+            qso_band_modes = timed('band_modes', engine.qso_band_modes, columns)
+            qso_classes = timed('classes', engine.qso_classes, cursor, columns)
+            qsos_per_hour, qsos_per_band = timed('qsos_per_hour', engine.qsos_per_hour_per_band, columns)
+            qsos_by_section = timed('sections', engine.qsos_by_section, cursor, columns)
+        elif qsos:
+            qso_operators = timed('operators', get_operators_by_qsos, cursor)
+            qso_stations = timed('stations', get_station_qsos, cursor)
+            qso_band_modes = timed('band_modes', get_qso_band_modes, cursor)
+            qso_classes = timed('classes', get_qso_classes, cursor)
+            qsos_per_hour, qsos_per_band = timed('qsos_per_hour', get_qsos_per_hour_per_band, cursor)
+        if qsos:
+            if score is None:
+                score = timed('score', scoring.compute_score, cursor)
+            # these read a few rows of qso_log by index, with either engine
+            last_qso_time, last_qso_message = timed('last_qso', get_last_qso, cursor)
+            if running is None:
+                operator_qso_rates = timed('operator_rates', get_qsos_per_hour_per_operator, cursor, last_qso_time)
+            last_qsos = timed('last_qsos', get_last_N_qsos, cursor, LAST_QSO_COUNT)
+        if qsos_by_section is None:
+            qsos_by_section = timed('sections', get_qsos_by_section, cursor)
+        radio_states = timed('radio_states', get_radio_states, cursor, config.RADIO_STATE_MAX_AGE)
+        score_curve = timed('score_curve', get_score_curve, cursor)
+    finally:
+        # a read transaction has nothing to commit
+        db.rollback()
+        cursor.close()
+    logging.debug('snapshot loaded in %.1f ms' % (sum(timings.values()) * 1000))
+    return Snapshot(last_qso_time, last_qso_message, qso_operators, qso_stations, qso_band_modes, qso_classes,
+                    operator_qso_rates, qsos_per_hour, qsos_per_band, last_qsos,
+                    qsos_by_section, radio_states, score_curve, total_rates, score, types.MappingProxyType(timings))
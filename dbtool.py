@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+"""
+n1mm_view dbtool
+maintenance commands for the n1mm_view database.
+    check    compare the QSO count tables with qso_log
+    rebuild  recompute the QSO count tables from qso_log
+    migrate  bring the database up to the current schema version and compact it
+    compare  check that the sql and numpy aggregation engines give the same chart data
+    score    show the Field Day score, and check the streaming score engine against a full recompute
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from config import Config
+import dataaccess
+import scoring
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+config = Config()
+
+
+def check():
+    """
+    returns True if every QSO count table matches qso_log.
+    """
+    db = dataaccess.connect_read_only()
+    try:
+        differences = dataaccess.check_aggregates(db.cursor())
+    finally:
+        db.close()
+    for table, count in differences.items():
+        logging.error(f'{table}: {count} groups do not match qso_log')
+    if not differences:
+        logging.info('QSO count tables match qso_log')
+    return not differences
+
+
+def rebuild():
+    db = dataaccess.connect()
+    try:
+        cursor = db.cursor()
+        dataaccess.create_tables(db, cursor)
+        dataaccess.rebuild_aggregates(cursor)
+        db.commit()
+    finally:
+        db.close()
+    return True
+
+
+def migrate():
+    """
+    migrate the database in place, then VACUUM it to give back the space the old tables used.
+    the collector migrates by itself when it starts, but does not compact the database.
+    """
+    size = os.path.getsize(config.DATABASE_FILENAME)
+    db = dataaccess.connect()
+    try:
+        cursor = db.cursor()
+        logging.info(f'schema version {dataaccess.get_schema_version(cursor)}, {size} bytes')
+        dataaccess.create_tables(db, cursor)
+        db.execute('VACUUM;')
+        if config.DATABASE_WAL:
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        logging.info(f'schema version {dataaccess.get_schema_version(cursor)}, '
+                     f'{os.path.getsize(config.DATABASE_FILENAME)} bytes')
+    finally:
+        db.close()
+    return True
+
+
+def compare():
+    """
+    returns True if the numpy aggregation engine gives the same chart data as the sql getters.
+    """
+    import columnar
+    db = dataaccess.connect_read_only()
+    try:
+        differences = columnar.compare(db.cursor())
+    finally:
+        db.close()
+    if not differences:
+        logging.info('sql and numpy aggregation engines match')
+    return not differences
+
+
+def score():
+    """
+    returns True if scoring the log one QSO at a time gives the same score as computing it from the whole log.
+    """
+    db = dataaccess.connect_read_only()
+    try:
+        cursor = db.cursor()
+        differences = scoring.compare(cursor)
+        result = scoring.compute_score(cursor)
+    finally:
+        db.close()
+    logging.info(f'score {result.score}: {result.qsos} QSOs, {result.dupes} dupes, {result.points} points '
+                 f'x{result.power_multiplier} power + {result.bonus_points} bonus')
+    for field in differences:
+        logging.error(f'{field} differs between the score engine and the full recompute')
+    if not differences:
+        logging.info('score engine matches the full recompute')
+    return not differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='n1mm_view database maintenance')
+    parser.add_argument('command', choices=('check', 'rebuild', 'migrate', 'compare', 'score'),
+                        help='check: compare the QSO count tables with qso_log, '
+                             'rebuild: recompute the QSO count tables from qso_log, '
+                             'migrate: upgrade the database schema and compact the database, '
+                             'compare: compare the sql and numpy aggregation engines, '
+                             'score: show the score and check the score engine')
+    args = parser.parse_args()
+    if args.command == 'check':
+        ok = check()
+    elif args.command == 'rebuild':
+        ok = rebuild()
+    elif args.command == 'migrate':
+        ok = migrate()
+    elif args.command == 'score':
+        ok = score()
+    else:
+        ok = compare()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+"""
+n1mm_view decoder benchmark
+this program compares the collector's single pass message decoder with the original
+compress_message + expat parser + strptime path, using captured N1MM+ broadcasts.
+it checks that both paths agree on every field the collector uses, then times them.
+"""
+
+import logging
+import timeit
+
+from config import Config
+import collector
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+config = Config()
+
+ITERATIONS = 20000
+
+CONTACT_INFO = b'''<?xml version="1.0" encoding="utf-8"?>
+<contactinfo>
+    <app>N1MM</app>
+    <contestname>FD</contestname>
+    <contestnr>73</contestnr>
+    <timestamp>2025-01-25 16:04:31</timestamp>
+    <mycall>N4N</mycall>
+    <band>14</band>
+    <rxfreq>1402550</rxfreq>
+    <txfreq>1402550</txfreq>
+    <operator>N1KDO</operator>
+    <mode>CW</mode>
+    <call>W1AW</call>
+    <countryprefix>K</countryprefix>
+    <wpxprefix>W1</wpxprefix>
+    <stationprefix>N4N</stationprefix>
+    <continent>NA</continent>
+    <snt>599</snt>
+    <sntnr>5</sntnr>
+    <rcv>599</rcv>
+    <rcvnr>0</rcvnr>
+    <gridsquare></gridsquare>
+    <exchange1>3A</exchange1>
+    <section>CT</section>
+    <comment></comment>
+    <qth></qth>
+    <name></name>
+    <power></power>
+    <misctext></misctext>
+    <zone>5</zone>
+    <prec></prec>
+    <ck>0</ck>
+    <ismultiplier1>1</ismultiplier1>
+    <ismultiplier2>0</ismultiplier2>
+    <ismultiplier3>0</ismultiplier3>
+    <points>2</points>
+    <radionr>1</radionr>
+    <run1run2>1</run1run2>
+    <RoverLocation></RoverLocation>
+    <RadioInterfaced>1</RadioInterfaced>
+    <NetworkedCompNr>2</NetworkedCompNr>
+    <IsOriginal>True</IsOriginal>
+    <NetBiosName>CW-STATION</NetBiosName>
+    <IsRunQSO>1</IsRunQSO>
+    <StationName>CW-STATION</StationName>
+    <ID>f9ffac4fcd3e479ca86e137df1338531</ID>
+    <IsClaimedQso>1</IsClaimedQso>
+</contactinfo>'''
+
+RADIO_INFO = b'''<?xml version="1.0" encoding="utf-8"?>
+<RadioInfo>
+    <app>N1MM</app>
+    <StationName>CW-STATION</StationName>
+    <RadioNr>1</RadioNr>
+    <Freq>1402550</Freq>
+    <TXFreq>1402550</TXFreq>
+    <Mode>CW</Mode>
+    <OpCall>N1KDO</OpCall>
+    <IsRunning>True</IsRunning>
+    <FocusEntry>00000</FocusEntry>
+    <EntryWindowHwnd>0</EntryWindowHwnd>
+    <Antenna>2</Antenna>
+    <Rotors></Rotors>
+    <FocusRadioNr>1</FocusRadioNr>
+    <IsStereo>False</IsStereo>
+    <IsSplit>False</IsSplit>
+    <ActiveRadioNr>1</ActiveRadioNr>
+    <IsTransmitting>False</IsTransmitting>
+    <FunctionKeyCaption></FunctionKeyCaption>
+    <RadioName>IC-7610</RadioName>
+    <AuxAntSelected>-1</AuxAntSelected>
+    <AuxAntSelectedName></AuxAntSelectedName>
+    <IsConnected>True</IsConnected>
+</RadioInfo>'''
+
+SAMPLES = [('contactinfo', CONTACT_INFO), ('RadioInfo', RADIO_INFO)]
+
+
+def old_decode(parser, message):
+    data = parser.parse(collector.compress_message(message))
+    if 'timestamp' in data:
+        data['timestamp'] = collector.time.strptime(data['timestamp'], '%Y-%m-%d %H:%M:%S')
+    return data
+
+
+def new_decode(parser, message):
+    data = collector.decode_message(message, parser)
+    if 'timestamp' in data:
+        data['timestamp'] = collector.convert_timestamp(data['timestamp'])
+    return data
+
+
+def check(parser, name, message):
+    """
+    make sure the new decoder returns the same value as the old parser for every field it keeps.
+    """
+    old_data = old_decode(parser, message)
+    new_data = new_decode(parser, message)
+    if new_data['__messagetype__'] != old_data.get('__messagetype__'):
+        logging.error(f'{name}: message type {new_data["__messagetype__"]} != {old_data.get("__messagetype__")}')
+        return False
+    for key, value in new_data.items():
+        if old_data.get(key) != value:
+            logging.error(f'{name}: field {key} {value!r} != {old_data.get(key)!r}')
+            return False
+    for key in collector.DECODED_FIELDS.values():
+        if key in old_data and key not in new_data:
+            logging.error(f'{name}: field {key} is missing')
+            return False
+    return True
+
+
+def main():
+    parser = collector.N1mmMessageParser()
+    for name, message in SAMPLES:
+        if not check(parser, name, message):
+            continue
+        old_time = timeit.timeit(lambda: old_decode(parser, message), number=ITERATIONS)
+        new_time = timeit.timeit(lambda: new_decode(parser, message), number=ITERATIONS)
+        print(f'{name:12s} old {old_time / ITERATIONS * 1e6:8.1f} us/msg   '
+              f'new {new_time / ITERATIONS * 1e6:8.1f} us/msg   speedup {old_time / new_time:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
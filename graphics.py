@@ -1,25 +1,21 @@
 # holds code that returns graphs.
 #
 #
-import calendar
 import logging
 import os
 import datetime
 
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import cartopy.feature.nightshade as nightshade
-import cartopy.io.shapereader as shapereader
 import matplotlib
 import matplotlib.backends.backend_agg as agg
-import matplotlib.cm
 import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
+import numpy
 import pygame
 from matplotlib.dates import HourLocator, DateFormatter
 
 from config import Config
 from constants import *
+import sectionmap
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016, 2019, 2021, 2024, 2025 Jeffrey B. Otterson and n1mm_view maintainers'
@@ -50,7 +46,7 @@ else:
     image_format = 'ARGB'
 
 logging.warning(f'set image format to {image_format}')
-_map = None
+_maps = {}  # sectionmap.SectionMap or RasterSectionMap by output size, see draw_map
 
 
 def init_display():
@@ -245,6 +241,31 @@ def qso_table(size, qsos):
     else:
         return draw_table(size, cells, "Last 10 QSOs")
         
+def radio_status_table(size, radio_states):
+    """
+    create the table of who is on which band right now
+    """
+    if radio_states is None or len(radio_states) == 0:
+        return None, (0, 0)
+
+    cells = [['Station', 'Operator', 'Band', 'Freq', 'Mode', '']]
+    for d in radio_states:
+        if d[7]:
+            activity = 'TX'
+        elif d[6]:
+            activity = 'Run'
+        else:
+            activity = 'S&P'
+        cells.append(['%s' % d[0]  # Station
+                     , '%s' % d[5]  # Operator
+                     , '%s' % d[3]  # Band
+                     , '%.1f' % (d[2] / 1000.0)  # Freq in kHz
+                     , '%s' % d[4]  # Mode
+                     , activity
+                     ])
+    return draw_table(size, cells, "Radio Status")
+
+
 def qso_operators_table(size, qso_operators):
     """
     create the Top 5 QSOs by Operators table
@@ -307,21 +328,17 @@ def qso_bands_graph(size, qso_band_modes):
     if qso_band_modes is None or len(qso_band_modes) == 0:
         return None, (0, 0)
 
-    labels = []
-    values = []
-    band_data = [[band, 0] for band in range(0, Bands.count())]
-    total = 0
-    for i in range(0, Bands.count()):
-        band_data[i][1] = qso_band_modes[i][1] + qso_band_modes[i][2] + qso_band_modes[i][3]
-        total += band_data[i][1]
-
-    if total == 0:
+    # QSOs of each band, over the simple modes
+    band_totals = numpy.asarray(qso_band_modes)[:, 1:].sum(axis=1)
+    if band_totals.sum() == 0:
         return None, (0, 0)
 
-    for bd in sorted(band_data[1:], key=lambda count: count[1], reverse=True):
-        if bd[1] > 0:
-            labels.append(Bands.BANDS_TITLE[bd[0]])
-            values.append(bd[1])
+    labels = []
+    values = []
+    for band_num in numpy.argsort(-band_totals[1:], kind='stable') + 1:
+        if band_totals[band_num] > 0:
+            labels.append(Bands.BANDS_TITLE[band_num])
+            values.append(int(band_totals[band_num]))
     return make_pie(size, values, labels, 'QSOs by Band')
 
 
@@ -332,22 +349,17 @@ def qso_modes_graph(size, qso_band_modes):
     if qso_band_modes is None or len(qso_band_modes) == 0:
         return None, (0, 0)
 
-    labels = []
-    values = []
-    mode_data = [[mode, 0] for mode in range(0, len(Modes.SIMPLE_MODES_LIST))]
-    total = 0
-    for i in range(0, Bands.count()):
-        for mode_num in range(1, len(Modes.SIMPLE_MODES_LIST)):
-            mode_data[mode_num][1] += qso_band_modes[i][mode_num]
-            total += qso_band_modes[i][mode_num]
-
-    if total == 0:
+    # QSOs of each simple mode, over all the bands
+    mode_totals = numpy.asarray(qso_band_modes).sum(axis=0)
+    if mode_totals[1:].sum() == 0:
         return None, (0, 0)
 
-    for md in sorted(mode_data[1:], key=lambda count: count[1], reverse=True):
-        if md[1] > 0:
-            labels.append(Modes.SIMPLE_MODES_LIST[md[0]])
-            values.append(md[1])
+    labels = []
+    values = []
+    for mode_num in numpy.argsort(-mode_totals[1:], kind='stable') + 1:
+        if mode_totals[mode_num] > 0:
+            labels.append(Modes.SIMPLE_MODES_LIST[mode_num])
+            values.append(int(mode_totals[mode_num]))
     return make_pie(size, values, labels, "QSOs by Mode")
 
 
@@ -355,18 +367,10 @@ def make_score_table(qso_band_modes):
     """
     create the score table from data
     """
-    cell_data = [[0 for m in Modes.SIMPLE_MODES_LIST] for b in Bands.BANDS_TITLE]
-
-    for band_num in range(1, Bands.count()):
-        for mode_num in range(1, len(Modes.SIMPLE_MODES_LIST)):
-            cell_data[band_num][mode_num] = qso_band_modes[band_num][mode_num]
-            cell_data[band_num][0] += qso_band_modes[band_num][mode_num]
-            cell_data[0][mode_num] += qso_band_modes[band_num][mode_num]
-
-    total = 0
-    for c in cell_data[0][1:]:
-        total += c
-    cell_data[0][0] = total
+    cell_data = numpy.zeros((Bands.count(), len(Modes.SIMPLE_MODES_LIST)), dtype=int)
+    cell_data[1:, 1:] = numpy.asarray(qso_band_modes)[1:, 1:]
+    cell_data[1:, 0] = cell_data[1:, 1:].sum(axis=1)
+    cell_data[0] = cell_data[1:].sum(axis=0)
 
     # the totals are in the 0th row and 0th column, move them to last.
     cell_text = [['', '   CW', 'Phone', ' Data', 'Total']]
@@ -396,6 +400,38 @@ def qso_summary_table(size, qso_band_modes):
     return draw_table(size, make_score_table(qso_band_modes), "QSOs Summary")
 
 
+def make_field_day_score_table(score):
+    """
+    create the Field Day score table from a scoring.Score: QSO points by band and mode, for the bands
+    with QSOs, then how the points make the score. QSOs logged without a known band score like the others,
+    so they get a No Band row and the rows add up to the points. each bonus claimed gets a row above the
+    total bonus.
+    """
+    cell_text = [['', '   CW', 'Phone', ' Data', 'Total']]
+    for band_num in range(Bands.count()):
+        row = score.band_mode_points[band_num]
+        if sum(row) > 0:
+            cell_text.append(['%5s' % Bands.BANDS_TITLE[band_num], *('%5d' % col for col in row[1:]),
+                              '%5d' % sum(row)])
+    mode_points = numpy.asarray(score.band_mode_points).sum(axis=0)
+    cell_text.append(['Points', *('%5d' % col for col in mode_points[1:]), '%5d' % score.points])
+    for title, value in (('QSOs', '%5d' % score.qsos), ('Dupes', '%5d' % score.dupes),
+                         ('Power', '   x%d' % score.power_multiplier),
+                         *((name.replace('_', ' ').title(), '%5d' % points) for name, points in score.bonus),
+                         ('Bonus', '%5d' % score.bonus_points), ('Score', '%5d' % score.score)):
+        cell_text.append([title, '', '', '', value])
+    return cell_text
+
+
+def field_day_score_table(size, score):
+    """
+    create the Field Day Score table
+    """
+    if score is None:
+        return None, (0, 0)
+    return draw_table(size, make_field_day_score_table(score), 'Field Day Score')
+
+
 def qso_rates_table(size, operator_qso_rates):
     """
     create the QSO Rates by Operator table
@@ -406,26 +442,37 @@ def qso_rates_table(size, operator_qso_rates):
         return draw_table(size, operator_qso_rates, "QSO/Hour Rates")
 
 
-def qso_rates_graph(size, qsos_per_hour):
+def qso_rates_graph(size, qso_rates_series):
     """
-    make the qsos per hour per band chart
+    make the qsos per hour per band chart from a timeseries.BucketSeries
     returns a pygame surface
     """
-    
-    title = 'QSOs per Hour by Band'
-    qso_counts = [[], [], [], [], [], [], [], [], [], []]
+    return series_rates_graph(size, qso_rates_series, 'QSOs per Hour by Band', Bands.BANDS_TITLE[1:],
+                              'QSO Rate/Hour')
+
+
+def score_rate_graph(size, score):
+    """
+    make the QSO points per hour per mode chart from the series of a scoring.Score
+    returns a pygame surface
+    """
+    if score is None:
+        return None, (0, 0)
+    return series_rates_graph(size, score.series, 'Points per Hour by Mode', Modes.SIMPLE_MODES_LIST[1:],
+                              'Points/Hour')
 
-    if qsos_per_hour is None or len(qsos_per_hour) == 0:
+
+def series_rates_graph(size, series, title, labels, ylabel):
+    """
+    make a stacked chart of the hourly rates of a timeseries.BucketSeries over the event, one layer per label
+    returns a pygame surface
+    """
+    if series is None or len(series) == 0:
         logging.debug('No QSOs so size will be invalid')
         return None, (0, 0)
 
-    data_valid = len(qsos_per_hour) != 0
+    data_valid = len(series) != 0
 
-    for qpm in qsos_per_hour:
-        for i in range(0, Bands.count()):
-            c = qpm[i]
-            cl = qso_counts[i]
-            cl.append(c)
     # TODO FIXME remove bands with no data here?
     logging.debug('make_plot(...,...,%s)', title)
     width_inches = size[0] / 100.0
@@ -439,24 +486,17 @@ def qso_rates_graph(size, qsos_per_hour):
 
     ax.set_title(title, color='white', size=48, weight='bold')
 
-    st = calendar.timegm(config.EVENT_START_TIME.timetuple())
-    lt = calendar.timegm(qsos_per_hour[-1][0].timetuple())
     if data_valid:
-        dates = matplotlib.dates.date2num(qso_counts[0])
-        labels = Bands.BANDS_TITLE[1:]
-        if lt < st:
-            start_date = dates[0]  # matplotlib.dates.date2num(qsos_per_hour[0][0].timetuple())
-            end_date = dates[-1]  # matplotlib.dates.date2num(qsos_per_hour[-1][0].timetuple())
-        else:
-            start_date = matplotlib.dates.date2num(config.EVENT_START_TIME)
-            end_date = matplotlib.dates.date2num(config.EVENT_END_TIME)
-        ax.set_xlim(start_date, end_date)
+        # the series covers the event, so the dates are evenly spaced from its start
+        start_date = matplotlib.dates.date2num(datetime.datetime.utcfromtimestamp(series.start))
+        bucket_days = series.bucket_seconds / 86400.0
+        dates = start_date + numpy.arange(len(series)) * bucket_days
+        ax.set_xlim(start_date, start_date + series.buckets * bucket_days)
 
-        ax.stackplot(dates, qso_counts[1], qso_counts[2], qso_counts[3], qso_counts[4], qso_counts[5], qso_counts[6],
-                     qso_counts[7], qso_counts[8], qso_counts[9], labels=labels, colors=mcolors.TABLEAU_COLORS,
+        ax.stackplot(dates, *series.rates(), labels=labels, colors=mcolors.TABLEAU_COLORS,
                      linewidth=0.2)
         ax.grid(True)
-        legend = ax.legend(loc='best', ncol=Bands.count() - 1)
+        legend = ax.legend(loc='best', ncol=len(labels))
         legend.get_frame().set_color((0, 0, 0, 0))
         legend.get_frame().set_edgecolor('w')
         for text in legend.get_texts():
@@ -467,7 +507,7 @@ def qso_rates_graph(size, qsos_per_hour):
         ax.spines['bottom'].set_color('w')
         ax.tick_params(axis='y', colors='w')
         ax.tick_params(axis='x', colors='w')
-        ax.set_ylabel('QSO Rate/Hour', color='w', size='x-large', weight='bold')
+        ax.set_ylabel(ylabel, color='w', size='x-large', weight='bold')
         ax.set_xlabel('UTC Hour', color='w', size='x-large', weight='bold')
         hour_locator = HourLocator()
         hour_formatter = DateFormatter('%H')
@@ -486,6 +526,52 @@ def qso_rates_graph(size, qsos_per_hour):
     return raw_data, canvas_size
 
 
+def score_graph(size, score_curve):
+    """
+    make the score over time chart from the dynamicresults score curve
+    returns a pygame surface
+    """
+    title = 'Score'
+    if score_curve is None or len(score_curve) == 0:
+        return None, (0, 0)
+
+    width_inches = size[0] / 100.0
+    height_inches = size[1] / 100.0
+    fig = plt.Figure(figsize=(width_inches, height_inches), dpi=100, tight_layout={'pad': 0.10}, facecolor='black')
+    ax = fig.add_subplot(111, facecolor='black')
+    ax.set_title('%s: %d' % (title, score_curve[-1][1]), color='white', size=48, weight='bold')
+
+    dates = matplotlib.dates.date2num([sample[0] for sample in score_curve])
+    scores = [sample[1] for sample in score_curve]
+    ax.step(dates, scores, where='post', color='#33cc33', linewidth=3)
+    if score_curve[-1][0] < config.EVENT_START_TIME or score_curve[0][0] > config.EVENT_END_TIME:
+        ax.set_xlim(dates[0], dates[-1] if dates[-1] > dates[0] else dates[0] + 1 / 24.0)
+    else:
+        ax.set_xlim(matplotlib.dates.date2num(config.EVENT_START_TIME),
+                    matplotlib.dates.date2num(config.EVENT_END_TIME))
+    ax.set_ylim(bottom=0)
+    ax.grid(True)
+    for spine in ('left', 'right', 'top', 'bottom'):
+        ax.spines[spine].set_color('w')
+    ax.tick_params(axis='y', colors='w')
+    ax.tick_params(axis='x', colors='w')
+    ax.set_ylabel('Score', color='w', size='x-large', weight='bold')
+    ax.set_xlabel('UTC Hour', color='w', size='x-large', weight='bold')
+    ax.xaxis.set_major_locator(HourLocator())
+    ax.xaxis.set_major_formatter(DateFormatter('%H'))
+    canvas = agg.FigureCanvasAgg(fig)
+    canvas.draw()
+    renderer = canvas.get_renderer()
+    if image_format == 'ARGB':
+        raw_data = renderer.tostring_argb()
+    else:
+        raw_data = renderer.tostring_rgb()
+
+    plt.close(fig)
+    canvas_size = canvas.get_width_height()
+    return raw_data, canvas_size
+
+
 def draw_table(size, cell_text, title, font=None):
     """
     draw a table
@@ -590,74 +676,13 @@ def draw_table(size, cell_text, title, font=None):
 
 def draw_map(size, qsos_by_section):
     """
-    make the choropleth with Cartopy & section shapefiles
+    make the choropleth with Cartopy & section shapefiles, from the layers sectionmap keeps for each size
     """
     logging.debug('draw_section map()')
-    width_inches = size[0] / 100.0
-    height_inches = size[1] / 100.0
-    fig = plt.Figure(figsize=(width_inches, height_inches), dpi=100, facecolor='black')
-
-    projection = ccrs.PlateCarree()
-    ax = fig.add_axes([0, 0, 1, 1], projection=projection)
-    ax.set_extent([-168, -52, 10, 60], ccrs.Geodetic())
-    ax.add_feature(cfeature.OCEAN, color='#000080')
-    ax.add_feature(cfeature.LAKES, color='#000080')
-    ax.add_feature(cfeature.LAND, color='#113311')
-
-    ax.coastlines('50m')
-    ax.annotate('Sections Worked', xy=(0.5, 1), xycoords='axes fraction', ha='center', va='top',
-                color='white', size=48, weight='bold')
-    
-    ax.text(0.83, 0, datetime.datetime.utcnow().strftime("%d %b %Y %H:%M %Zz"),
-            transform=ax.transAxes, style='italic', size=14, color='white')
-    ranges = [0, 1, 2, 10, 20, 50, 100]  # , 500]  # , 1000]
-    num_colors = len(ranges)
-    # color_palette = matplotlib.cm.viridis(np.linspace(0.33, 1, num_colors + 1))
-    delta = 1 / (num_colors + 1)
-    colors = [delta * i for i in range(num_colors+1)]
-    color_palette = matplotlib.cm.viridis(colors)
-
-    for section_name in CONTEST_SECTIONS.keys():
-        qsos = qsos_by_section.get(section_name)
-        if qsos is None:
-            qsos = 0
-
-        color_index = 0
-        for range_max in ranges:
-            if range_max == -1 or qsos <= range_max:
-                break
-            color_index += 1
-            if color_index == num_colors:
-                break
-
-        shape_file_name = 'shapes/{}.shp'.format(section_name)
-        reader = shapereader.Reader(shape_file_name)
-        shapes = reader.records()
-        while True:
-            shape = next(shapes, None)
-            if shape is None:
-                break
-            shape.attributes['name'] = section_name
-            section_color = 'k' if color_index == 0 else color_palette[color_index]
-            ax.add_geometries([shape.geometry], projection, linewidth=0.7, edgecolor="w", facecolor=section_color)
-
-    # show terminator
-    date = datetime.datetime.utcnow()  # this might have some timezone problems?
-    ax.add_feature(nightshade.Nightshade(date, alpha=0.5))
-
-    # show QTH marker
-    ax.plot(config.QTH_LONGITUDE, config.QTH_LATITUDE, '.', color='r')
-
-    canvas = agg.FigureCanvasAgg(fig)
-    canvas.draw()
-    renderer = canvas.get_renderer()
-    if image_format == 'ARGB':
-        raw_data = renderer.tostring_argb()
-    else:
-        raw_data = renderer.tostring_rgb()
-
-    fig.clf()
-    plt.close(fig)
-    canvas_size = canvas.get_width_height()
+    section_map = _maps.get(size)
+    if section_map is None:
+        map_class = sectionmap.RasterSectionMap if config.MAP_ENGINE == 'raster' else sectionmap.SectionMap
+        section_map = _maps[size] = map_class(size)
+    raw_data, canvas_size = section_map.render(qsos_by_section, image_format)
     logging.debug('draw_map() done')
     return raw_data, canvas_size
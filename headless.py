@@ -17,12 +17,23 @@ import time
 from config import Config
 import dataaccess
 import graphics
+import metrics
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2017 Jeffrey B. Otterson'
 __license__ = 'Simplified BSD'
 
 config = Config()
+
+LOAD_DATA_SECONDS = metrics.histogram('n1mm_headless_load_data_seconds',
+                                      'time to read the chart data from the database')
+CHART_RENDER_SECONDS = metrics.histogram('n1mm_headless_chart_render_seconds',
+                                         'time to render and save each chart', ('chart',))
+CHART_IMAGE_BYTES = metrics.gauge('n1mm_headless_chart_image_bytes',
+                                  'size of the last image of each chart', ('chart',))
+CREATE_IMAGES_SECONDS = metrics.histogram('n1mm_headless_create_images_seconds', 'time for one create_images pass')
+POST_COMMAND_SECONDS = metrics.histogram('n1mm_headless_post_command_seconds', 'time to run POST_FILE_COMMAND')
+
 #logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(module)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
 #                    level=config.LOG_LEVEL)
 #logging.Formatter.converter = time.gmtime
@@ -37,182 +48,74 @@ def makePNGTitle(image_dir, title):
     # return ''.join([image_dir, '/', re.sub('[^\w\-_]', '_', title), '.png'])
 
 
-def create_images(size, image_dir, last_qso_timestamp):
+def save_chart(image_dir, title, chart_function, *args):
+    """
+    render one chart and save it as title.png in image_dir, recording how long it took.
+    """
+    try:
+        t0 = time.monotonic()
+        image_data, image_size = chart_function(*args)
+        if image_data is not None:
+            filename = makePNGTitle(image_dir, title)
+            graphics.save_image(image_data, image_size, filename)
+            CHART_IMAGE_BYTES.set(len(image_data), chart=title)
+        CHART_RENDER_SECONDS.observe(time.monotonic() - t0, chart=title)
+    except Exception as e:
+        logging.exception(e)
+
+
+def create_images(size, image_dir, detector, running=None):
     """
     load data from the database tables
+    detector is the dataaccess.ChangeDetector that tells if the QSOs changed, its connection is used for the reads.
+    running is the caller's dataaccess.running_aggregates(), or None.
     """
     logging.debug('load data')
 
-    qso_operators = []
-    qso_stations = []
-    qso_band_modes = []
-    operator_qso_rates = []
-    qsos_per_hour = []
-    qsos_by_section = {}
-    qso_classes = []
-    qsos = []
-
-    db = None
     data_updated = False
 
     try:
-        logging.debug('connecting to database')
-        db = sqlite3.connect(config.DATABASE_FILENAME)
-        cursor = db.cursor()
-        logging.debug('database connected')
-
-        # Handy routine to dump the database to help debug strange problems
-        #if logging.getLogger().isEnabledFor(logging.DEBUG):
-        #   cursor.execute('SELECT timestamp, callsign, section, operator_id, operator.name FROM qso_log join operator WHERE operator.id = operator_id')
-        #  for row in cursor: 
-        #      logging.debug('QSO: %s\t%s\t%s\t%s\t%s' % (row[0], row[1], row[2], row[3], row[4])) 
-              
-        # get timestamp from the last record in the database
-        last_qso_time, message = dataaccess.get_last_qso(cursor)
-
-        logging.debug('old_timestamp = %s, timestamp = %s' % (last_qso_timestamp, last_qso_time))
+        t0 = time.monotonic()
+        qso_log_changed = detector.qso_log_changed()
+        logging.debug('qso_log changed = %s' % (qso_log_changed))
         if config.SKIP_TIMESTAMP_CHECK: 
            logging.warn('Skipping check for a recent QSO - Please just use this for debug - Review SKIP_TIMESTAMP_CHECK in ini file')
-        if last_qso_time != last_qso_timestamp or config.SKIP_TIMESTAMP_CHECK:
-            # last_qso_time is passed as the result and updated in call to this function.
-            logging.debug('data updated!')
-            data_updated = True
-
-            # load qso_operators
-            qso_operators = dataaccess.get_operators_by_qsos(cursor)
-
-            # load qso_stations -- maybe useless chartjunk
-            qso_stations = dataaccess.get_station_qsos(cursor)
-
-            # get something else.
-            qso_band_modes = dataaccess.get_qso_band_modes(cursor)
-
-            # load QSOs per Hour by Operator
-            operator_qso_rates = dataaccess.get_qsos_per_hour_per_operator(cursor, last_qso_time)
-
-            # load QSO rates per Hour by Band
-            qsos_per_hour, qsos_per_band = dataaccess.get_qsos_per_hour_per_band(cursor)
-
-            # load qso exchange data: what class are the other stations?
-            qso_classes = dataaccess.get_qso_classes(cursor)
-
-            # load QSOs by Section
-            qsos_by_section = dataaccess.get_qsos_by_section(cursor)
-            
-            # load last 10 qsos
-            qsos = dataaccess.get_last_N_qsos(cursor, 10) # Note this returns last 10 qsos in reverse order so oldest is first
-
+        data_updated = qso_log_changed or config.SKIP_TIMESTAMP_CHECK
+        # the QSO datasets are only read when qso_log changed, the rest every time.
+        snapshot = dataaccess.load_snapshot(detector.connection(), qsos=data_updated, running=running)
+        LOAD_DATA_SECONDS.observe(time.monotonic() - t0)
         logging.info('load data done')
     except sqlite3.OperationalError as error:
         logging.exception(error)
+        # open a fresh connection next time, and reload everything.
+        detector.close()
         return
-    finally:
-        if db is not None:
-            logging.debug('Closing DB')
-            cursor.close()
-            db.close()
-            db = None
 
     if data_updated:
-        try:
-            image_data, image_size = graphics.qso_summary_table(size, qso_band_modes)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_summary_table')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_rates_table(size, operator_qso_rates)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_rates_table')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_operators_graph(size, qso_operators)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_operators_graph')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_operators_table(size, qso_operators)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_operators_table')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_operators_table_all(size, qso_operators)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_operators_table_all')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)  
-        
-        try:
-            image_data, image_size = graphics.qso_stations_graph(size, qso_stations)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_stations_graph')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_bands_graph(size, qso_band_modes)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_bands_graph')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_modes_graph(size, qso_band_modes)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_modes_graph')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_classes_graph(size, qso_classes)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_classes_graph')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        
-        try:
-            image_data, image_size = graphics.qso_rates_graph(size, qsos_per_hour)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'qso_rates_graph')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-            
-        try:
-            image_data, image_size = graphics.qso_table(size, qsos)
-            if image_data is not None:
-               filename = makePNGTitle(image_dir, 'last_qso_table')
-               graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
+        save_chart(image_dir, 'qso_summary_table', graphics.qso_summary_table, size, snapshot.qso_band_modes)
+        save_chart(image_dir, 'qso_operators_graph', graphics.qso_operators_graph, size, snapshot.qso_operators)
+        save_chart(image_dir, 'qso_operators_table', graphics.qso_operators_table, size, snapshot.qso_operators)
+        save_chart(image_dir, 'qso_operators_table_all', graphics.qso_operators_table_all, size,
+                   snapshot.qso_operators)
+        save_chart(image_dir, 'qso_stations_graph', graphics.qso_stations_graph, size, snapshot.qso_stations)
+        save_chart(image_dir, 'qso_bands_graph', graphics.qso_bands_graph, size, snapshot.qso_band_modes)
+        save_chart(image_dir, 'qso_modes_graph', graphics.qso_modes_graph, size, snapshot.qso_band_modes)
+        save_chart(image_dir, 'qso_classes_graph', graphics.qso_classes_graph, size, snapshot.qso_classes)
+        save_chart(image_dir, 'qso_rates_graph', graphics.qso_rates_graph, size, snapshot.qsos_per_hour)
+        save_chart(image_dir, 'field_day_score_table', graphics.field_day_score_table, size, snapshot.score)
+        save_chart(image_dir, 'score_rate_graph', graphics.score_rate_graph, size, snapshot.score)
+        # last QSOs are oldest first
+        save_chart(image_dir, 'last_qso_table', graphics.qso_table, size, snapshot.last_qsos)
+
+    # the running rates move with the clock, so they are redrawn every time they are loaded
+    if snapshot.operator_qso_rates is not None:
+        save_chart(image_dir, 'qso_rates_table', graphics.qso_rates_table, size, snapshot.operator_qso_rates)
+    save_chart(image_dir, 'radio_status_table', graphics.radio_status_table, size, snapshot.radio_states)
+    save_chart(image_dir, 'score_graph', graphics.score_graph, size, snapshot.score_curve)
 
     # map gets updated every time so grey line moves
-    try:
-       # There is a memory leak in the next code -- is there?
-       image_data, image_size = graphics.draw_map(size, qsos_by_section)
-       if image_data is not None:
-          filename = makePNGTitle(image_dir, 'sections_worked_map')
-          graphics.save_image(image_data, image_size, filename)
-          gc.collect()
-
-    except Exception as e:
-        logging.exception(e)
+    save_chart(image_dir, 'sections_worked_map', graphics.draw_map, size, snapshot.qsos_by_section)
+    gc.collect()
 
     #if data_updated:   # Data is always updated since the sections map is always updated. Let rsync command handle this.
     if config.POST_FILE_COMMAND is not None:
@@ -221,9 +124,9 @@ def create_images(size, image_dir, last_qso_timestamp):
        #args=[]
        #args.append(config.POST_FILE_COMMAND)
        #subprocess.run(args,capture_output=False);
+       t0 = time.monotonic()
        os.system(config.POST_FILE_COMMAND)
-
-    return last_qso_time
+       POST_COMMAND_SECONDS.observe(time.monotonic() - t0)
 
 
 def main():
@@ -244,16 +147,22 @@ def main():
 #    base_map = graphics.create_map()
 
     run = True
-    last_qso_timestamp = '' 
+    detector = dataaccess.ChangeDetector()
+    running = dataaccess.running_aggregates()
+    metrics_server = metrics.start_server(config.METRICS_HEADLESS_PORT, 'headless')
     logging.info('headless running...')
     while run:
         try:
-            last_qso_timestamp = create_images(size, image_dir, last_qso_timestamp)
+            t0 = time.monotonic()
+            create_images(size, image_dir, detector, running)
+            CREATE_IMAGES_SECONDS.observe(time.monotonic() - t0)
             time.sleep(config.HEADLESS_DWELL_TIME)
         except KeyboardInterrupt:
             logging.info('Keyboard interrupt, shutting down...')
             run = False
 
+    detector.close()
+    metrics.stop_server(metrics_server)
     logging.info('headless shutdown...')
 
 
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+"""
+n1mm_view incremental
+QSO counts kept in memory by a long running reader, dashboard or headless. the counts start from the
+QSO count tables, then each refresh folds in only the changes to qso_log since the last one, read from
+the qso_change changelog, so a refresh costs in proportion to the new QSOs, not to the size of the log.
+used by dataaccess.load_snapshot when AGGREGATION_ENGINE = incremental.
+"""
+
+import collections
+import logging
+
+import constants
+import dataaccess
+import metrics
+import rates
+import scoring
+import timeseries
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+INCREMENTAL_CHANGES = metrics.counter('n1mm_incremental_changes_total', 'qso_log changes folded into the counts')
+INCREMENTAL_RELOADS = metrics.counter('n1mm_incremental_reloads_total',
+                                      'times the counts were reloaded from the QSO count tables')
+
+# the key of each QSO count table for a change row: (seq, sign, timestamp, band_id, mode_id,
+# operator_id, station_id, section_id, exchange_id, callsign). these match the expressions in dataaccess.AGGREGATES.
+AGGREGATE_KEYS = {
+    'qso_count_band_mode': lambda change: (change[3], change[4]),
+    'qso_count_operator': lambda change: (change[5],),
+    'qso_count_station': lambda change: (change[6],),
+    'qso_count_section': lambda change: (change[7],),
+    'qso_count_exchange': lambda change: (change[8],),
+    'qso_count_minute_band': lambda change: (change[2] // 60, change[3]),
+}
+NAME_TABLES = ('operator', 'station', 'section', 'exchange')
+
+
+class RunningAggregates:
+    """
+    the QSO count tables, in memory, as of changelog position seq, the QSO rates and the score.
+    """
+
+    def __init__(self):
+        self.seq = None
+        self.counts = {table: collections.Counter() for table in AGGREGATE_KEYS}
+        self.names = {table: {} for table in NAME_TABLES}
+        self.rates = rates.RateEngine()
+        self.series = timeseries.event_series()
+        self.scoring = scoring.ScoreEngine()
+
+    def load(self, cursor):
+        """
+        start over from the QSO count tables, and the rates and the score from qso_log.
+        call inside a read transaction, so the counts and the changelog position agree.
+        """
+        for table, columns in dataaccess.AGGREGATES:
+            cursor.execute(f'SELECT {dataaccess.aggregate_columns(columns)}, qso_count FROM {table} '
+                           f'WHERE qso_count != 0;')
+            self.counts[table] = collections.Counter({row[:-1]: row[-1] for row in cursor})
+        self.series = timeseries.event_series()
+        for (minute, band_id), count in self.counts['qso_count_minute_band'].items():
+            self.series.add(minute * 60, band_id, count)
+        self.seq = dataaccess.get_changelog_range(cursor)[1] or 0
+        self.rates.load(cursor)
+        self.scoring.load(cursor)
+        INCREMENTAL_RELOADS.inc()
+        logging.debug(f'QSO counts loaded at changelog position {self.seq}')
+
+    def in_step(self, first, last):
+        """
+        True if the changes after seq are all still in the changelog, which spans first to last.
+        """
+        if self.seq is None or (last or 0) < self.seq:
+            return False
+        return first is None or first <= self.seq + 1
+
+    def check_total(self, cursor):
+        """
+        True if the QSO total agrees with the QSO count tables.
+        """
+        cursor.execute('SELECT COALESCE(SUM(qso_count), 0) FROM qso_count_station;')
+        return cursor.fetchone()[0] == sum(self.counts['qso_count_station'].values())
+
+    def fold(self, changes):
+        for change in changes:
+            self.rates.add_change(change)
+            self.scoring.add_change(change)
+            self.series.add(change[2] // 60 * 60, change[3], change[1])
+            sign = change[1]
+            for table, key in AGGREGATE_KEYS.items():
+                counter = self.counts[table]
+                k = key(change)
+                counter[k] += sign
+                if counter[k] == 0:
+                    del counter[k]
+        if changes:
+            self.seq = changes[-1][0]
+            INCREMENTAL_CHANGES.inc(len(changes))
+
+    def load_names(self, cursor):
+        """
+        names are only ever added, so read the ones after the highest id already known.
+        """
+        for table, names in self.names.items():
+            cursor.execute(f'SELECT id, name FROM {table} WHERE id > ?;', (max(names, default=0),))
+            names.update(cursor.fetchall())
+
+    def refresh(self, cursor):
+        """
+        bring the counts up to date. call inside a read transaction.
+        returns the number of changes folded in, None if the counts were reloaded.
+        """
+        folded = None
+        first, last = dataaccess.get_changelog_range(cursor)
+        if self.in_step(first, last):
+            changes = dataaccess.get_changes(cursor, self.seq) if last is not None and last > self.seq else []
+            self.fold(changes)
+            folded = len(changes)
+        # the QSO total catches what the changelog cannot show: a replaced database, rebuilt count tables,
+        # or a collector too old to write the changelog.
+        if folded is None or not self.check_total(cursor):
+            self.load(cursor)
+            folded = None
+        self.load_names(cursor)
+        return folded
+
+    def named_counts(self, table, name_table):
+        names = self.names[name_table]
+        return [(names.get(key[0], ''), count) for key, count in self.counts[table].items() if count > 0]
+
+    def operator_rates(self, now):
+        return self.rates.operator_table(self.names['operator'], now)
+
+    def total_rates(self, now):
+        return self.rates.rates(('total',), now)
+
+    def score(self):
+        return self.scoring.score()
+
+    def qso_band_modes(self):
+        qso_band_modes = [[0] * len(constants.Modes.SIMPLE_MODES_LIST) for _ in constants.Bands.BANDS_LIST]
+        for (band_id, mode_id), count in self.counts['qso_count_band_mode'].items():
+            qso_band_modes[band_id][constants.Modes.MODE_TO_SIMPLE_MODE[mode_id]] += count
+        return qso_band_modes
+
+    def operators_by_qsos(self):
+        return sorted(self.named_counts('qso_count_operator', 'operator'), key=lambda item: item[1], reverse=True)
+
+    def station_qsos(self):
+        return self.named_counts('qso_count_station', 'station')
+
+    def qso_classes(self):
+        return [(count, name) for name, count in self.named_counts('qso_count_exchange', 'exchange')]
+
+    def qsos_by_section(self):
+        return dict(self.named_counts('qso_count_section', 'section'))
+
+    def qsos_per_hour_per_band(self):
+        """
+        a copy of the QSOs per hour by band series, so the snapshot does not change with the next refresh,
+        and the QSOs by band.
+        """
+        qsos_by_band = [0] * constants.Bands.count()
+        for (band_id, mode_id), count in self.counts['qso_count_band_mode'].items():
+            qsos_by_band[band_id] += count
+        return self.series.copy(), qsos_by_band
@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+"""
+n1mm_view journal
+an append-only journal of the raw datagrams received by the collector, written before they are queued
+for the message processor. if the message processor dies, the datagrams it lost are still in the journal,
+and the next collector start replays them. the journal can also rebuild the database from scratch.
+only the messages that make up the QSO log and the score log are journaled, see JOURNALED_MESSAGES;
+RadioInfo, the bulk of the traffic, is current state that the radios send again every second.
+
+each collector start is a run, and each receiver in the run writes its own stream of segment files:
+    <JOURNAL_DIR>/<run>-<stream>-<segment>.journal
+a segment starts with MAGIC, followed by records of a RECORD_HEADER and the datagram.
+once every message of a run is known to be in the database, each stream of the run gets a CLOSED record
+at its end; a run with a stream that does not end with one did not shut down cleanly.
+while the run is going, the message processor writes a checkpoint file, <JOURNAL_DIR>/<run>.checkpoint,
+holding a time before which every datagram of the run is in the database, so a replay starts there.
+closed runs older than JOURNAL_RETENTION_DAYS are deleted when the collector starts.
+"""
+
+import glob
+import heapq
+import logging
+import os
+import re
+import struct
+import time
+import zlib
+
+from config import Config
+import metrics
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+config = Config()
+
+MAGIC = b'N1MMJRN1'
+RECORD_HEADER = struct.Struct('<BIdI')  # kind, length, time received, crc32 of the datagram
+DATAGRAM = 1
+CLOSED = 2
+SEGMENT_NAME_PATTERN = re.compile(r'^(\d{6})-(\w+)-(\d{5})\.journal$')
+CHECKPOINT_FORMAT = struct.Struct('<d')  # time received
+# the message types replayed into the database, found near the start of the datagram
+JOURNALED_MESSAGES = (b'<contactinfo', b'<contactreplace', b'<contactdelete', b'<dynamicresults')
+
+JOURNAL_RECORDS = metrics.counter('n1mm_journal_records_total', 'datagrams written to the journal')
+JOURNAL_BYTES = metrics.counter('n1mm_journal_bytes_total', 'bytes written to the journal')
+JOURNAL_FSYNC_SECONDS = metrics.histogram('n1mm_journal_fsync_seconds', 'time to flush and fsync the journal')
+
+
+def segment_filename(directory, run, stream, segment):
+    return os.path.join(directory, f'{run:06d}-{stream}-{segment:05d}.journal')
+
+
+def checkpoint_filename(directory, run):
+    return os.path.join(directory, f'{run:06d}.checkpoint')
+
+
+def is_journaled(data):
+    head = data[:128]
+    return any(tag in head for tag in JOURNALED_MESSAGES)
+
+
+def list_runs(directory):
+    """
+    return {run: {stream: [segment filenames in order]}} for the journal files in directory.
+    """
+    runs = {}
+    for filename in glob.glob(os.path.join(directory, '*.journal')):
+        match = SEGMENT_NAME_PATTERN.match(os.path.basename(filename))
+        if match is None:
+            continue
+        run, stream, segment = int(match.group(1)), match.group(2), int(match.group(3))
+        runs.setdefault(run, {}).setdefault(stream, []).append((segment, filename))
+    return {run: {stream: [filename for segment, filename in sorted(segments)]
+                  for stream, segments in streams.items()}
+            for run, streams in runs.items()}
+
+
+def next_run(directory):
+    """
+    return the number for a new run, one more than the last run in directory.
+    """
+    runs = list_runs(directory)
+    return max(runs) + 1 if runs else 1
+
+
+class JournalWriter:
+    """
+    append datagrams to one stream of the journal.
+    records are written through a buffered file and synced to disk at most every fsync_interval seconds,
+    so a crash loses at most that much of the journal. an fsync_interval of 0 syncs every record.
+    """
+
+    def __init__(self, directory, run, stream, segment_size, fsync_interval):
+        self.directory = directory
+        self.run = run
+        self.stream = stream
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.segment = 0
+        self.file = None
+        self.size = 0
+        self.dirty = False
+        self.next_sync = 0.0
+        self.failed = False
+        os.makedirs(directory, exist_ok=True)
+
+    def open_segment(self):
+        self.segment += 1
+        filename = segment_filename(self.directory, self.run, self.stream, self.segment)
+        self.file = open(filename, 'xb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+        logging.debug(f'journal segment {filename} opened')
+
+    def write_record(self, kind, data, received):
+        if self.file is None or self.size >= self.segment_size:
+            if self.file is not None:
+                self.sync()
+                self.file.close()
+            self.open_segment()
+        self.file.write(RECORD_HEADER.pack(kind, len(data), received, zlib.crc32(data)))
+        self.file.write(data)
+        self.size += RECORD_HEADER.size + len(data)
+        if not self.dirty:
+            self.dirty = True
+            self.next_sync = time.monotonic() + self.fsync_interval
+
+    def append(self, data, received=None):
+        """
+        append one received datagram, if it is one of the JOURNALED_MESSAGES. a journal that cannot be
+        written is logged once and then ignored, the collector keeps running without it.
+        """
+        if self.failed or not is_journaled(data):
+            return
+        try:
+            self.write_record(DATAGRAM, data, time.time() if received is None else received)
+            JOURNAL_RECORDS.inc()
+            JOURNAL_BYTES.inc(RECORD_HEADER.size + len(data))
+            self.sync_if_due()
+        except OSError as error:
+            logging.error(f'cannot write journal, journaling stopped: {error}')
+            self.failed = True
+
+    def sync_if_due(self):
+        if self.dirty and time.monotonic() >= self.next_sync:
+            self.sync()
+
+    def sync(self):
+        if self.file is None or not self.dirty:
+            return
+        t0 = time.monotonic()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        JOURNAL_FSYNC_SECONDS.observe(time.monotonic() - t0)
+        self.dirty = False
+
+    def close(self):
+        """
+        sync and close the stream. the stream is marked closed later, by mark_closed, once the
+        collector knows its messages were written to the database.
+        """
+        if self.file is None:
+            return
+        try:
+            self.sync()
+            self.file.close()
+        except OSError as error:
+            logging.error(f'cannot close journal: {error}')
+        self.file = None
+
+
+def open_writer(run, stream):
+    """
+    return a JournalWriter for stream in run, or None when the journal is disabled.
+    """
+    if not config.JOURNAL_ENABLED or run is None:
+        return None
+    return JournalWriter(config.JOURNAL_DIR, run, stream, config.JOURNAL_SEGMENT_SIZE,
+                         config.JOURNAL_FSYNC_INTERVAL)
+
+
+def read_segment(filename):
+    """
+    yield (kind, received, data, end offset) for each intact record in a segment.
+    reading stops at the first torn or corrupt record, which is where a crash left the segment.
+    """
+    with open(filename, 'rb') as segment:
+        if segment.read(len(MAGIC)) != MAGIC:
+            logging.warning(f'{filename} is not a journal segment')
+            return
+        while True:
+            header = segment.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, length, received, crc = RECORD_HEADER.unpack(header)
+            data = segment.read(length)
+            if len(data) < length or zlib.crc32(data) != crc or kind not in (DATAGRAM, CLOSED):
+                offset = segment.tell() - len(data) - len(header)
+                logging.warning(f'{filename} has a damaged record at offset {offset}, ignoring the rest of it')
+                return
+            yield kind, received, data, segment.tell()
+
+
+def read_stream(filenames):
+    """
+    yield (received, data) for every datagram in a stream's segments.
+    """
+    for filename in filenames:
+        for kind, received, data, end in read_segment(filename):
+            if kind == DATAGRAM:
+                yield received, data
+
+
+def stream_closed(filenames):
+    """
+    True if the stream's last record is a CLOSED record.
+    """
+    closed = False
+    for kind, received, data, end in read_segment(filenames[-1]):
+        closed = kind == CLOSED
+    return closed
+
+
+def unclean_runs(directory, before_run):
+    """
+    return the runs before before_run that have a stream that was not closed cleanly, oldest first.
+    """
+    runs = list_runs(directory)
+    return [run for run in sorted(runs)
+            if run < before_run and not all(stream_closed(filenames) for filenames in runs[run].values())]
+
+
+def read_runs(directory, runs, since=0.0):
+    """
+    yield (received, data) for every datagram in the given runs received at or after since, oldest run first.
+    the streams of each run, one per receive worker, are merged in the order the datagrams were received.
+    """
+    all_runs = list_runs(directory)
+    for run in runs:
+        streams = all_runs.get(run, {}).values()
+        for record in heapq.merge(*(read_stream(filenames) for filenames in streams), key=lambda record: record[0]):
+            if record[0] >= since:
+                yield record
+
+
+def write_checkpoint(directory, run, received):
+    """
+    record that every datagram of run received before received is in the database.
+    the file is replaced whole, so a crash leaves the old checkpoint or the new one.
+    """
+    filename = checkpoint_filename(directory, run)
+    temporary_filename = filename + '.tmp'
+    try:
+        with open(temporary_filename, 'wb') as checkpoint:
+            checkpoint.write(CHECKPOINT_FORMAT.pack(received))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temporary_filename, filename)
+    except OSError as error:
+        logging.warning(f'cannot write journal checkpoint {filename}: {error}')
+
+
+def read_checkpoint(directory, run):
+    """
+    the time of run's checkpoint, or 0.0 when it has none, so the whole run is replayed.
+    """
+    try:
+        with open(checkpoint_filename(directory, run), 'rb') as checkpoint:
+            received, = CHECKPOINT_FORMAT.unpack(checkpoint.read(CHECKPOINT_FORMAT.size))
+        return received
+    except (OSError, struct.error):
+        return 0.0
+
+
+def prune_runs(directory, before_run, days):
+    """
+    delete the closed runs before before_run whose last segment was written more than days ago,
+    with their checkpoints. runs that did not shut down cleanly are kept to be replayed.
+    """
+    oldest = time.time() - days * 86400
+    pruned = 0
+    for run, streams in sorted(list_runs(directory).items()):
+        if run >= before_run:
+            continue
+        filenames = [filename for segments in streams.values() for filename in segments]
+        try:
+            if max(os.path.getmtime(filename) for filename in filenames) > oldest:
+                continue
+            if not all(stream_closed(segments) for segments in streams.values()):
+                continue
+            for filename in filenames + [checkpoint_filename(directory, run)]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+        except OSError as error:
+            logging.warning(f'cannot delete journal run {run}: {error}')
+            continue
+        pruned += 1
+    if pruned:
+        logging.info(f'deleted {pruned} closed journal runs older than {days} days')
+
+
+def mark_closed(directory, run):
+    """
+    close every stream of run that was not closed cleanly: cut off any torn record at the end of the
+    last segment, and append a CLOSED record.
+    """
+    for stream, filenames in list_runs(directory).get(run, {}).items():
+        filename = filenames[-1]
+        end = len(MAGIC)
+        closed = False
+        for kind, received, data, end in read_segment(filename):
+            closed = kind == CLOSED
+        if closed:
+            continue
+        with open(filename, 'r+b') as segment:
+            if segment.read(len(MAGIC)) != MAGIC:  # the crash came before the segment was started
+                segment.seek(0)
+                segment.write(MAGIC)
+            segment.truncate(end)
+            segment.seek(end)
+            segment.write(RECORD_HEADER.pack(CLOSED, 0, time.time(), zlib.crc32(b'')))
+            segment.flush()
+            os.fsync(segment.fileno())
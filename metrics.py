@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+"""
+n1mm_view metrics
+counters, gauges and histograms kept in memory, and a small HTTP endpoint on localhost that
+serves them in the prometheus text format. collector, dashboard and headless each have their own port.
+child processes cannot share the registry, so they send snapshots of it to the process that
+owns the endpoint, and the snapshots are served with a process label.
+"""
+
+import bisect
+import http.server
+import logging
+import queue
+import threading
+import time
+
+from config import Config
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+config = Config()
+
+PUBLISH_INTERVAL = 5  # seconds between snapshots sent by a child process
+# latency buckets in seconds, from a fraction of a millisecond to a slow chart render
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    """
+    a named metric with zero or more labels. values are kept per tuple of label values.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """
+        return a list of (sample name, ((label, value), ...), value) for this metric.
+        """
+        with self.lock:
+            return [(self.name, tuple(zip(self.labelnames, key)), value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # per bucket counts (the last one is +Inf), sum, count
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.values[key] = state
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = tuple(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    result.append((self.name + '_bucket', labels + (('le', format_value(bound)),), cumulative))
+                result.append((self.name + '_sum', labels, total))
+                result.append((self.name + '_count', labels, count))
+        return result
+
+
+class Registry:
+    """
+    the metrics of this process, plus the latest snapshot received from each child process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.snapshots = {}
+
+    def register(self, metric_class, name, help_text, labelnames=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, help_text, labelnames, **kwargs)
+                self.metrics[name] = metric
+            return metric
+
+    def collect(self):
+        """
+        return a picklable snapshot of this process's metrics:
+        a list of (name, kind, help, samples)
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return [(metric.name, metric.kind, metric.help_text, metric.samples()) for metric in metrics]
+
+    def add_snapshot(self, source, families):
+        with self.lock:
+            self.snapshots[source] = families
+
+    def render(self, source):
+        """
+        render this process's metrics and the child snapshots as prometheus text.
+        every sample is labelled with the process it came from.
+        """
+        with self.lock:
+            sources = [(source, None)] + list(self.snapshots.items())
+        merged = {}
+        for source_name, families in sources:
+            if families is None:
+                families = self.collect()
+            for name, kind, help_text, samples in families:
+                family = merged.setdefault(name, (kind, help_text, []))
+                for sample_name, labels, value in samples:
+                    family[2].append((sample_name, (('process', source_name),) + tuple(labels), value))
+        lines = []
+        for name, (kind, help_text, samples) in sorted(merged.items()):
+            lines.append(f'# HELP {name} {escape_help(help_text)}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                label_text = ','.join(f'{label}="{escape_label(label_value)}"' for label, label_value in labels)
+                lines.append(f'{sample_name}{{{label_text}}} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labelnames=()):
+    return REGISTRY.register(Counter, name, help_text, labelnames)
+
+
+def gauge(name, help_text, labelnames=()):
+    return REGISTRY.register(Gauge, name, help_text, labelnames)
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+
+def escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def escape_label(text):
+    return str(text).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    source = None
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render(self.source).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('metrics request: ' + format % args)
+
+
+def start_server(port, source):
+    """
+    serve the metrics at http://127.0.0.1:port/metrics from a daemon thread, if metrics are enabled.
+    source names this process in the process label.
+    returns the server, or None.
+    """
+    if not config.METRICS_ENABLED:
+        return None
+    handler = type('MetricsHandler', (MetricsRequestHandler,), {'source': source})
+    try:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    except OSError as error:
+        logging.error(f'cannot start metrics endpoint on port {port}: {error}')
+        return None
+    server.daemon_threads = True
+    thread = threading.Thread(name='metrics-server', target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info(f'metrics available at http://127.0.0.1:{port}/metrics')
+    return server
+
+
+def stop_server(server):
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
+def publish_snapshots(q, source):
+    """
+    in a child process, send a snapshot of the registry to q every PUBLISH_INTERVAL seconds.
+    the snapshots are dropped if the parent is not reading them.
+    """
+    def publisher():
+        while True:
+            time.sleep(PUBLISH_INTERVAL)
+            try:
+                q.put_nowait((source, REGISTRY.collect()))
+            except queue.Full:
+                pass
+
+    # do not hold up process exit for a snapshot the parent will never read.
+    q.cancel_join_thread()
+    threading.Thread(name='metrics-publisher', target=publisher, daemon=True).start()
+
+
+def receive_snapshots(q):
+    """
+    in the process that serves the metrics, collect the snapshots sent by publish_snapshots.
+    """
+    def receiver():
+        while True:
+            source, families = q.get()
+            REGISTRY.add_snapshot(source, families)
+
+    threading.Thread(name='metrics-receiver', target=receiver, daemon=True).start()
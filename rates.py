@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+"""
+n1mm_view rates
+sliding window QSO rates for the station and for each operator, station, band and mode.
+each key has a ring of QSO counts per minute for the last RING_MINUTES minutes, with a running sum for
+each of RATE_WINDOWS, so adding a QSO or moving the windows along costs the same however long the log is.
+the windows are moved to the wall clock when the rates are read, so the rates fall off when the band dies.
+kept up to date by incremental.RunningAggregates from the qso_log changes.
+"""
+
+import constants
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+RING_MINUTES = 60
+RATE_WINDOWS = (1, 10, 60)  # minutes, the last one is the hour the best hour is taken over
+RATE_TITLES = ('Now', '10 min', 'Hour', 'Best')
+OPERATOR_RATES_COUNT = 10  # operators in the rates table
+# the kinds of key, and the qso_log column each is counted by when loading
+LOAD_COLUMNS = (('total', None), ('operator', 'operator_id'), ('station', 'station_id'), ('band', 'band_id'),
+                ('mode', 'mode_id'))
+
+
+class RateWindow:
+    """
+    QSO counts for one key by minute, for the RING_MINUTES minutes up to minute, and the best hour: the most
+    QSOs in any RATE_WINDOWS[-1] minutes. history keeps the count of every minute with QSOs, so when a QSO
+    is removed from the hour that set the best, the best hour is found again from it instead of staying
+    higher than the log supports.
+    """
+    __slots__ = ('counts', 'minute', 'sums', 'best', 'best_minute', 'history')
+
+    def __init__(self, minute):
+        self.counts = [0] * RING_MINUTES
+        self.minute = minute
+        self.sums = [0] * len(RATE_WINDOWS)
+        self.best = 0
+        self.best_minute = None  # the last minute of the best hour
+        self.history = {}  # minute: QSOs
+
+    def advance(self, minute):
+        """
+        move the windows forward to end at minute, dropping the minutes that fall out of each.
+        """
+        if minute <= self.minute:
+            return
+        if minute - self.minute >= RING_MINUTES:
+            self.counts = [0] * RING_MINUTES
+            self.sums = [0] * len(RATE_WINDOWS)
+        else:
+            for m in range(self.minute + 1, minute + 1):
+                for i, window in enumerate(RATE_WINDOWS):
+                    self.sums[i] -= self.counts[(m - window) % RING_MINUTES]
+                self.counts[m % RING_MINUTES] = 0
+        self.minute = minute
+
+    def add(self, minute, count):
+        """
+        add count QSOs, -1 for a QSO removed, at minute. QSOs older than the ring are not counted in the windows.
+        """
+        self.advance(minute)
+        total = self.history.get(minute, 0) + count
+        if total > 0:
+            self.history[minute] = total
+        else:
+            self.history.pop(minute, None)
+        if count < 0 and self.best_minute is not None and 0 <= self.best_minute - minute < RATE_WINDOWS[-1]:
+            self.find_best()
+        age = self.minute - minute
+        if age >= RING_MINUTES:
+            return
+        self.counts[minute % RING_MINUTES] += count
+        for i, window in enumerate(RATE_WINDOWS):
+            if age < window:
+                self.sums[i] += count
+        if self.sums[-1] > self.best:
+            self.best = self.sums[-1]
+            self.best_minute = self.minute
+
+    def find_best(self):
+        """
+        find the best hour again from history.
+        """
+        self.best = 0
+        self.best_minute = None
+        minutes = sorted(self.history)
+        total = 0
+        first = 0
+        for minute in minutes:
+            total += self.history[minute]
+            while minutes[first] <= minute - RATE_WINDOWS[-1]:
+                total -= self.history[minutes[first]]
+                first += 1
+            if total > self.best:
+                self.best = total
+                self.best_minute = minute
+
+    def rates(self, minute):
+        """
+        QSOs per hour in each of RATE_WINDOWS ending at minute, and the best hour.
+        """
+        self.advance(minute)
+        return tuple(int(total * 60 / window) for total, window in zip(self.sums, RATE_WINDOWS)) + (self.best,)
+
+
+class RateEngine:
+    """
+    a RateWindow for the station, ('total',), and for each ('operator', operator_id), ('station', station_id),
+    ('band', band_id) and ('mode', simple mode).
+    """
+
+    def __init__(self):
+        self.windows = {}
+        self.last_minute = 0
+
+    def add_minute(self, key, minute, count):
+        if minute > self.last_minute:
+            self.last_minute = minute
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = RateWindow(minute)
+        window.add(minute, count)
+
+    def add(self, timestamp, band_id, mode_id, operator_id, station_id, count=1):
+        minute = timestamp // 60
+        for key in (('total',), ('operator', operator_id), ('station', station_id), ('band', band_id),
+                    ('mode', constants.Modes.MODE_TO_SIMPLE_MODE[mode_id])):
+            self.add_minute(key, minute, count)
+
+    def add_change(self, change):
+        """
+        add a qso_change row: (seq, sign, timestamp, band_id, mode_id, operator_id, station_id, ...).
+        """
+        self.add(change[2], change[3], change[4], change[5], change[6], change[1])
+
+    def load(self, cursor):
+        """
+        start over from qso_log, counted by minute for each kind of key, in time order so the best hours are found.
+        """
+        self.windows = {}
+        self.last_minute = 0
+        for kind, column in LOAD_COLUMNS:
+            grouping = 'minute' if column is None else f'minute, {column}'
+            cursor.execute(f'SELECT timestamp / 60 AS minute, {column or "NULL"}, COUNT(*) FROM qso_log '
+                           f'GROUP BY {grouping} ORDER BY minute;')
+            for minute, value, count in cursor:
+                if kind == 'total':
+                    key = (kind,)
+                elif kind == 'mode':
+                    key = (kind, constants.Modes.MODE_TO_SIMPLE_MODE[value])
+                else:
+                    key = (kind, value)
+                self.add_minute(key, minute, count)
+
+    def now_minute(self, now):
+        """
+        the minute the windows end at: now, or the last QSO when now is None.
+        """
+        if now is None:
+            return self.last_minute
+        return int(now) // 60
+
+    def rates(self, key, now=None):
+        """
+        the rates for key as a tuple in the order of RATE_TITLES, zeros for a key with no QSOs.
+        """
+        window = self.windows.get(key)
+        if window is None:
+            return (0,) * len(RATE_TITLES)
+        return window.rates(self.now_minute(now))
+
+    def operator_table(self, operator_names, now=None):
+        """
+        the QSO rates table: the busiest OPERATOR_RATES_COUNT operators of the last hour, then the station.
+        """
+        minute = self.now_minute(now)
+        operator_rates = []
+        for key, window in self.windows.items():
+            if key[0] == 'operator':
+                rates = window.rates(minute)
+                if rates[-2] > 0:
+                    operator_rates.append((operator_names.get(key[1], ''), rates))
+        operator_rates.sort(key=lambda item: item[1][1:3], reverse=True)
+        table = [['Operator', *RATE_TITLES]]
+        for name, rates in operator_rates[:OPERATOR_RATES_COUNT]:
+            table.append([name, *('%4d' % rate for rate in rates)])
+        table.append(['Total', *('%4d' % rate for rate in self.rates(('total',), now))])
+        return table
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+"""
+n1mm_view scoring
+the Field Day score: QSO points by band and mode, counting a station once per band and mode, times the
+power multiplier, plus the bonus points, both from the [SCORING INFO] and [BONUS POINTS] sections of the ini.
+ScoreEngine keeps the score up to date one QSO at a time, kept by incremental.RunningAggregates from the
+qso_log changes. compute_score recomputes it from the whole log, for the sql and numpy engines and to check
+the engine against, see dbtool.py score.
+"""
+
+import collections
+
+import constants
+from config import Config
+import timeseries
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+config = Config()
+
+# band_mode_qsos and band_mode_points are [band_id][simple mode] without the dupes, dupes is the QSOs logged
+# again on a band and mode. bonus is the (name, points) of each [BONUS POINTS] entry, bonus_points their sum.
+# series is a timeseries.BucketSeries of QSO points by simple mode, each QSO counted at the time of the first
+# QSO with that station on its band and mode.
+Score = collections.namedtuple('Score', (
+    'band_mode_qsos', 'band_mode_points', 'qsos', 'dupes', 'points', 'power_multiplier', 'bonus', 'bonus_points',
+    'score', 'series'))
+
+
+def points_series():
+    """
+    an empty BucketSeries of QSO points by simple mode for the event.
+    """
+    series = timeseries.event_series()
+    return timeseries.BucketSeries(series.start, series.end(), series.bucket_seconds,
+                                   len(constants.Modes.SIMPLE_MODES_LIST))
+
+
+def make_score(band_mode_qsos, logged, series):
+    """
+    the Score of the QSOs counted in band_mode_qsos, out of logged QSOs, with the ini's multiplier and bonus.
+    """
+    band_mode_points = [[qsos * mode_points for qsos, mode_points in zip(row, constants.Modes.SIMPLE_MODE_POINTS)]
+                        for row in band_mode_qsos]
+    qsos = sum(map(sum, band_mode_qsos))
+    points = sum(map(sum, band_mode_points))
+    bonus = tuple(config.SCORE_BONUS_POINTS.items())
+    bonus_points = sum(config.SCORE_BONUS_POINTS.values())
+    return Score(band_mode_qsos, band_mode_points, qsos, logged - qsos, points, config.SCORE_POWER_MULTIPLIER,
+                 bonus, bonus_points, points * config.SCORE_POWER_MULTIPLIER + bonus_points, series)
+
+
+def empty_band_modes():
+    return [[0] * len(constants.Modes.SIMPLE_MODES_LIST) for _ in constants.Bands.BANDS_LIST]
+
+
+class ScoreEngine:
+    """
+    the times of the QSOs with each station by band and simple mode, the first of which counts.
+    """
+
+    def __init__(self):
+        self.contacts = {}
+        self.band_mode_qsos = empty_band_modes()
+        self.logged = 0
+        self.series = points_series()
+
+    def add(self, callsign, band_id, mode_id, timestamp, count=1):
+        """
+        add a QSO, or remove it when count is -1. only the first QSO with a station on a band and mode scores,
+        so a QSO changes the score when it is the first, or when it was the first and is removed.
+        """
+        mode = constants.Modes.MODE_TO_SIMPLE_MODE[mode_id]
+        key = (callsign, band_id, mode)
+        points = constants.Modes.SIMPLE_MODE_POINTS[mode]
+        times = self.contacts.get(key)
+        if count > 0:
+            self.logged += 1
+            if times is None:
+                self.contacts[key] = [timestamp]
+                self.band_mode_qsos[band_id][mode] += 1
+                self.series.add(timestamp, mode, points)
+                return
+            first = min(times)
+            times.append(timestamp)
+            if timestamp < first:
+                self.series.add(first, mode, -points)
+                self.series.add(timestamp, mode, points)
+        elif times is not None and timestamp in times:
+            self.logged -= 1
+            first = min(times)
+            times.remove(timestamp)
+            if not times:
+                del self.contacts[key]
+                self.band_mode_qsos[band_id][mode] -= 1
+                self.series.add(first, mode, -points)
+            elif min(times) != first:
+                self.series.add(first, mode, -points)
+                self.series.add(min(times), mode, points)
+
+    def add_change(self, change):
+        """
+        add a qso_change row: (seq, sign, timestamp, band_id, mode_id, ..., callsign).
+        """
+        self.add(change[9], change[3], change[4], change[2], change[1])
+
+    def load(self, cursor):
+        """
+        start over from qso_log.
+        """
+        self.contacts = {}
+        self.band_mode_qsos = empty_band_modes()
+        self.logged = 0
+        self.series = points_series()
+        cursor.execute('SELECT callsign, band_id, mode_id, timestamp FROM qso_log;')
+        for row in cursor:
+            self.add(*row)
+
+    def score(self):
+        """
+        the Score now, with its own copies of the counts, so it does not change with the next QSO.
+        """
+        return make_score([list(row) for row in self.band_mode_qsos], self.logged, self.series.copy())
+
+
+def compute_score(cursor):
+    """
+    compute the Score from the whole of qso_log, grouped in SQL.
+    """
+    first_times = {}
+    logged = 0
+    cursor.execute('SELECT callsign, band_id, mode_id, MIN(timestamp), COUNT(*) FROM qso_log \n'
+                   'GROUP BY callsign, band_id, mode_id;')
+    for callsign, band_id, mode_id, timestamp, count in cursor:
+        key = (callsign, band_id, constants.Modes.MODE_TO_SIMPLE_MODE[mode_id])
+        first_times[key] = min(timestamp, first_times.get(key, timestamp))
+        logged += count
+    band_mode_qsos = empty_band_modes()
+    series = points_series()
+    for (callsign, band_id, mode), timestamp in first_times.items():
+        band_mode_qsos[band_id][mode] += 1
+        series.add(timestamp, mode, constants.Modes.SIMPLE_MODE_POINTS[mode])
+    return make_score(band_mode_qsos, logged, series)
+
+
+def compare(cursor):
+    """
+    score qso_log one QSO at a time with a ScoreEngine, and return the names of the Score fields
+    that differ from compute_score.
+    """
+    engine = ScoreEngine()
+    engine.load(cursor)
+    streamed = engine.score()
+    computed = compute_score(cursor)
+    return [field for field in Score._fields if getattr(streamed, field) != getattr(computed, field)]
@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+"""
+n1mm_view sectionmap
+the Sections Worked map, drawn from layers cached once per output size. the ocean, lakes, land and coastlines
+never change, so they are drawn once and kept as a raster. the section shapes are read from the shape store,
+see shapestore.py, as matplotlib paths, a collection for each shape; when a section's count moves to another
+color, only its collections are recolored, then the sections are drawn over the raster, and that is kept too.
+each refresh then only restores the sections raster and draws the night shade, the QTH marker and the text over it.
+the night shade only moves every NIGHT_SHADE_MINUTES, so it is kept for each of those, see NightShadeCache.
+RasterSectionMap, for MAP_ENGINE = raster, keeps which section each pixel is in instead, so a recolor is one
+NumPy lookup of every section pixel's color, and the night shade is worked out per pixel.
+used by graphics.draw_map.
+"""
+
+import bisect
+import calendar
+import datetime
+import logging
+import threading
+
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import cartopy.feature.nightshade as nightshade
+import matplotlib
+import matplotlib.backends.backend_agg as agg
+import matplotlib.cm
+import matplotlib.collections
+import matplotlib.colors
+import matplotlib.pyplot as plt
+import numpy
+
+from config import Config
+import shapestore
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+config = Config()
+
+EXTENT = (-168, -52, 10, 60)
+# a section with more QSOs than RANGES[i - 1], up to RANGES[i], is drawn in PALETTE[i]; none is black
+RANGES = (0, 1, 2, 10, 20, 50, 100)
+PALETTE = matplotlib.cm.viridis([i / (len(RANGES) + 1) for i in range(len(RANGES) + 1)])
+PALETTE[0] = matplotlib.colors.to_rgba('k')
+# masks of a pixel's RGBA bytes read as one uint32: the color bits left after halving them, and the alpha
+HALF_RGB = numpy.array((127, 127, 127, 0), dtype=numpy.uint8).view(numpy.uint32)[0]
+ALPHA = numpy.array((0, 0, 0, 255), dtype=numpy.uint8).view(numpy.uint32)[0]
+
+
+class NightShadeCache:
+    """
+    the night shade of a map for each NIGHT_SHADE_MINUTES, made by make(date) for the middle of those minutes.
+    getting one starts making the next on a background thread, so it is ready when its minutes come.
+    """
+
+    def __init__(self, make):
+        self.make = make
+        self.seconds = config.NIGHT_SHADE_MINUTES * 60
+        self.shades = {}  # start of the minutes: night shade
+        self.lock = threading.Lock()
+        self.thread = None
+        self.thread_start = None  # the start of the minutes the thread makes the shade for
+
+    def make_shade(self, start):
+        shade = self.make(datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=start + self.seconds // 2))
+        with self.lock:
+            self.shades[start] = shade
+        return shade
+
+    def get(self, date):
+        """
+        the night shade at date.
+        """
+        start = calendar.timegm(date.timetuple()) // self.seconds * self.seconds
+        if self.thread is not None and self.thread_start == start:
+            self.thread.join()
+        with self.lock:
+            self.shades = {key: shade for key, shade in self.shades.items() if key >= start}
+            shade = self.shades.get(start)
+        if shade is None:
+            shade = self.make_shade(start)
+        following = start + self.seconds
+        if following not in self.shades and (self.thread is None or not self.thread.is_alive()):
+            self.thread = threading.Thread(target=self.make_shade, args=(following,), name='night_shade', daemon=True)
+            self.thread_start = following
+            self.thread.start()
+        return shade
+
+
+def solar_position(date):
+    """
+    the (longitude, latitude) in degrees where the sun is overhead at date, in UTC. this is the algorithm
+    cartopy's Nightshade uses, from Vallado, Fundamentals of Astrodynamics and Applications, algorithm 29.
+    """
+    seconds = calendar.timegm(date.timetuple()) + date.microsecond / 1e6
+    centuries = (seconds / 86400 + 2440587.5 - 2451545.0) / 36525  # Julian centuries since J2000
+    mean_longitude = (280.460 + 36000.771 * centuries) % 360
+    anomaly = numpy.radians((357.5277233 + 35999.05034 * centuries) % 360)
+    ecliptic_longitude = numpy.radians(mean_longitude + 1.914666471 * numpy.sin(anomaly) +
+                                       0.019994643 * numpy.sin(2 * anomaly))
+    obliquity = numpy.radians(23.439291 - 0.0130042 * centuries)
+    declination = numpy.arcsin(numpy.sin(obliquity) * numpy.sin(ecliptic_longitude))
+    right_ascension = numpy.degrees(numpy.arctan2(numpy.cos(obliquity) * numpy.sin(ecliptic_longitude),
+                                                  numpy.cos(ecliptic_longitude)))
+    sidereal_time = ((67310.54841 + (876600 * 3600 + 8640184.812866) * centuries + 0.093104 * centuries ** 2 -
+                      6.2e-6 * centuries ** 3) % 86400) / 240  # Greenwich mean sidereal time in degrees
+    return (right_ascension - sidereal_time + 180) % 360 - 180, numpy.degrees(declination)
+
+
+def color_index(qsos):
+    """
+    the index in PALETTE of a section with qsos QSOs.
+    """
+    return bisect.bisect_left(RANGES, qsos)
+
+
+class SectionMap:
+    """
+    the Sections Worked map for one output size, drawn with the shapes at a level of detail from the shape store,
+    by default the simplest one that looks the same at this size.
+    """
+
+    def __init__(self, size, level=None):
+        logging.debug('building the section map for %s', size)
+        self.size = size
+        self.fig = plt.Figure(figsize=(size[0] / 100.0, size[1] / 100.0), dpi=100, facecolor='black')
+        projection = ccrs.PlateCarree()
+        self.ax = ax = self.fig.add_axes([0, 0, 1, 1], projection=projection)
+        ax.set_extent(EXTENT, ccrs.Geodetic())
+        ax.add_feature(cfeature.OCEAN, color='#000080')
+        ax.add_feature(cfeature.LAKES, color='#000080')
+        ax.add_feature(cfeature.LAND, color='#113311')
+        ax.coastlines('50m')
+        self.canvas = agg.FigureCanvasAgg(self.fig)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        # the width of a pixel in degrees, PlateCarree is as wide as it is high
+        (x0, _), (x1, _) = ax.transData.inverted().transform([(0, 0), (1, 0)])
+        self.pixel_degrees = abs(x1 - x0)
+        self.level = shapestore.level_for(self.pixel_degrees) if level is None else level
+        logging.debug('drawing the sections at level of detail %d', self.level)
+
+        # the layers drawn over the background, in the order and zorder the map always drew them.
+        # one collection per shape draws the shared edges the way one feature per shape did.
+        self.sections = {}
+        for section_name, paths in shapestore.section_paths(self.level).items():
+            collections = self.sections[section_name] = []
+            for path in paths:
+                collection = matplotlib.collections.PathCollection(
+                    [path], facecolors=PALETTE[0], edgecolors='w', linewidths=0.7, transform=ax.transData,
+                    zorder=1.5, animated=True)
+                ax.add_collection(collection, autolim=False)
+                collection.set_clip_path(ax.patch)
+                collections.append(collection)
+        self.qth_marker, = ax.plot(config.QTH_LONGITUDE, config.QTH_LATITUDE, '.', color='r', animated=True)
+        self.title = ax.annotate('Sections Worked', xy=(0.5, 1), xycoords='axes fraction', ha='center', va='top',
+                                 color='white', size=48, weight='bold', animated=True)
+        self.timestamp = ax.text(0.83, 0, '', transform=ax.transAxes, style='italic', size=14, color='white',
+                                 animated=True)
+        self.shade = matplotlib.collections.PathCollection([], facecolors='k', edgecolors='none', alpha=0.5,
+                                                           transform=ax.transData, animated=True)
+        ax.add_collection(self.shade, autolim=False)
+        self.shade.set_clip_path(ax.patch)
+        self.night_shades = NightShadeCache(self.night_path)
+        self.colors = None
+        self.sections_layer = None
+
+    def recolor(self, qsos_by_section):
+        """
+        color the sections by their QSOs, and redraw the sections layer if any changed color.
+        """
+        colors = {section_name: color_index(qsos_by_section.get(section_name, 0))
+                  for section_name in self.sections}
+        if colors == self.colors:
+            return
+        for section_name, collections in self.sections.items():
+            if self.colors is None or colors[section_name] != self.colors[section_name]:
+                for collection in collections:
+                    collection.set_facecolor(PALETTE[colors[section_name]])
+        self.colors = colors
+        self.canvas.restore_region(self.background)
+        for collections in self.sections.values():
+            for collection in collections:
+                self.ax.draw_artist(collection)
+        self.sections_layer = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def night_path(self, date):
+        """
+        the night at date as a path on the map, for the night shade collection.
+        """
+        night = nightshade.Nightshade(date)
+        geometry, = night.geometries()
+        return shapestore.shapely_to_path(self.ax.projection.project_geometry(geometry, night.crs))
+
+    def draw_sections(self, date):
+        """
+        restore the sections layer and shade the night at date over it.
+        """
+        self.canvas.restore_region(self.sections_layer)
+        self.shade.set_paths([self.night_shades.get(date)])
+        self.ax.draw_artist(self.shade)
+
+    def render(self, qsos_by_section, image_format):
+        """
+        draw the map, returns the image data in image_format and its size.
+        """
+        self.recolor(qsos_by_section)
+        date = datetime.datetime.utcnow()  # this might have some timezone problems?
+        self.draw_sections(date)
+        self.ax.draw_artist(self.qth_marker)
+        self.ax.draw_artist(self.ax.spines['geo'])
+        self.timestamp.set_text(date.strftime('%d %b %Y %H:%M %Zz'))
+        self.ax.draw_artist(self.title)
+        self.ax.draw_artist(self.timestamp)
+
+        renderer = self.canvas.get_renderer()
+        if image_format == 'ARGB':
+            raw_data = renderer.tostring_argb()
+        else:
+            raw_data = renderer.tostring_rgb()
+        return raw_data, self.canvas.get_width_height()
+
+
+class RasterSectionMap(SectionMap):
+    """
+    the Sections Worked map for one output size, recolored with NumPy instead of drawn by matplotlib.
+    the section collections are drawn once more into the renderer's pixels: filled with their section
+    number and no edge, to label each pixel with the section drawn over it, then in black with their
+    white edges, for how much of each pixel's color is edge once the sections after it are drawn over.
+    a recolor is then one lookup of each labelled pixel's color, and the night shade is worked out per
+    pixel from the sun's position.
+    """
+
+    def __init__(self, size, level=None):
+        super().__init__(size, level)
+        pixels = numpy.asarray(self.canvas.buffer_rgba())  # the renderer's pixels, top row first
+        self.canvas.restore_region(self.background)
+        self.background_pixels = pixels.copy()
+
+        pixels[:] = 0
+        for number, collections in enumerate(self.sections.values(), 1):
+            for collection in collections:
+                collection.set(facecolor=(number % 256 / 255, number // 256 / 255, 0, 1), edgecolor='none',
+                               antialiased=False)
+                self.ax.draw_artist(collection)
+        labels = pixels[..., 0].astype(numpy.intp) + pixels[..., 1].astype(numpy.intp) * 256
+        self.section_pixels = numpy.flatnonzero(labels)
+        self.section_labels = labels.ravel()[self.section_pixels]
+
+        pixels[:] = (0, 0, 0, 255)
+        for collections in self.sections.values():
+            for collection in collections:
+                collection.set(facecolor='k', edgecolor='w', antialiased=True)
+                self.ax.draw_artist(collection)
+        coverage = pixels[..., 0].ravel()
+        self.edge_pixels = numpy.flatnonzero(coverage)
+        self.edge_coverage = coverage[self.edge_pixels, numpy.newaxis] / 255.0
+
+        for collections in self.sections.values():
+            for collection in collections:
+                collection.set(facecolor=PALETTE[0], edgecolor='w')
+        self.section_colors = numpy.rint(PALETTE * 255).astype(numpy.uint8)
+
+        # longitude of each column and latitude of each row of the map's pixels, for the night shade
+        height, width = pixels.shape[:2]
+        x0, y0, x1, y1 = self.ax.bbox.extents
+        columns = numpy.flatnonzero((numpy.arange(width) + 0.5 >= x0) & (numpy.arange(width) + 0.5 <= x1))
+        rows = numpy.flatnonzero((height - numpy.arange(height) - 0.5 >= y0) &
+                                 (height - numpy.arange(height) - 0.5 <= y1))
+        self.map_area = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+        inverse = self.ax.transData.inverted()
+        lons = inverse.transform(numpy.column_stack((columns + 0.5, numpy.full(len(columns), y0))))[:, 0]
+        lats = inverse.transform(numpy.column_stack((numpy.full(len(rows), x0), height - rows - 0.5)))[:, 1]
+        self.lons = numpy.radians(lons)
+        self.sin_lats = numpy.sin(numpy.radians(lats))[:, numpy.newaxis]
+        self.cos_lats = numpy.cos(numpy.radians(lats))[:, numpy.newaxis]
+        self.night_shades = NightShadeCache(self.night_mask)
+
+    def recolor(self, qsos_by_section):
+        """
+        color the sections by their QSOs, and remake the sections layer if any changed color.
+        """
+        colors = {section_name: color_index(qsos_by_section.get(section_name, 0))
+                  for section_name in self.sections}
+        if colors == self.colors:
+            return
+        self.colors = colors
+        lookup = self.section_colors[[0] + list(colors.values())]
+        layer = self.background_pixels.copy()
+        flat = layer.reshape(-1, 4)
+        flat[self.section_pixels] = lookup[self.section_labels]
+        edges = flat[self.edge_pixels]
+        flat[self.edge_pixels] = numpy.rint(edges + (255 - edges) * self.edge_coverage)
+        self.sections_layer = layer
+
+    def night_mask(self, date):
+        """
+        True for the pixels of the map where the sun is set at date, allowing for refraction the way
+        cartopy's Nightshade does.
+        """
+        sun_lon, sun_lat = numpy.radians(solar_position(date))
+        # the sun is set where sin(lat) sin(sun_lat) + cos(lat) cos(sun_lat) cos(lon - sun_lon) is below
+        # the sine of the refraction, so each row of the map is night where cos(lon - sun_lon) is below a limit
+        limits = ((numpy.sin(numpy.radians(-0.83)) - self.sin_lats * numpy.sin(sun_lat)) /
+                  (self.cos_lats * numpy.cos(sun_lat)))
+        return numpy.cos(self.lons - sun_lon) < limits
+
+    def draw_sections(self, date):
+        """
+        copy the sections layer into the renderer and halve the pixels where it is night at date.
+        """
+        pixels = numpy.asarray(self.canvas.buffer_rgba())
+        pixels[:] = self.sections_layer
+        night = self.night_shades.get(date)
+        words = pixels[self.map_area].view(numpy.uint32)[..., 0]
+        numpy.copyto(words, (words >> 1) & HALF_RGB | words & ALPHA, where=night)
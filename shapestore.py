@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+"""
+n1mm_view shapestore
+the section shapes packed into one file, shapes/sections.store, so the map reads one file with mmap instead
+of opening every section's shapefile. the store holds the vertices and path codes of every shape one after
+another, the offset of each shape's first vertex, and which shapes are each section's, with a checksum of the
+shapefiles' names, sizes and modification times. the map rebuilds the store when the shapefiles change.
+the shapes are kept at each level of detail in LEVELS, simplified so no point moves more than the level's
+tolerance, and the map draws the simplest level whose tolerance is below a fraction of a pixel, see level_for.
+run this to build the store by hand, or with --report to show the vertices and drawing time of each level:
+    python3 shapestore.py [--force] [--report [WIDTHxHEIGHT]]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import matplotlib.path
+import numpy
+
+from constants import CONTEST_SECTIONS
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+SHAPES_DIRECTORY = 'shapes'
+STORE_FILENAME = os.path.join(SHAPES_DIRECTORY, 'sections.store')
+SHAPEFILE_EXTENSIONS = ('.shp', '.shx', '.dbf')
+# the store starts with MAGIC and the length of the JSON header after it, then the arrays, each ALIGNMENT aligned
+MAGIC = b'N1MMSHP1'
+ALIGNMENT = 16
+# simplification tolerances in degrees, level 0 is the shapes as they are in the shapefiles
+LEVELS = (0.0, 0.002, 0.005, 0.01, 0.02, 0.05)
+# the largest tolerance drawn, as a fraction of the size of a pixel
+PIXEL_TOLERANCE = 0.1
+
+
+def shapefile_names():
+    for section_name in CONTEST_SECTIONS.keys():
+        for extension in SHAPEFILE_EXTENSIONS:
+            yield os.path.join(SHAPES_DIRECTORY, section_name + extension)
+
+
+def checksum():
+    """
+    a checksum of the shapefiles' names, sizes and modification times, which only needs their directory entries,
+    and of the levels of detail.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'{LEVELS}\n'.encode())
+    for filename in shapefile_names():
+        try:
+            stat = os.stat(filename)
+            digest.update(f'{filename} {stat.st_size} {stat.st_mtime_ns}\n'.encode())
+        except FileNotFoundError:
+            digest.update(f'{filename} missing\n'.encode())
+    return digest.hexdigest()
+
+
+def shapely_to_path(geometry):
+    """
+    a matplotlib path of a shapely geometry.
+    """
+    try:
+        from cartopy.mpl.path import shapely_to_path as to_path
+    except ImportError:  # cartopy before 0.23
+        from cartopy.mpl.patch import geos_to_path
+        return matplotlib.path.Path.make_compound_path(*geos_to_path(geometry))
+    return to_path(geometry)
+
+
+def pack(digest):
+    """
+    read every section's shapefile and simplify it for each level, returns the store's header and arrays.
+    """
+    import cartopy.io.shapereader as shapereader
+    vertices = [[] for _ in LEVELS]
+    codes = [[] for _ in LEVELS]
+    offsets = [[0] for _ in LEVELS]
+    sections = []
+    for section_name in CONTEST_SECTIONS.keys():
+        reader = shapereader.Reader(os.path.join(SHAPES_DIRECTORY, section_name + '.shp'))
+        first = len(offsets[0]) - 1
+        for geometry in reader.geometries():
+            for level, tolerance in enumerate(LEVELS):
+                path = shapely_to_path(geometry.simplify(tolerance, preserve_topology=True) if tolerance else geometry)
+                vertices[level].append(path.vertices.reshape(-1, 2))
+                if path.codes is None:
+                    path_codes = numpy.full(len(path.vertices), matplotlib.path.Path.LINETO, dtype=numpy.uint8)
+                    path_codes[:1] = matplotlib.path.Path.MOVETO
+                    codes[level].append(path_codes)
+                else:
+                    codes[level].append(path.codes)
+                offsets[level].append(offsets[level][-1] + len(path.vertices))
+        sections.append((section_name, first, len(offsets[0]) - 1 - first))
+    arrays = {}
+    for level in range(len(LEVELS)):
+        arrays[f'vertices{level}'] = numpy.concatenate(vertices[level]).astype(numpy.float64)
+        arrays[f'codes{level}'] = numpy.concatenate(codes[level]).astype(matplotlib.path.Path.code_type)
+        arrays[f'offsets{level}'] = numpy.array(offsets[level], dtype=numpy.int64)
+    return {'checksum': digest, 'levels': LEVELS, 'sections': sections}, arrays
+
+
+def write_store(filename, header, arrays):
+    """
+    write the store to a new file and rename it over the old one, so a reader never sees half a store.
+    """
+    data_offset = 0
+    header = dict(header, arrays={})
+    for name, array in arrays.items():
+        header['arrays'][name] = (array.dtype.str, array.shape, data_offset)
+        data_offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 4 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    # a file of its own, so processes building the store at the same time do not write into each other's
+    descriptor, temporary_filename = tempfile.mkstemp(prefix=os.path.basename(filename) + '.', suffix='.tmp',
+                                                      dir=os.path.dirname(filename) or '.')
+    try:
+        with os.fdopen(descriptor, 'wb') as store:
+            store.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+            for name, array in arrays.items():
+                store.seek(start + header['arrays'][name][2])
+                store.write(numpy.ascontiguousarray(array).tobytes())
+            store.truncate(start + data_offset)
+        os.chmod(temporary_filename, 0o644)  # mkstemp makes it readable by its owner only
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        os.remove(temporary_filename)
+        raise
+
+
+def read_store(filename):
+    """
+    map the store into memory, returns its header and read-only arrays backed by the mapping.
+    """
+    with open(filename, 'rb') as store:
+        mapping = mmap.mmap(store.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapping[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{filename} is not a section shape store')
+    header_length, = struct.unpack_from('<I', mapping, len(MAGIC))
+    header_start = len(MAGIC) + 4
+    header = json.loads(mapping[header_start:header_start + header_length])
+    start = -(-(header_start + header_length) // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, (dtype, shape, offset) in header['arrays'].items():
+        count = int(numpy.prod(shape))
+        arrays[name] = numpy.frombuffer(mapping, dtype=dtype, count=count, offset=start + offset).reshape(shape)
+    return header, arrays
+
+
+def load(filename=STORE_FILENAME, force=False):
+    """
+    the store's header and arrays, rebuilt first if it is missing, or force is set, or the shapefiles changed.
+    if the store cannot be written, the shapes are used from memory.
+    """
+    digest = checksum()
+    header = None
+    if not force:
+        try:
+            header, arrays = read_store(filename)
+        except (OSError, ValueError) as e:
+            logging.info(f'cannot read {filename}: {e}')
+    if header is not None and header['checksum'] == digest:
+        return header, arrays
+    logging.info(f'building {filename} from the shapefiles in {SHAPES_DIRECTORY}')
+    header, arrays = pack(digest)
+    try:
+        write_store(filename, header, arrays)
+        return read_store(filename)
+    except OSError as e:
+        logging.warning(f'cannot write {filename}: {e}')
+        return header, arrays
+
+
+def level_for(pixel_degrees):
+    """
+    the simplest level of detail that moves no point more than PIXEL_TOLERANCE of a pixel pixel_degrees wide.
+    """
+    return max(level for level, tolerance in enumerate(LEVELS) if tolerance <= pixel_degrees * PIXEL_TOLERANCE)
+
+
+def section_paths(level=0, filename=STORE_FILENAME):
+    """
+    {section name: [path of each shape]} at a level of detail, in the order of CONTEST_SECTIONS,
+    sharing the store's arrays.
+    """
+    header, arrays = load(filename)
+    vertices, codes = arrays[f'vertices{level}'], arrays[f'codes{level}']
+    offsets = arrays[f'offsets{level}'].tolist()
+    paths = [matplotlib.path.Path(vertices[start:end], codes[start:end], readonly=True)
+             for start, end in zip(offsets, offsets[1:])]
+    return {section_name: paths[first:first + count] for section_name, first, count in header['sections']}
+
+
+def report(size, repeat=5):
+    """
+    draw the sections at size with each level of detail, and log its vertices, the time to draw them,
+    and the pixels that differ from level 0 by more than a little.
+    """
+    import sectionmap
+    header, arrays = load()
+    full_detail = None
+    for level, tolerance in enumerate(header['levels']):
+        section_map = sectionmap.SectionMap(size, level)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            section_map.colors = None
+            section_map.recolor({})
+        seconds = (time.perf_counter() - start) / repeat
+        pixels = numpy.asarray(section_map.canvas.buffer_rgba()).astype(numpy.int16)
+        if full_detail is None:
+            full_detail = pixels
+        differing = int((numpy.abs(pixels - full_detail).max(axis=2) > 8).sum())
+        logging.info(f'level {level}: tolerance {tolerance} degrees, {len(arrays[f"vertices{level}"])} vertices, '
+                     f'{seconds * 1000:.1f} ms to draw, {differing} pixels differ from level 0')
+    logging.info(f'the map draws level {level_for(section_map.pixel_degrees)} at {size[0]}x{size[1]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pack the section shapefiles into one file for the map')
+    parser.add_argument('--force', action='store_true', help='rebuild the store even if the shapefiles are unchanged')
+    parser.add_argument('--report', nargs='?', const='1280x1024', metavar='WIDTHxHEIGHT',
+                        help='show the vertices and drawing time of each level of detail at this image size')
+    args = parser.parse_args()
+    header, arrays = load(force=args.force)
+    logging.info(f'{STORE_FILENAME}: {len(header["sections"])} sections, {len(arrays["offsets0"]) - 1} shapes, '
+                 f'{len(header["levels"])} levels of detail, {sum(array.nbytes for array in arrays.values())} bytes')
+    if args.report:
+        report(tuple(int(pixels) for pixels in args.report.lower().split('x')))
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+n1mm_view timeseries
+QSO counts by time bucket and band for the QSOs per hour by band chart.
+the buckets are RATE_BUCKET_MINUTES long and cover the event, EVENT_START_TIME to EVENT_END_TIME; the counts
+live in one preallocated array, so adding a QSO is one increment, and QSOs outside the event are left out.
+"""
+
+import array
+import calendar
+
+import constants
+from config import Config
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2025 Jeffrey B. Otterson and n1mm_view maintainers'
+__license__ = 'Simplified BSD'
+
+config = Config()
+
+
+class BucketSeries:
+    """
+    QSO counts for every bucket from start to end by band, bucket-major in counts.
+    used is the number of buckets from start up to the last one with QSOs, the part of the series plotted.
+    """
+
+    def __init__(self, start, end, bucket_seconds, bands=constants.Bands.count()):
+        self.start = start
+        self.bucket_seconds = bucket_seconds
+        self.bands = bands
+        self.buckets = max(1, -(-(end - start) // bucket_seconds))
+        self.counts = array.array('q', bytes(8 * self.buckets * bands))
+        self.used = 0
+
+    def bucket(self, timestamp):
+        """
+        the bucket index of timestamp, None if it is outside the event.
+        """
+        if timestamp < self.start:
+            return None
+        index = (timestamp - self.start) // self.bucket_seconds
+        return index if index < self.buckets else None
+
+    def add(self, timestamp, band_id, count=1):
+        """
+        add count QSOs, -1 for a QSO removed. returns False if timestamp is outside the event.
+        """
+        index = self.bucket(timestamp)
+        if index is None:
+            return False
+        self.counts[index * self.bands + band_id] += count
+        if count > 0 and index >= self.used:
+            self.used = index + 1
+        elif count < 0 and index == self.used - 1:
+            # the last buckets with QSOs may be empty now
+            while self.used > 0 and not any(self.counts[(self.used - 1) * self.bands:self.used * self.bands]):
+                self.used -= 1
+        return True
+
+    def copy(self):
+        series = BucketSeries.__new__(BucketSeries)
+        series.start, series.bucket_seconds, series.bands = self.start, self.bucket_seconds, self.bands
+        series.buckets, series.counts, series.used = self.buckets, array.array('q', self.counts), self.used
+        return series
+
+    def end(self):
+        return self.start + self.buckets * self.bucket_seconds
+
+    def rates(self):
+        """
+        QSOs per hour for bands 1 and up, one list per band over the used buckets, as the chart stacks them.
+        """
+        per_hour = 3600 / self.bucket_seconds
+        stop = self.used * self.bands
+        return [[count * per_hour for count in self.counts[band_id:stop:self.bands]]
+                for band_id in range(1, self.bands)]
+
+    def __len__(self):
+        return self.used
+
+    def __eq__(self, other):
+        return (isinstance(other, BucketSeries) and
+                (self.start, self.bucket_seconds, self.bands, self.used, self.counts) ==
+                (other.start, other.bucket_seconds, other.bands, other.used, other.counts))
+
+
+def event_series():
+    """
+    an empty BucketSeries for the event in n1mm_view.ini.
+    """
+    return BucketSeries(calendar.timegm(config.EVENT_START_TIME.timetuple()),
+                        calendar.timegm(config.EVENT_END_TIME.timetuple()),
+                        config.RATE_BUCKET_MINUTES * 60)